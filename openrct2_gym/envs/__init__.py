@@ -1 +1,2 @@
 from .openrct2_env import OpenRCT2Env
+from .vector_env import SimVectorEnv
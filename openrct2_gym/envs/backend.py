@@ -0,0 +1,82 @@
+from abc import ABC, abstractmethod
+from .logs import get_logger
+
+
+class BackendError(Exception):
+    pass
+
+
+class GameBackend(ABC):
+    """The operations OpenRCT2Env and TrackBuilder need from the game.
+
+    UIController implements them by clicking in the game window, SimController with
+    an offline model of the track and SocketBackend by sending them to a game plugin.
+    """
+
+    station_length = 6
+    log = get_logger('backend')  # The environment gives every backend a logger of its own
+
+    @abstractmethod
+    def add_track_piece(self, piece_type):
+        """Build `piece_type` at the end of the track, returns True if it was placed."""
+
+    @abstractmethod
+    def remove_piece(self):
+        """Remove the last track piece, returns True if it was removed."""
+
+    @abstractmethod
+    def start_new_rollercoaster(self):
+        """Place a new rollercoaster and build its station."""
+
+    @abstractmethod
+    def demolish_rollercoaster(self):
+        """Demolish the current rollercoaster."""
+
+    @abstractmethod
+    def is_loop_completed(self):
+        """Return True if the track is a complete circuit."""
+
+    @abstractmethod
+    def run_ride_evaluation(self, timeout=None, track_length=None):
+        """Test the ride and return (excitement, intensity, nausea), None values on failure.
+
+        Without a timeout backends choose one, using `track_length` when it is given.
+        """
+
+    def add_track_pieces(self, piece_types):
+        # Place pieces in order until one fails, returns how many were placed
+        for count, piece_type in enumerate(piece_types):
+            if not self.add_track_piece(piece_type):
+                return count
+        return len(piece_types)
+
+    def remove_pieces(self, count):
+        # Remove the last `count` pieces, returns how many were removed
+        for removed in range(count):
+            if not self.remove_piece():
+                return removed
+        return count
+
+    def load_track_design(self, piece_types):
+        # Replace the coaster with a new station followed by `piece_types`, returns how many were placed
+        self.demolish_rollercoaster()
+        self.start_new_rollercoaster()
+        return self.add_track_pieces(piece_types)
+
+    def _place_entrance_exit(self):
+        # Only needed by backends where the ride can't be tested without them
+        pass
+
+    def reconnect(self):
+        # Called after the game was restarted, backends drop their connections to the old one
+        pass
+
+    def instrument(self, recorder):
+        # Time the game operations with a LatencyRecorder, backends add their own parts
+        recorder.instrument(self, {
+            'add_track_piece': 'add_track_piece',
+            'remove_piece': 'remove_piece',
+            'start_new_rollercoaster': 'start_new_rollercoaster',
+            'demolish_rollercoaster': 'demolish_rollercoaster',
+            'run_ride_evaluation': 'run_ride_evaluation',
+        })
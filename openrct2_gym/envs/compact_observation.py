@@ -0,0 +1,84 @@
+"""Compact observations: everything an OpenRCT2Env observation holds in one flat uint8 array.
+
+With `compact_observations=True` the environments return this array instead of the dict.
+In a rollout buffer it takes about a quarter of the memory of the dict, whose pieces are
+int32 and whose discrete values are int64, and it is a single array to copy to the model.
+For a track of at most N pieces (N <= 255) the bytes are:
+
+    [0, N)          track_pieces, one action per byte, zero after the last piece
+    N + 0 .. N + 5  current_position x, y, z, little-endian int16 each
+    N + 6           current_direction
+    N + 7 .. N + 8  distance_to_start, little-endian uint16 in 1/16 units
+    N + 9           track_length
+    N + 10          last_piece_type
+    N + 11          pieces_to_close, only with a distance field (distance_field.py)
+
+`decode_observation()` turns it back into the dict, the feature extractor in
+train_rl_agent.py decodes batches of them on the model's device.
+"""
+import struct
+import gymnasium as gym
+import numpy as np
+
+POSITION = 0  # Offsets after the track pieces
+DIRECTION = 6
+DISTANCE = 7
+TRACK_LENGTH = 9
+LAST_PIECE_TYPE = 10
+PIECES_TO_CLOSE = 11
+EXTRA_BYTES = 11  # Without pieces_to_close
+DISTANCE_SCALE = 16  # Steps of the stored distance per unit
+MAX_DISTANCE = 0xffff
+EXTRA = struct.Struct('<3hBHBB')  # The bytes after the track pieces
+
+
+def compact_observation_space(max_track_length, pieces_to_close=False):
+    if max_track_length > 255:
+        raise ValueError(f"A track of {max_track_length} pieces doesn't fit the one byte track length")
+    size = max_track_length + EXTRA_BYTES + (1 if pieces_to_close else 0)
+    return gym.spaces.Box(low=0, high=255, shape=(size,), dtype=np.uint8)
+
+
+def encode_observation(out, max_track_length, position, direction, distance, track_length, last_piece_type,
+                       pieces_to_close=None):
+    # Write everything after the track pieces, an OpenRCT2Env keeps the pieces in `out` already
+    distance = min(round(float(distance) * DISTANCE_SCALE), MAX_DISTANCE)
+    EXTRA.pack_into(out, max_track_length, *position, direction, distance, track_length, last_piece_type)
+    if pieces_to_close is not None:
+        out[max_track_length + PIECES_TO_CLOSE] = pieces_to_close
+    return out
+
+
+def encode_observations(out, max_track_length, track_pieces, position, direction, distance, track_length,
+                        last_piece_type, pieces_to_close=None):
+    # Write a batch of observations into the rows of `out`
+    n = max_track_length
+    out[:, :n] = track_pieces
+    out[:, n + POSITION:n + DIRECTION] = position.astype('<i2').view(np.uint8)
+    out[:, n + DIRECTION] = direction
+    distance = np.minimum(np.rint(distance * DISTANCE_SCALE), MAX_DISTANCE)
+    out[:, n + DISTANCE:n + TRACK_LENGTH] = distance.astype('<u2')[:, None].view(np.uint8)
+    out[:, n + TRACK_LENGTH] = track_length
+    out[:, n + LAST_PIECE_TYPE] = last_piece_type
+    if pieces_to_close is not None:
+        out[:, n + PIECES_TO_CLOSE] = pieces_to_close
+    return out
+
+
+def decode_observation(observation, pieces_to_close=False):
+    # The dict observation of one compact observation, or of a batch of them
+    observation = np.asarray(observation, dtype=np.uint8)
+    n = observation.shape[-1] - EXTRA_BYTES - (1 if pieces_to_close else 0)
+    extra = np.ascontiguousarray(observation[..., n:])
+    distance = extra[..., DISTANCE:TRACK_LENGTH].view('<u2').astype(np.float32) / DISTANCE_SCALE
+    decoded = {
+        'track_pieces': observation[..., :n].astype(np.int32),
+        'current_position': extra[..., POSITION:DIRECTION].view('<i2').astype(np.int32),
+        'current_direction': extra[..., DIRECTION].astype(np.int64),
+        'distance_to_start': distance,
+        'track_length': extra[..., TRACK_LENGTH].astype(np.int64),
+        'last_piece_type': extra[..., LAST_PIECE_TYPE].astype(np.int64),
+    }
+    if pieces_to_close:
+        decoded['pieces_to_close'] = extra[..., PIECES_TO_CLOSE:].astype(np.int32)
+    return decoded
@@ -0,0 +1,90 @@
+"""The fewest track pieces that close the loop, from every position, direction and slope.
+
+Where the track can go next only depends on where its end is relative to the end of the
+station, which way it faces and its slope. So the number of pieces needed to get back is
+computed once for all of them, by a breadth-first search backwards from the closed loop
+over the moves of TRACK_PIECES and the slope rules of the simulation. Collisions with the
+track itself and banking are ignored, which makes it a lower bound: a track that needs more pieces
+than it has steps left can't be closed anymore.
+
+The table covers `extent` tiles around the station in both directions and `height` levels
+above it. It is stored as a .npy file that is built when it is missing and memory-mapped,
+so all processes share one copy and a lookup is an index into it. Delete the file after
+changing TRACK_PIECES.
+"""
+import os
+import numpy as np
+from .sim_controller import piece_fits_after, piece_slope
+from .track_builder import TRACK_PIECES, move
+
+UNKNOWN = 255  # Outside the table or more pieces than fit in a byte
+
+# Slope at the end of every piece
+ACTION_SLOPES = {action: piece_slope(piece[0]) for action, piece in TRACK_PIECES.items()}
+SLOPES = range(-2, 3)
+
+
+def _shifted(length, delta):
+    # Slices of the entries i and i + delta that are both inside an axis of `length`
+    return slice(max(0, -delta), length - max(0, delta)), slice(max(0, delta), length + min(0, delta))
+
+
+def build_table(extent=64, height=32):
+    """Return the table of pieces to close, indexed [direction, slope + 2, dx + extent, dy + extent, dz]."""
+    shape = (4, len(SLOPES), 2 * extent + 1, 2 * extent + 1, height + 1)
+    table = np.full(shape, UNKNOWN, dtype=np.uint8)
+    frontier = np.zeros(shape, dtype=bool)
+    frontier[0, 2, extent, extent, 0] = True  # Facing north on level track at the end of the station
+    table[frontier] = 0
+
+    # Distinct (direction, slope) -> (new direction, new slope, position delta) moves, pieces
+    # that only differ in their roll move the same way
+    moves = set()
+    for action in TRACK_PIECES:
+        for direction in range(4):
+            delta, new_direction = move(action, (0, 0, 0), direction)
+            for slope in SLOPES:
+                if any(piece_fits_after(action, slope, roll) for roll in (-1, 0, 1)):
+                    moves.add((direction, slope, new_direction, ACTION_SLOPES[action], tuple(delta)))
+
+    for pieces in range(1, UNKNOWN):
+        # States with a move that ends in a state reached with one piece less
+        reached = np.zeros(shape, dtype=bool)
+        for direction, slope, new_direction, new_slope, delta in moves:
+            source, target = zip(*(_shifted(length, d) for length, d in zip(shape[2:], delta)))
+            reached[direction, slope + 2][source] |= frontier[new_direction, new_slope + 2][target]
+        reached &= table == UNKNOWN
+        if not reached.any():
+            break
+        table[reached] = pieces
+        frontier = reached
+    return table
+
+
+class DistanceField:
+    def __init__(self, path, extent=64, height=32):
+        self.path = path
+        self.extent = extent
+        self.height = height
+        shape = (4, len(SLOPES), 2 * extent + 1, 2 * extent + 1, height + 1)
+        if not os.path.exists(path) or np.load(path, mmap_mode='r').shape != shape:
+            # Written to a temporary file first, processes building it at the same time don't see half of it
+            temporary = f"{path}.{os.getpid()}.tmp"
+            with open(temporary, 'wb') as f:
+                np.save(f, build_table(extent, height))
+            os.replace(temporary, path)
+        self.table = np.load(path, mmap_mode='r')
+
+    def lookup(self, dx, dy, dz, direction, slope):
+        # Pieces to close from the end of the station + (dx, dy, dz), UNKNOWN outside the table
+        if abs(dx) > self.extent or abs(dy) > self.extent or not 0 <= dz <= self.height:
+            return UNKNOWN
+        return int(self.table[direction, slope + 2, dx + self.extent, dy + self.extent, dz])
+
+    def lookup_batch(self, relative_positions, directions, slopes):
+        # The same for arrays of positions (n, 3), directions and slopes
+        dx, dy, dz = relative_positions.T
+        inside = (np.abs(dx) <= self.extent) & (np.abs(dy) <= self.extent) & (dz >= 0) & (dz <= self.height)
+        pieces = self.table[directions, slopes + 2, np.clip(dx + self.extent, 0, 2 * self.extent),
+                            np.clip(dy + self.extent, 0, 2 * self.extent), np.clip(dz, 0, self.height)]
+        return np.where(inside, pieces, UNKNOWN)
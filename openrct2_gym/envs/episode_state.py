@@ -0,0 +1,56 @@
+import numpy as np
+
+
+class EpisodeState:
+    """The track and builder state of one OpenRCT2Env episode.
+
+    The track pieces are kept in a buffer of the maximum track length that is zero after
+    the last piece, so adding or removing a piece is a single write and the buffer itself
+    is the observation. Positions are tuples, so the history and snapshots can share them
+    without copies. Every episode gets a new state, observations of the previous one stay
+    as they were.
+    """
+
+    __slots__ = ('pieces', 'length', 'position', 'direction', 'steps', 'loop_completed', 'last_piece_type',
+                 'chain_lift_count', 'last_action', 'position_array', 'distance', 'compact', 'pieces_to_close',
+                 'closure_steps')
+
+    def __init__(self, max_track_length, station_length=0, position=(500, 500, 0), compact_size=0):
+        # A compact observation starts with the track pieces, so they are kept in it directly
+        self.compact = np.zeros(compact_size, dtype=np.uint8) if compact_size else None
+        self.pieces = self.compact[:max_track_length] if compact_size else np.zeros(max_track_length, dtype=np.int32)
+        self.length = station_length  # The station pieces are straight pieces, action 0
+        self.position = position
+        self.direction = 0
+        self.steps = 0
+        self.loop_completed = False
+        self.last_piece_type = 0
+        self.chain_lift_count = 0
+        self.last_action = None
+        # Observation arrays, updated in place
+        self.position_array = np.array(position, dtype=np.int32)
+        self.distance = np.zeros(1, dtype=np.float32)
+        # With a distance field, the pieces needed to close the loop from here and a stack of the
+        # fewest steps to close it, removals included, for the station and every piece after it
+        self.pieces_to_close = np.zeros(1, dtype=np.int32)
+        self.closure_steps = []
+
+    @property
+    def track_pieces(self):
+        # A view of the pieces of the track, only valid until the next change
+        return self.pieces[:self.length]
+
+    def push(self, action):
+        if self.length >= len(self.pieces):
+            raise ValueError(f"The track is already {self.length} pieces long, the most the episode holds")
+        self.pieces[self.length] = action
+        self.length += 1
+
+    def pop(self):
+        self.length -= 1
+        self.pieces[self.length] = 0
+
+    def set_pieces(self, track_pieces):
+        self.pieces[:] = 0
+        self.pieces[:len(track_pieces)] = track_pieces
+        self.length = len(track_pieces)
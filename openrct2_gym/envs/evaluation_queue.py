@@ -0,0 +1,99 @@
+"""Tests completed rides in the background so the environment never waits for a rating.
+
+Completed designs are submitted with an episode id and tested by a pool of workers,
+one thread per evaluator. An evaluator is any callable that takes the track pieces and
+returns (excitement, intensity, nausea), e.g. a separate game instance through
+`backend_evaluator` or a surrogate through `model_evaluator`. Finished ratings are
+collected with `poll()`, from the thread that owns the trajectories being relabelled.
+"""
+import logging
+import queue
+import threading
+from .logs import get_logger, log_event
+from .track_builder import TRACK_PIECES
+
+log = get_logger('evaluation_queue')
+
+
+def backend_evaluator(backend, station_length=6):
+    # Builds each design on its own game instance and runs the test there
+    def evaluate(track_pieces):
+        pieces = track_pieces[station_length:]
+        placed = backend.load_track_design([TRACK_PIECES[action][0] for action in pieces])
+        if placed < len(pieces):
+            return None, None, None
+        backend._place_entrance_exit()
+        return backend.run_ride_evaluation(track_length=len(track_pieces))
+    return evaluate
+
+
+def model_evaluator(rating_model, max_std=None):
+    # Estimates ratings with a RatingModel, without an estimate at least as certain as
+    # `max_std` (by default the model's own) there is no rating
+    max_std = rating_model.max_std if max_std is None else max_std
+
+    def evaluate(track_pieces):
+        mean, std = rating_model.predict(track_pieces)
+        if mean is None or std.max() > max_std:
+            return None, None, None
+        return tuple(float(value) for value in mean)
+    return evaluate
+
+
+class EvaluationQueue:
+    def __init__(self, evaluators):
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.next_episode_id = 0
+        self.pending = 0
+        self.workers = []
+        for evaluator in evaluators:
+            worker = threading.Thread(target=self._work, args=(evaluator,), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, track_pieces):
+        """Queue a design for testing and return its episode id."""
+        self.next_episode_id += 1
+        self.pending += 1
+        self.requests.put((self.next_episode_id, list(track_pieces)))
+        return self.next_episode_id
+
+    def _work(self, evaluator):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            episode_id, track_pieces = request
+            try:
+                excitement, intensity, nausea = evaluator(track_pieces)
+            except Exception as e:
+                log_event(log, logging.WARNING, 'evaluation_failed', episode_id=episode_id, error=str(e))
+                excitement = intensity = nausea = None
+            if excitement is None or intensity is None or nausea is None:
+                ride_rating = None
+            else:
+                ride_rating = {'excitement': excitement, 'intensity': intensity, 'nausea': nausea}
+            self.results.put((episode_id, ride_rating))
+
+    def poll(self, timeout=None):
+        """Return the (episode id, ride rating) of every finished evaluation, the rating is None if it failed.
+
+        With a timeout, wait up to that long for the first result if none are ready.
+        """
+        results = []
+        try:
+            if timeout is not None and self.pending:
+                results.append(self.results.get(timeout=timeout))
+            while True:
+                results.append(self.results.get_nowait())
+        except queue.Empty:
+            pass
+        self.pending -= len(results)
+        return results
+
+    def close(self):
+        for _ in self.workers:
+            self.requests.put(None)
+        for worker in self.workers:
+            worker.join()
@@ -0,0 +1,463 @@
+"""A simulated game screen that lets the real UIController run without an X server.
+
+FakeScreen is a small state machine over the windows UIController works with: the new
+ride windows, the track builder, the ride window with its test and demolish buttons and
+the demolish confirmation. Clicks and key presses from FakeInput drive it, the track
+itself is an offline SimController, and every change is drawn into an RGB framebuffer
+that FakeCapture grabs from. Buttons the builder can't use are drawn in the faded
+colour, failed pieces fill the error area with red, the build button turns into its
+background once the loop is complete and test results are written in a small pixel
+font, so the colour checks, waits and rating reader all run on real pixels.
+
+The ratings are a made up function of the track shape, useful to exercise the code
+but not for training. To profile the UI layer:
+
+    env = gym.make('OpenRCT2-v0', backend='fake_ui', backend_kwargs={'latency': 0.01})
+"""
+import time
+import numpy as np
+from .rating_model import track_features
+from .rating_reader import GlyphReader
+from .sim_controller import SimController, SLOPES
+
+PARK_COLOR = (60, 120, 60)
+RIDE_COLOR = (90, 90, 90)
+WINDOW_COLOR = (170, 160, 140)
+BUTTON_COLOR = (100, 100, 180)
+SELECTED_COLOR = (220, 220, 220)
+MARKER_COLOR = (240, 200, 40)
+TEXT_COLOR = (0, 0, 0)
+ERROR_COLOR = (199, 0, 0)
+
+# Window rectangles (left, top, right, bottom) and where the ride is drawn in the park
+RIDE_AREA = (420, 330, 640, 470)
+BUILDER_WINDOW = (95, 95, 280, 485)
+NEW_RIDE_WINDOW = (95, 180, 400, 400)
+DESIGN_WINDOW = (95, 120, 400, 300)
+RIDE_WINDOW = (700, 75, 1100, 300)
+CONFIRM_WINDOW = (400, 350, 600, 450)
+
+# 7 row pixel font for the rating lines, lower case letters sit on rows 2 to 4
+FONT = {
+    'E': ["###", "#..", "##.", "#..", "###", "...", "..."],
+    'I': ["###", ".#.", ".#.", ".#.", "###", "...", "..."],
+    'N': ["#..#", "##.#", "#.##", "#..#", "#..#", "....", "...."],
+    'a': ["...", "...", ".##", "#.#", ".##", "...", "..."],
+    'c': ["..", "..", "##", "#.", "##", "..", ".."],
+    'e': ["...", "...", "##.", "###", "##.", "...", "..."],
+    'g': ["...", "...", ".##", "#.#", ".##", "..#", "##."],
+    'i': ["#", ".", "#", "#", "#", ".", "."],
+    'm': [".....", ".....", "####.", "#.#.#", "#.#.#", ".....", "....."],
+    'n': ["...", "...", "##.", "#.#", "#.#", "...", "..."],
+    'r': ["..", "..", "##", "#.", "#.", "..", ".."],
+    's': ["...", "...", ".##", ".#.", "##.", "...", "..."],
+    't': ["#.", "#.", "##", "#.", "##", "..", ".."],
+    'u': ["...", "...", "#.#", "#.#", "###", "...", "..."],
+    'x': ["...", "...", "#.#", ".#.", "#.#", "...", "..."],
+    'y': ["...", "...", "#.#", "#.#", ".##", "..#", "##."],
+    ':': [".", ".", "#", ".", "#", ".", "."],
+    '.': [".", ".", ".", ".", "#", ".", "."],
+    '0': ["###", "#.#", "#.#", "#.#", "###", "...", "..."],
+    '1': ["##", ".#", ".#", ".#", ".#", "..", ".."],
+    '2': ["###", "..#", "###", "#..", "###", "...", "..."],
+    '3': ["###", "..#", ".##", "..#", "###", "...", "..."],
+    '4': ["#.#", "#.#", "###", "..#", "..#", "...", "..."],
+    '5': ["###", "#..", "###", "..#", "###", "...", "..."],
+    '6': ["###", "#..", "###", "#.#", "###", "...", "..."],
+    '7': ["###", "..#", ".#.", ".#.", ".#.", "...", "..."],
+    '8': ["###", "#.#", "###", "#.#", "###", "...", "..."],
+    '9': ["###", "#.#", "###", "..#", "###", "...", "..."],
+}
+SPACE_WIDTH = 4
+LINE_HEIGHT = 10
+
+
+def rating_lines(excitement, intensity, nausea):
+    return [f"Excitement rating: {excitement:.2f}", f"Intensity rating: {intensity:.2f}", f"Nausea rating: {nausea:.2f}"]
+
+
+def draw_text(image, lines, color=TEXT_COLOR):
+    for row, line in enumerate(lines):
+        x = 2
+        y = 2 + row * LINE_HEIGHT
+        for char in line:
+            if char == ' ':
+                x += SPACE_WIDTH - 1
+                continue
+            glyph = np.array([[pixel == '#' for pixel in glyph_row] for glyph_row in FONT[char]])
+            height, width = glyph.shape
+            image[y:y + height, x:x + width][glyph] = color
+            x += width + 1
+
+
+class FakeScreen:
+    def __init__(self, latency=0.0, test_time=0.5, size=(1280, 720), grid_size=(64, 64), max_height=32,
+                 redraw_frames=1, frame_time=1 / 60):
+        self.latency = latency  # Seconds before a change shows up in grabs
+        # A change is drawn from the top down over this many frames of frame_time seconds,
+        # like a window that takes a few frames to open
+        self.redraw_frames = redraw_frames
+        self.frame_time = frame_time
+        self.test_time = test_time  # Seconds a ride test takes at normal speed
+        self.track = SimController(grid_size, max_height)
+        self.ui = None
+        self.frame = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+        self.previous_frame = self.frame
+        self.changed_at = 0.0
+        self.clicks = 0
+        self.presses = 0
+
+        self.state = 'park'  # park, new_ride, choose_design, placing, builder, ride_window, confirm_demolish
+        self.station_pieces = 0
+        self.selection = {'direction': 'straight', 'slope': 'level', 'roll': 'noroll'}
+        self.chain = False
+        self.built = []  # Builder selection and chain lift of every placed piece
+        self.error = False
+        self.placing_entrance = False
+        self.entrance = False
+        self.exit = False
+        self.test_started = None
+        self.results_tab = False
+        self.results_shown = False
+        self.game_speed = 1
+
+    def set_layout(self, ui):
+        # Button positions, areas and colours are taken from the UIController
+        self.ui = ui
+        self.directions = {
+            ui.direction_straight: 'straight', ui.direction_left: 'left', ui.direction_left_large: 'large_left',
+            ui.direction_left_small: 'small_left', ui.direction_right: 'right',
+            ui.direction_right_large: 'large_right', ui.direction_right_small: 'small_right',
+        }
+        self.slopes = {
+            ui.slope_level: 'level', ui.slope_steep_down: 'steep_down', ui.slope_down: 'down',
+            ui.slope_up: 'up', ui.slope_steep_up: 'steep_up',
+        }
+        self.rolls = {ui.roll_left: 'leftroll', ui.roll_none: 'noroll', ui.roll_right: 'rightroll'}
+        self._render()
+
+    # Input
+
+    def click(self, coords):
+        self.clicks += 1
+        coords = tuple(coords)
+        handler = getattr(self, '_click_' + self.state)
+        handler(coords)
+        self._render()
+
+    def press(self, key):
+        self.presses += 1
+        self._update_test()
+        if key == '+':
+            self.game_speed = min(self.game_speed + 1, 4)
+        elif key == '-':
+            self.game_speed = max(self.game_speed - 1, 1)
+        self._render()
+
+    def _click_park(self, coords):
+        if coords == self.ui.build_coaster_coords:
+            self.state = 'new_ride'
+
+    def _click_new_ride(self, coords):
+        if coords == self.ui.choose_coaster_coords:
+            self.state = 'choose_design'
+
+    def _click_choose_design(self, coords):
+        if coords == self.ui.custom_coster_coords:
+            self.state = 'placing'
+
+    def _click_placing(self, coords):
+        if coords == self.ui.place_coords:
+            self.track.demolish_rollercoaster()
+            self.track.start_new_rollercoaster()
+            self.state = 'builder'
+            self.station_pieces = 1
+            self.selection = {'direction': 'straight', 'slope': 'level', 'roll': 'noroll'}
+            self.chain = False
+            self.built = []
+            self.error = False
+            self.entrance = self.exit = self.placing_entrance = False
+
+    def _click_builder(self, coords):
+        ui = self.ui
+        self.error = False
+        if coords == ui.build_coords:
+            self._build()
+        elif coords == ui.exit_builder_coords:
+            self.state = 'ride_window'
+            self.results_tab = False
+        elif coords == ui.remove_piece_coords:
+            self._remove()
+        elif coords == ui.chain_lift:
+            self.chain = not self.chain
+        elif coords == ui.entrance_button:
+            self.placing_entrance = True
+        elif coords == ui.entrance_coords and self.placing_entrance:
+            self.entrance = True
+        elif coords == ui.exit_coords and self.placing_entrance:
+            self.exit = True
+            self.placing_entrance = False
+        elif coords in self.directions and self._available('direction', self.directions[coords]):
+            self._select('direction', self.directions[coords])
+        elif coords in self.slopes and self._available('slope', self.slopes[coords]):
+            self._select('slope', self.slopes[coords])
+        elif coords in self.rolls and self._available('roll', self.rolls[coords]):
+            self._select('roll', self.rolls[coords])
+
+    def _click_ride_window(self, coords):
+        ui = self.ui
+        if coords == ui.test_button and self.test_started is None and self._can_test():
+            self.test_started = time.perf_counter()
+            self.test_elapsed = 0.0
+            self.results_shown = False
+        elif coords == ui.test_result_button:
+            self.results_tab = True
+        elif coords == ui.demolish_ride_coords:
+            self.state = 'confirm_demolish'
+
+    def _click_confirm_demolish(self, coords):
+        if coords == self.ui.confirm_demolish_coords:
+            self.track.demolish_rollercoaster()
+            self.state = 'park'
+            self.station_pieces = 0
+            self.test_started = None
+            self.results_tab = self.results_shown = False
+
+    # Track builder
+
+    def _build(self):
+        if self.station_pieces < self.track.station_length:
+            self.station_pieces += 1
+            return
+        if self.track.is_loop_completed():
+            return
+        piece_type = '_'.join(self.selection[key] for key in ('direction', 'slope', 'roll'))
+        if self.chain:
+            piece_type += '_chain'
+        self.error = not self.track.add_track_piece(piece_type)
+        if not self.error:
+            self.built.append((dict(self.selection), self.chain))
+
+    def _remove(self):
+        if not self.track.remove_piece():
+            self.error = True
+            return
+        # Like the game the builder selects the shape of the removed piece, and the chain lift
+        # of the piece that is now the last one
+        self.selection = self.built.pop()[0]
+        self.chain = bool(self.built) and self.built[-1][1]
+
+    def _available(self, kind, name):
+        # The slope changes one step at a time, curves can't be steep and only level pieces
+        # can roll. Curves that change the slope are refused when they are built.
+        if kind == 'direction':
+            return name == 'straight' or abs(self.track.slope) < 2
+        if kind == 'slope':
+            steep_curve = self.selection['direction'] != 'straight' and abs(SLOPES[name]) == 2
+            return abs(SLOPES[name] - self.track.slope) <= 1 and not steep_curve
+        return self.selection['slope'] == 'level' or name == 'noroll'
+
+    def _select(self, kind, name):
+        self.selection[kind] = name
+        if kind == 'slope' and SLOPES[name] < 0:
+            # The game takes the chain lift off for down slopes
+            self.chain = False
+        # Selections that don't fit the new one fall back to the nearest that does
+        if not self._available('slope', self.selection['slope']):
+            self.selection['slope'] = next(slope for slope, value in SLOPES.items() if value == self.track.slope)
+        if not self._available('roll', self.selection['roll']):
+            self.selection['roll'] = 'noroll'
+
+    # Ride test
+
+    def _can_test(self):
+        return self.track.is_loop_completed() and self.entrance and self.exit
+
+    def _update_test(self):
+        # The test runs faster with every game speed step
+        if self.test_started is None or self.results_shown:
+            return
+        now = time.perf_counter()
+        self.test_elapsed += (now - self.test_started) * 2 ** (self.game_speed - 1)
+        self.test_started = now
+        if self.test_elapsed >= self.test_time:
+            self.results_shown = True
+            self._render()
+
+    def ratings(self):
+        # Made up ratings from the shape of the track, only meant to be read back
+        track_pieces = [0] * self.track.station_length + [piece[0] for piece in self.track.pieces]
+        features = track_features(track_pieces, self.track.station_length)
+        length, max_height, _, drops, max_drop, _, left, right, banked, chain = features[:10]
+        excitement = 1 + 0.02 * length + 0.3 * max_drop + 0.2 * drops + 0.05 * (left + right)
+        intensity = 1 + 0.1 * max_height + 0.4 * max_drop + 0.1 * banked
+        nausea = 0.5 + 0.1 * (left + right) + 0.2 * banked + 0.05 * chain
+        return tuple(round(min(max(value, 0.0), 9.99), 2) for value in (excitement, intensity, nausea))
+
+    def glyph_reader(self):
+        # A glyph bank for the pixel font, built from rendered rating lines
+        reader = GlyphReader()
+        samples = []
+        for values in ((0.12, 3.45, 6.78), (9.01, 2.34, 5.67), (8.9, 1.0, 0.0)):
+            lines = rating_lines(*values)
+            image = np.empty((LINE_HEIGHT * 3 + 4, 140, 3), dtype=np.uint8)
+            image[:] = self.ui.ride_windows_bg
+            draw_text(image, lines)
+            samples.append((image, lines))
+        reader.calibrate(samples)
+        return reader
+
+    # Drawing
+
+    def _fill(self, rect, color):
+        left, top, right, bottom = rect
+        self.frame[top:bottom, left:right] = color
+
+    def _button(self, coords, color, size=5):
+        x, y = coords
+        self._fill((x - size, y - size, x + size + 1, y + size + 1), color)
+
+    def _render(self):
+        if self.latency or self.redraw_frames > 1:
+            # What was on screen until now stays visible for the latency
+            self.previous_frame = self.grab_frame()
+            self.changed_at = time.perf_counter()
+        self.frame = np.empty_like(self.frame)
+        ui = self.ui
+        self._fill((0, 0, self.frame.shape[1], self.frame.shape[0]), PARK_COLOR)
+        if self.track.station_built:
+            self._fill(RIDE_AREA, RIDE_COLOR)
+        self._button(ui.build_coaster_coords, SELECTED_COLOR if self.state in ('new_ride', 'choose_design') else BUTTON_COLOR)
+        for placed, coords in ((self.entrance, ui.entrance_coords), (self.exit, ui.exit_coords)):
+            if placed:
+                self._button(coords, MARKER_COLOR)
+
+        if self.state == 'new_ride':
+            self._fill(NEW_RIDE_WINDOW, WINDOW_COLOR)
+            self._button(ui.choose_coaster_coords, BUTTON_COLOR)
+        elif self.state == 'choose_design':
+            self._fill(DESIGN_WINDOW, WINDOW_COLOR)
+            self._button(ui.custom_coster_coords, BUTTON_COLOR)
+        elif self.state == 'placing':
+            self._button(ui.place_coords, MARKER_COLOR)
+        elif self.state == 'builder':
+            self._render_builder()
+        elif self.state in ('ride_window', 'confirm_demolish'):
+            self._render_ride_window()
+            if self.state == 'confirm_demolish':
+                self._fill(CONFIRM_WINDOW, WINDOW_COLOR)
+                self._button(ui.confirm_demolish_coords, BUTTON_COLOR)
+
+    def _render_builder(self):
+        ui = self.ui
+        self._fill(BUILDER_WINDOW, WINDOW_COLOR)
+        self._button(ui.exit_builder_coords, BUTTON_COLOR)
+        for buttons, kind in ((self.directions, 'direction'), (self.slopes, 'slope'), (self.rolls, 'roll')):
+            for coords, name in buttons.items():
+                if self.selection[kind] == name:
+                    color = SELECTED_COLOR
+                elif self._available(kind, name):
+                    color = BUTTON_COLOR
+                else:
+                    color = ui.faded_color
+                self._button(coords, color)
+        self._button(ui.chain_lift, SELECTED_COLOR if self.chain else BUTTON_COLOR)
+        self._button(ui.remove_piece_coords, BUTTON_COLOR)
+        self._button(ui.entrance_button, SELECTED_COLOR if self.placing_entrance else BUTTON_COLOR)
+
+        # The build button shows the length of the track, and is gone once the loop is closed
+        self._button(ui.build_coords, ui.build_button_bg, size=50)
+        if not self.track.is_loop_completed():
+            pieces = self.station_pieces + len(self.track.pieces)
+            self._button(ui.build_coords, (200, 40 + pieces * 37 % 200, 100), size=20)
+        if self.error:
+            self._fill(ui.error_area, ERROR_COLOR)
+
+    def _render_ride_window(self):
+        ui = self.ui
+        self._fill(RIDE_WINDOW, WINDOW_COLOR)
+        self._button(ui.test_button, SELECTED_COLOR if self.test_started is not None else BUTTON_COLOR)
+        self._button(ui.test_result_button, SELECTED_COLOR if self.results_tab else BUTTON_COLOR)
+        self._button(ui.demolish_ride_coords, SELECTED_COLOR if self.state == 'confirm_demolish' else BUTTON_COLOR)
+        if self.results_tab:
+            self._fill(ui.test_score_area, ui.ride_windows_bg)
+            left, top, right, bottom = ui.ride_rating_area
+            self._fill((left, top, right, bottom), ui.ride_windows_bg)
+            if self.results_shown:
+                draw_text(self.frame[top:bottom, left:right], rating_lines(*self.ratings()))
+
+    # Capture
+
+    def grab_frame(self):
+        if not (self.latency or self.redraw_frames > 1):
+            return self.frame
+        elapsed = time.perf_counter() - self.changed_at - self.latency
+        if elapsed < 0:
+            return self.previous_frame
+        drawn = int(elapsed / self.frame_time) + 1
+        if drawn >= self.redraw_frames:
+            return self.frame
+        rows = self.frame.shape[0] * drawn // self.redraw_frames
+        frame = self.previous_frame.copy()
+        frame[:rows] = self.frame[:rows]
+        return frame
+
+    def grab(self, bbox):
+        self._update_test()
+        left, top, right, bottom = bbox
+        return self.grab_frame()[top:bottom, left:right].copy()
+
+
+class FakeCapture:
+    """Capture backend that grabs from a FakeScreen."""
+
+    def __init__(self, screen):
+        self.screen = screen
+
+    def grab(self, bbox):
+        return self.screen.grab(bbox)
+
+    def reconnect(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeInput:
+    """Input backend that clicks and presses keys on a FakeScreen, the pauses between clicks are skipped."""
+
+    def __init__(self, screen, batched=True):
+        self.screen = screen
+        self.batched = batched
+
+    def click(self, coords):
+        self.screen.click(coords)
+
+    def click_sequence(self, coords_list, interval):
+        for coords in coords_list:
+            self.screen.click(coords)
+
+    def press(self, key, presses=1):
+        for _ in range(presses):
+            self.screen.press(key)
+
+    def reconnect(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def fake_ui_controller(latency=0.0, test_time=0.5, batched=True, grid_size=(64, 64), max_height=32, redraw_frames=1,
+                       frame_time=1 / 60, **controller_kwargs):
+    """Return a UIController playing on a new FakeScreen."""
+    from .ui_controller import UIController
+    screen = FakeScreen(latency, test_time, grid_size=grid_size, max_height=max_height, redraw_frames=redraw_frames,
+                        frame_time=frame_time)
+    controller = UIController(capture=FakeCapture(screen), input_backend=FakeInput(screen, batched), **controller_kwargs)
+    screen.set_layout(controller)
+    if controller.rating_reader is None:
+        controller.rating_reader = screen.glyph_reader()
+    controller.screen = screen
+    return controller
@@ -0,0 +1,148 @@
+import os
+import subprocess
+
+# Key characters -> X keysym names
+KEYSYMS = {
+    '+': 'plus',
+    '-': 'minus',
+}
+
+
+class PyAutoGUIInput:
+    """Clicks through pyautogui, one synchronous call per click."""
+
+    batched = False
+
+    def __init__(self):
+        # Imported here, pyautogui needs a display as soon as it is imported
+        import pyautogui
+        self.pyautogui = pyautogui
+        # The UI controller waits for the UI to react itself, so pyautogui shouldn't pause
+        pyautogui.PAUSE = 0
+
+    def click(self, coords):
+        self.pyautogui.click(coords)
+
+    def click_sequence(self, coords_list, interval):
+        for i, coords in enumerate(coords_list):
+            if i:
+                self.pyautogui.sleep(interval)
+            self.pyautogui.click(coords)
+
+    def press(self, key, presses=1):
+        self.pyautogui.press(key, presses=presses)
+
+    def reconnect(self):
+        # pyautogui connects to the X server when it is imported, on X11 that connection is
+        # replaced with a new one to the display
+        try:
+            from pyautogui import _pyautogui_x11
+            from Xlib.display import Display
+        except ImportError:
+            return
+        _pyautogui_x11._display = Display(os.environ['DISPLAY'])
+
+    def close(self):
+        pass
+
+
+class XdotoolInput:
+    """Sends a whole click sequence to the X server with a single xdotool invocation."""
+
+    batched = True
+
+    def click(self, coords):
+        self.click_sequence([coords], 0)
+
+    def click_sequence(self, coords_list, interval):
+        command = ['xdotool']
+        for i, (x, y) in enumerate(coords_list):
+            if i and interval:
+                command += ['sleep', str(interval)]
+            command += ['mousemove', '--sync', str(x), str(y), 'click', '1']
+        subprocess.run(command, check=True)
+
+    def press(self, key, presses=1):
+        subprocess.run(['xdotool', 'key', '--repeat', str(presses), KEYSYMS.get(key, key)], check=True)
+
+    def reconnect(self):
+        # Every xdotool call connects by itself
+        pass
+
+    def close(self):
+        pass
+
+
+class XTestInput:
+    """Queues a click sequence as XTest fake input events and flushes them in one round trip.
+
+    The pause between clicks is done by the X server through the XTest event delay,
+    so the whole sequence is one request batch followed by a single sync.
+    """
+
+    batched = True
+
+    def __init__(self):
+        try:
+            from Xlib import X, display
+            from Xlib.ext import xtest
+        except ImportError:
+            raise ImportError("The xtest input backend needs python-xlib, install it with: pip install python-xlib")
+        self.X = X
+        self.xtest = xtest
+        self.Display = display.Display
+        self.display = self.Display()
+
+    def click(self, coords):
+        self.click_sequence([coords], 0)
+
+    def click_sequence(self, coords_list, interval):
+        delay = int(interval * 1000)
+        for i, (x, y) in enumerate(coords_list):
+            self.xtest.fake_input(self.display, self.X.MotionNotify, x=x, y=y, time=delay if i else self.X.CurrentTime)
+            self.xtest.fake_input(self.display, self.X.ButtonPress, 1)
+            self.xtest.fake_input(self.display, self.X.ButtonRelease, 1)
+        self.display.sync()
+
+    def press(self, key, presses=1):
+        from Xlib import XK
+        keysym = XK.string_to_keysym(KEYSYMS.get(key, key))
+        keycode = self.display.keysym_to_keycode(keysym)
+        # Keys like '+' are on a shifted level of their key on most layouts
+        shift = self.display.keycode_to_keysym(keycode, 0) != keysym
+        shift_keycode = self.display.keysym_to_keycode(XK.XK_Shift_L)
+        for _ in range(presses):
+            if shift:
+                self.xtest.fake_input(self.display, self.X.KeyPress, shift_keycode)
+            self.xtest.fake_input(self.display, self.X.KeyPress, keycode)
+            self.xtest.fake_input(self.display, self.X.KeyRelease, keycode)
+            if shift:
+                self.xtest.fake_input(self.display, self.X.KeyRelease, shift_keycode)
+        self.display.sync()
+
+    def reconnect(self):
+        # The old connection may be to an X server that is gone, closing it can fail
+        try:
+            self.display.close()
+        except Exception:
+            pass
+        self.display = self.Display()
+
+    def close(self):
+        self.display.close()
+
+
+INPUT_BACKENDS = {
+    'pyautogui': PyAutoGUIInput,
+    'xdotool': XdotoolInput,
+    'xtest': XTestInput,
+}
+
+
+def create_input(name):
+    # Anything that isn't a name is taken to be an input backend already
+    if not isinstance(name, str):
+        return name
+    if name not in INPUT_BACKENDS:
+        raise ValueError(f"Unknown input backend: {name}")
+    return INPUT_BACKENDS[name]()
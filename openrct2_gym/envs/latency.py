@@ -0,0 +1,126 @@
+"""Latency histograms of the operations a step is made of.
+
+A LatencyRecorder times functions by wrapping them, so code only pays for the timing
+when a recorder was attached with `instrument()` and nothing at all otherwise. Every
+operation gets a histogram with power of two buckets in microseconds, recording is a
+couple of additions. Operations nest, a click includes the grabs and waits it does.
+
+The recorder also keeps the time spent per operation since `begin()`, which the
+environment returns in the info dict of every step, and can write its histograms as a
+Prometheus text file.
+"""
+import math
+import os
+from time import perf_counter
+
+NUM_BUCKETS = 40  # Bucket i holds times below 2**i microseconds, the last one everything above
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        bucket = math.frexp(seconds * 1e6)[1] if seconds > 0 else 0
+        self.counts[min(max(bucket, 0), NUM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        # Upper bound of the bucket holding the q-th percentile, in seconds
+        if not self.count:
+            return 0.0
+        target = q / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(2 ** bucket * 1e-6, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.histograms = {}
+        self.step_times = {}  # operation -> seconds spent since begin()
+        self.step_start = None
+
+    def _histogram(self, operation):
+        histogram = self.histograms.get(operation)
+        if histogram is None:
+            histogram = self.histograms[operation] = LatencyHistogram()
+        return histogram
+
+    def record(self, operation, seconds):
+        self._histogram(operation).add(seconds)
+        self.step_times[operation] = self.step_times.get(operation, 0.0) + seconds
+
+    def wrap(self, operation, function):
+        """Return `function` timed as `operation`."""
+        histogram = self._histogram(operation)
+
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = perf_counter() - start
+                histogram.add(seconds)
+                self.step_times[operation] = self.step_times.get(operation, 0.0) + seconds
+        return timed
+
+    def instrument(self, obj, operations):
+        # Replace the methods of `obj` by timed ones, {method name: operation}
+        for name, operation in operations.items():
+            setattr(obj, name, self.wrap(operation, getattr(obj, name)))
+
+    def begin(self):
+        self.step_times = {}
+        self.step_start = perf_counter()
+
+    def end(self, operation):
+        """Record the time since begin() as `operation` and return the time per operation since then."""
+        self.record(operation, perf_counter() - self.step_start)
+        return self.step_times
+
+    def summary(self):
+        return {operation: histogram.summary() for operation, histogram in sorted(self.histograms.items())}
+
+    def format_summary(self):
+        lines = [f"{'operation':<24}{'count':>10}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+        for operation, stats in self.summary().items():
+            lines.append(f"{operation:<24}{stats['count']:>10}{stats['mean'] * 1e3:>10.3f}{stats['p50'] * 1e3:>10.3f}"
+                         f"{stats['p99'] * 1e3:>10.3f}{stats['max'] * 1e3:>10.3f}")
+        return '\n'.join(lines)
+
+    def write(self, path):
+        # Prometheus text format, written to a temporary file first so readers never see half of it
+        lines = ["# TYPE openrct2_latency_seconds histogram"]
+        for operation, histogram in sorted(self.histograms.items()):
+            label = f'operation="{operation}"'
+            cumulative = 0
+            last = max((bucket for bucket, count in enumerate(histogram.counts) if count), default=0)
+            for bucket in range(last + 1):
+                cumulative += histogram.counts[bucket]
+                lines.append(f'openrct2_latency_seconds_bucket{{{label},le="{2 ** bucket * 1e-6:g}"}} {cumulative}')
+            lines.append(f'openrct2_latency_seconds_bucket{{{label},le="+Inf"}} {histogram.count}')
+            lines.append(f'openrct2_latency_seconds_sum{{{label}}} {histogram.total:.9g}')
+            lines.append(f'openrct2_latency_seconds_count{{{label}}} {histogram.count}')
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temporary, path)
@@ -0,0 +1,252 @@
+"""Runs several games side by side, each on its own virtual X display.
+
+Every instance gets an Xvfb server on display :N and a game started on it. The game
+is the only window on that display, so it sits in the top left corner where the
+UIController expects it. The game command has to leave the game in the track designer
+with the ride type chosen, like the README describes for a manual start.
+
+Dead instances are restarted without waiting for the game to start, so training goes on
+while it does. A restart is moved on by every health check: the old processes are ended,
+then a new X server is started and the game once the display accepts connections. A
+display that doesn't come up is tried again later, after a longer pause every time. The
+environments are suspended in the meantime and reconnect to the new X server once the
+game has had its startup time.
+
+In mock mode no X server or game is started: every instance is a placeholder process
+and the environments use the sim backend, so the orchestration, health checks and
+restarts can be tried out without the game.
+"""
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+from .logs import get_logger, log_event
+
+log = get_logger('launcher')
+
+MOCK_COMMAND = [sys.executable, '-c', 'import time; time.sleep(1e9)']
+
+
+class GameInstance:
+    def __init__(self, display, game_command, screen='1280x1024x24', mock=False, startup_time=10, display_timeout=10,
+                 stop_timeout=5, max_retry_delay=60):
+        self.display = display
+        self.game_command = game_command
+        self.screen = screen
+        self.mock = mock
+        self.startup_time = startup_time  # Seconds the game needs before it can be clicked
+        self.display_timeout = display_timeout  # Seconds Xvfb gets to accept connections
+        self.stop_timeout = stop_timeout  # Seconds a process gets to end before it is killed
+        self.max_retry_delay = max_retry_delay
+        self.xvfb = None
+        self.game = None
+        self.restarts = 0
+        self.ready_at = None  # When the game can be clicked, None until it is started
+        self.display_deadline = 0.0
+        self.stopping = []  # Old processes a restart waits for
+        self.stop_deadline = 0.0
+        self.failures = 0  # Displays that didn't come up in a row
+        self.retry_at = None  # When to try again after a display didn't come up
+
+    def start(self, wait=True):
+        # Without waiting the game is started by poll() once the display is up, and is still
+        # starting until is_ready()
+        self.ready_at = None
+        self.retry_at = None
+        if self.mock:
+            self.game = subprocess.Popen(MOCK_COMMAND)
+            self.ready_at = time.time()
+            return
+        self._remove_stale_display()
+        try:
+            self.xvfb = subprocess.Popen(['Xvfb', self.display, '-screen', '0', self.screen, '-nolisten', 'tcp'],
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError:
+            if wait:
+                raise
+            self._failed('display')
+            return
+        self.display_deadline = time.time() + self.display_timeout
+        if wait:
+            while self.ready_at is None:
+                self.poll()
+                if self.retry_at is not None:
+                    raise RuntimeError(f"Could not start display {self.display} or its game")
+                time.sleep(0.05)
+            time.sleep(self.startup_time)
+
+    def _display_number(self):
+        return self.display.lstrip(':')
+
+    def _accepts_connections(self):
+        # Xvfb listens on the socket of the display once it is up. A socket file left behind by
+        # a server that died refuses connections.
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(f"/tmp/.X11-unix/X{self._display_number()}")
+            return True
+        except OSError:
+            return False
+        finally:
+            connection.close()
+
+    def _remove_stale_display(self):
+        # An X server that died leaves its socket and lock file, and Xvfb won't take the display then
+        if self._accepts_connections():
+            return
+        lock_path = f"/tmp/.X{self._display_number()}-lock"
+        try:
+            with open(lock_path) as lock:
+                os.kill(int(lock.read().strip()), 0)
+            return  # The server holding the lock is still running
+        except (OSError, ValueError):
+            pass
+        for path in (lock_path, f"/tmp/.X11-unix/X{self._display_number()}"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                log_event(log, logging.WARNING, 'stale_display', display=self.display, path=path, error=str(e))
+
+    def poll(self):
+        """Move a restart on without blocking, called until the instance is ready."""
+        now = time.time()
+        if self.stopping:
+            if now > self.stop_deadline:
+                for process in self.stopping:
+                    process.kill()
+            self.stopping = [process for process in self.stopping if process.poll() is None]
+            if not self.stopping:
+                self.start(wait=False)
+        elif self.retry_at is not None:
+            if now >= self.retry_at:
+                self.start(wait=False)
+        elif self.xvfb is not None and self.game is None:
+            if self._accepts_connections():
+                try:
+                    self.game = subprocess.Popen(self.game_command, env=dict(os.environ, DISPLAY=self.display),
+                                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                except OSError:
+                    self._failed('game')
+                    return
+                self.ready_at = now + self.startup_time
+            elif self.xvfb.poll() is not None or now > self.display_deadline:
+                self._failed('display')
+        elif self.ready_at is not None and now < self.ready_at and not self.is_alive():
+            self._failed('game')
+
+    def _failed(self, stage):
+        # Try again later, waiting twice as long after every failure in a row
+        for process in (self.game, self.xvfb):
+            if process is not None and process.poll() is None:
+                process.kill()
+                process.wait()
+        self.game = self.xvfb = None
+        self.ready_at = None
+        self.failures += 1
+        delay = min(2 ** self.failures, self.max_retry_delay)
+        self.retry_at = time.time() + delay
+        log_event(log, logging.WARNING, 'start_failed', display=self.display, stage=stage, failures=self.failures,
+                  retry_in=delay)
+
+    def is_ready(self):
+        self.poll()
+        ready = self.ready_at is not None and self.is_alive() and time.time() >= self.ready_at
+        if ready:
+            self.failures = 0
+        return ready
+
+    def is_alive(self):
+        processes = [self.game] if self.mock else [self.xvfb, self.game]
+        return all(process is not None and process.poll() is None for process in processes)
+
+    def stop(self):
+        for process in [self.game, self.xvfb] + self.stopping:
+            if process is not None and process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+        self.game = None
+        self.xvfb = None
+        self.stopping = []
+        self.retry_at = None
+
+    def restart(self, wait=True):
+        self.restarts += 1
+        if wait:
+            self.stop()
+            self.start()
+            return
+        # Ask the old processes to end, poll() starts the new ones once they have
+        self.stopping = [process for process in (self.game, self.xvfb) if process is not None and process.poll() is None]
+        for process in self.stopping:
+            process.terminate()
+        self.stop_deadline = time.time() + self.stop_timeout
+        self.game = self.xvfb = None
+        self.ready_at = None
+        self.retry_at = None
+        if not self.stopping:
+            self.start(wait=False)
+
+
+def make_env(display, backend, env_kwargs):
+    # Runs in the worker process, the display has to be set before the UI controller
+    # imports pyautogui or Xlib
+    def _init():
+        import gymnasium as gym
+        import openrct2_gym  # Registers the environment in the worker
+        if display is not None:
+            os.environ['DISPLAY'] = display
+        return gym.make('OpenRCT2-v0', backend=backend, **env_kwargs)
+    return _init
+
+
+class InstanceLauncher:
+    def __init__(self, num_instances, game_command=('openrct2',), first_display=99, mock=False, **instance_kwargs):
+        self.mock = mock
+        self.instances = [GameInstance(f":{first_display + i}", list(game_command), mock=mock, **instance_kwargs)
+                          for i in range(num_instances)]
+        self.restarting = set()  # Indices of restarted instances whose game is still starting
+
+    def start(self):
+        for instance in self.instances:
+            instance.start()
+        log_event(log, logging.INFO, 'instances_started', instances=len(self.instances), mock=self.mock)
+
+    def env_fns(self, backend='ui', env_kwargs=None):
+        # One environment factory per instance, mock instances train on the simulation.
+        # Environments are numbered like the instances, e.g. for their log files.
+        if self.mock:
+            return [make_env(None, 'sim', dict(env_kwargs or {}, env_id=str(i))) for i in range(len(self.instances))]
+        return [make_env(instance.display, backend, dict(env_kwargs or {}, env_id=str(i)))
+                for i, instance in enumerate(self.instances)]
+
+    def check_health(self):
+        """Restart every instance whose X server or game died without waiting for it, returns their indices."""
+        restarted = []
+        for index, instance in enumerate(self.instances):
+            # Restarting instances are moved on and checked by ready_instances()
+            if index not in self.restarting and not instance.is_alive():
+                log_event(log, logging.WARNING, 'instance_died', display=instance.display, restarts=instance.restarts)
+                instance.restart(wait=False)
+                self.restarting.add(index)
+                restarted.append(index)
+        return restarted
+
+    def ready_instances(self):
+        """Return the indices of restarted instances that are ready now, each of them once."""
+        ready = sorted(index for index in self.restarting if self.instances[index].is_ready())
+        self.restarting.difference_update(ready)
+        for index in ready:
+            log_event(log, logging.INFO, 'instance_ready', display=self.instances[index].display)
+        return ready
+
+    def close(self):
+        for instance in self.instances:
+            instance.stop()
@@ -0,0 +1,143 @@
+"""Structured logging for the environments, silent until it is configured.
+
+Everything logs through the standard logging module below the 'openrct2_gym' logger,
+with the details of an event as fields instead of formatted text:
+
+    log_event(logger, logging.DEBUG, 'step', step=12, reward=1.0)
+
+Without `configure_logging()` nothing is written and events below WARNING are skipped
+before any of their fields are formatted. Once configured, records are handed to a
+queue and a background thread writes them as JSON lines, one file per environment
+(`env_<id>.jsonl`) and one for everything else (`train.jsonl`, `evaluation_queue.jsonl`, ...).
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+
+ROOT_LOGGER = 'openrct2_gym'
+FLUSH_INTERVAL = 1.0  # Seconds between flushes of the log files
+
+logging.getLogger(ROOT_LOGGER).addHandler(logging.NullHandler())
+
+_listener = None
+_config = None
+
+
+def get_logger(name):
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def log_event(logger, level, event, **fields):
+    # The fields are only put together when the level is enabled
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'fields': fields})
+
+
+def _json_value(value):
+    # NumPy values and arrays become plain numbers and lists
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+
+class ConsoleFormatter(logging.Formatter):
+    def format(self, record):
+        text = super(ConsoleFormatter, self).format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            text += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+
+class JSONLinesHandler(logging.Handler):
+    """Writes every record as a JSON object to the file of the environment that logged it."""
+
+    def __init__(self, directory):
+        super(JSONLinesHandler, self).__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.files = {}
+        self.last_flush = 0.0
+
+    def _file_name(self, logger_name):
+        # openrct2_gym.env.<id>.backend -> env_<id>.jsonl, openrct2_gym.train -> train.jsonl
+        parts = logger_name.split('.')[1:] or ['openrct2_gym']
+        if parts[0] == 'env' and len(parts) > 1:
+            return f"env_{parts[1]}.jsonl"
+        return f"{parts[0]}.jsonl"
+
+    def format(self, record):
+        entry = {'time': record.created, 'level': record.levelname, 'logger': record.name, 'event': record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, default=_json_value)
+
+    def emit(self, record):
+        try:
+            name = self._file_name(record.name)
+            f = self.files.get(name)
+            if f is None:
+                f = self.files[name] = open(os.path.join(self.directory, name), 'a')
+            f.write(self.format(record) + '\n')
+            if record.created - self.last_flush > FLUSH_INTERVAL:
+                self.flush()
+                self.last_flush = record.created
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+        super(JSONLinesHandler, self).close()
+
+
+def configure_logging(level='INFO', directory='logs', console=False):
+    """Log events of `level` and above to JSON lines files in `directory`, optionally also to stderr.
+
+    The files are written by a background thread. Calling it again with other settings
+    replaces the configuration, with the same settings it does nothing.
+    """
+    global _listener, _config
+    if _listener is not None and _config == (level, directory, console):
+        return
+    shutdown_logging()
+    handlers = [JSONLinesHandler(directory)] if directory else []
+    if console:
+        stream = logging.StreamHandler()
+        stream.setFormatter(ConsoleFormatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        handlers.append(stream)
+
+    records = queue.SimpleQueue()
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.propagate = False
+    _listener = logging.handlers.QueueListener(records, *handlers)
+    _listener.start()
+    _config = (level, directory, console)
+
+
+def shutdown_logging():
+    # Write out the queued records and close the files
+    global _listener, _config
+    if _listener is None:
+        return
+    logger = logging.getLogger(ROOT_LOGGER)
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logger.removeHandler(handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+    _config = None
+
+
+atexit.register(shutdown_logging)
@@ -1,128 +1,395 @@
+from collections import namedtuple
+import itertools
+import logging
+import math
+import os
 import gymnasium as gym
 import numpy as np
-from .track_builder import TrackBuilder
-from .ui_controller import UIController
+from .backend import BackendError
+from .compact_observation import compact_observation_space, encode_observation
+from .distance_field import ACTION_SLOPES, UNKNOWN, DistanceField
+from .episode_state import EpisodeState
+from .latency import LatencyRecorder
+from .logs import configure_logging, get_logger, log_event
+from .placement_cache import PlacementCache
+from .rating_cache import RatingCache
+from .sim_controller import SimController
+from .td6 import save_td6
+from .track_builder import REMOVE_PIECE, TRACK_PIECES, TrackBuilder, move
+
+# Episode state returned by OpenRCT2Env.snapshot(), positions and pieces are tuples so it can be shared
+EnvSnapshot = namedtuple('EnvSnapshot', [
+    'history', 'track_pieces', 'current_position', 'current_direction', 'track_length',
+    'steps', 'loop_completed', 'last_piece_type', 'chain_lift_count', 'last_action',
+])
+
+# Numbers the environments of a process, for their log files
+_env_ids = itertools.count()
+
+
+def _state_attribute(name):
+    # The episode state is kept in an EpisodeState, the environment keeps its old attribute names
+    return property(lambda self: getattr(self.state, name), lambda self, value: setattr(self.state, name, value))
+
 
 class OpenRCT2Env(gym.Env):
-    def __init__(self, render_mode=None):
+    track_length = _state_attribute('length')
+    current_position = _state_attribute('position')
+    current_direction = _state_attribute('direction')
+    steps = _state_attribute('steps')
+    loop_completed = _state_attribute('loop_completed')
+    last_piece_type = _state_attribute('last_piece_type')
+    chain_lift_count = _state_attribute('chain_lift_count')
+    last_action = _state_attribute('last_action')
+
+    def __init__(self, render_mode=None, backend='ui', backend_kwargs=None, reset_mode='rebuild', mask_kwargs=None,
+                 placement_cache=None, rating_cache=None, rating_model=None, evaluation_queue=None,
+                 latency_metrics=True, metrics_path=None, metrics_interval=1000, env_id=None, log_level=None,
+                 log_dir='logs', debug=False, compact_observations=False, distance_field=None):
         super(OpenRCT2Env, self).__init__()
         self.render_mode = render_mode
-        self.ui_controller = UIController()
-        self.track_builder = TrackBuilder(self.ui_controller)
+        self.backend = backend
+        # Events are logged to logs/env_<env_id>.jsonl once logging is configured, here with
+        # log_level or by the training script. Nothing is logged by default.
+        if log_level is not None:
+            configure_logging(log_level, log_dir)
+        self.env_id = env_id if env_id is not None else f"{os.getpid()}-{next(_env_ids)}"
+        self.log = get_logger(f"env.{self.env_id}")
+        # 'rebuild' demolishes the coaster on reset, 'rewind' removes pieces back to the station
+        self.reset_mode = reset_mode
+        self.ui_controller = self._create_backend(backend, backend_kwargs or {})
+        self.ui_controller.log = self.log.getChild('backend')
+        # Outcomes of earlier placements, shared through an SQLite file. Failures read from the
+        # screen can be misreads, so those are only trusted after the second one in a row.
+        self.placement_cache = None
+        if placement_cache:
+            min_failures = 2 if backend in ('ui', 'fake_ui') else 1
+            self.placement_cache = PlacementCache(placement_cache, source=backend, min_failures=min_failures)
+        self.track_builder = TrackBuilder(self.ui_controller, self.placement_cache)
+        # Ratings of rides that were already tested
+        self.rating_cache = RatingCache(rating_cache) if rating_cache else None
+        # Optional RatingModel that estimates the ratings of rides it is sure about
+        self.rating_model = rating_model
+        if self.rating_model is not None and self.rating_cache is not None:
+            self.rating_model.add_samples(self.rating_cache.samples())
+        # With an EvaluationQueue completed rides are tested in the background and
+        # their ratings are collected later with poll_ratings()
+        self.evaluation_queue = evaluation_queue
+        # Table of the pieces needed to close the loop from anywhere, cached in the file `distance_field`.
+        # Used for the reward, to truncate episodes that can't be completed anymore and as an observation.
+        self.distance_field = DistanceField(distance_field) if distance_field else None
+        # Local copy of the track used to mask out pieces that can't be placed
+        self.track_model = SimController(**(mask_kwargs or {}))
+        self.track_model_synced = False
+        # Latency histograms of the steps and the operations in them, returned per step in
+        # info['latency'], logged every `metrics_interval` steps and written to `metrics_path`.
+        # Without latency_metrics nothing is timed at all.
+        self.latency = LatencyRecorder() if latency_metrics else None
+        if self.latency is not None:
+            self.ui_controller.instrument(self.latency)
+            self.latency.instrument(self.track_builder, {'take_action': 'take_action'})
+        self.metrics_path = metrics_path
+        self.metrics_interval = metrics_interval
+        self.total_steps = 0
         
         # Define action and observation space
         self.action_space = gym.spaces.Discrete(19)
 
         # Initialize state variables
-        self.current_position = None
         self.goal_position = None
-        self.current_direction = 0
-        self.track_pieces = []
-        self.track_length = 0
         self.max_track_length = 250
         self.max_steps = 256
         self.station_length = self.ui_controller.station_length
-        self.steps = 0
-        self.loop_completed = False
-        self.last_piece_type = 0
-        self.chain_lift_count = 0
         self.max_chain_lifts = 15
-        self.last_action = None
+        # Observations as one flat uint8 array, see compact_observation.py for the layout
+        self.compact_observations = compact_observations
+        # True while the game's track is known to match the track builder's history
+        self.track_known = False
+        # True while the game is being restarted, nothing is sent to it then
+        self.backend_suspended = False
+        # Check every observation against the observation space
+        self.debug = debug
 
         # Define observation space
-        self.observation_space = gym.spaces.Dict({
-            'track_pieces': gym.spaces.Box(low=0, high=19, shape=(self.max_track_length,), dtype=np.int32),
-            'current_position': gym.spaces.Box(low=-20, high=1000, shape=(3,), dtype=np.int32),
-            'current_direction': gym.spaces.Discrete(4),
-            'distance_to_start': gym.spaces.Box(low=0, high=np.sqrt(2000**2 + 2000**2), shape=(1,), dtype=np.float32),
-            'track_length': gym.spaces.Discrete(self.max_track_length + 1),
-            'last_piece_type': gym.spaces.Discrete(19),
-        })
+        if compact_observations:
+            self.observation_space = compact_observation_space(self.max_track_length, self.distance_field is not None)
+        else:
+            self.observation_space = gym.spaces.Dict({
+                'track_pieces': gym.spaces.Box(low=0, high=19, shape=(self.max_track_length,), dtype=np.int32),
+                'current_position': gym.spaces.Box(low=-20, high=1000, shape=(3,), dtype=np.int32),
+                'current_direction': gym.spaces.Discrete(4),
+                'distance_to_start': gym.spaces.Box(low=0, high=np.sqrt(2000**2 + 2000**2), shape=(1,), dtype=np.float32),
+                'track_length': gym.spaces.Discrete(self.max_track_length + 1),
+                'last_piece_type': gym.spaces.Discrete(19),
+            })
+            if self.distance_field is not None:
+                self.observation_space['pieces_to_close'] = gym.spaces.Box(low=0, high=UNKNOWN, shape=(1,), dtype=np.int32)
+        self.compact_size = self.observation_space.shape[0] if compact_observations else 0
+        self.state = EpisodeState(self.max_track_length, compact_size=self.compact_size)
+
+    def _create_backend(self, backend, backend_kwargs):
+        # Backends are imported lazily so the simulation runs without an X server
+        if backend == 'ui':
+            from .ui_controller import UIController
+            return UIController(**backend_kwargs)
+        elif backend == 'fake_ui':
+            from .fake_screen import fake_ui_controller
+            return fake_ui_controller(**backend_kwargs)
+        elif backend == 'sim':
+            from .sim_controller import SimController
+            return SimController(**backend_kwargs)
+        elif backend == 'socket':
+            from .socket_backend import SocketBackend
+            return SocketBackend(**backend_kwargs)
+        raise ValueError(f"Unknown backend: {backend}")
 
     def step(self, action):
-        success, new_position, new_direction = self.track_builder.take_action(action, self.current_position, self.current_direction)
+        if not self.track_known:
+            # The game's track doesn't match the episode anymore, e.g. after the game was restarted,
+            # so nothing is built and the episode ends to be started over
+            return self._get_observation(), 0.0, False, True, {'track_unknown': True}
+        if self.latency is not None:
+            self.latency.begin()
+        state = self.state
+        success, new_position, new_direction = self.track_builder.take_action(action, state.position, state.direction)
         if success:
             if action == 18:  # Remove piece
-                if self.track_pieces:
-                    self.track_pieces.pop()
-                    self.track_length -= 1
+                if state.length:
+                    state.pop()
+                self.track_model.remove_piece()
             else:
-                self.track_length += 1
-                self.track_pieces.append(action)
+                state.push(action)
+                # The game placed a piece the model thinks collides, masks can't be trusted anymore
+                if not self.track_model.add_track_piece(TRACK_PIECES[action][0]):
+                    self.track_model_synced = False
 
-            self.last_piece_type = action
-            self.current_position = new_position
-            self.current_direction = new_direction
+            state.last_piece_type = action
+            state.position = new_position
+            state.direction = new_direction
         
-        self.last_action = action
+        state.last_action = action
+        pieces_to_close = None
+        if self.distance_field is not None:
+            pieces_to_close = self._update_closure(success, action)
         observation = self._get_observation()
-        reward = self._calculate_reward(success)
+        reward = self._calculate_reward(success, pieces_to_close)
 
         # Check for loop completion
-        self.loop_completed = self.ui_controller.is_loop_completed()
-        if self.loop_completed:
-            print(f"Loop has been completed, great success!")
-        terminated = self.loop_completed
+        state.loop_completed = self.ui_controller.is_loop_completed()
+        if state.loop_completed:
+            log_event(self.log, logging.INFO, 'loop_completed', track_length=state.length, steps=state.steps + 1)
+        terminated = state.loop_completed
         
         # Check if episode was truncated
         truncated = self._is_trunkated()
-        self.steps += 1
-        print("Current step: %s, Track length: %s, Current position: %s, Last action: %s, Distance to goal: %f, Chainlifts: %s, Direction: %s" % (self.steps, self.track_length, self.current_position, self.last_action, self._calculate_distance_to_start(), self.chain_lift_count, self.current_direction))
+        state.steps += 1
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug('step', extra={'fields': {
+                'step': state.steps, 'action': state.last_action, 'success': success, 'reward': reward,
+                'track_length': state.length, 'position': state.position,
+                'direction': state.direction, 'distance': float(state.distance[0]),
+                'chain_lifts': state.chain_lift_count,
+            }})
         info = {}
 
         if terminated:
-            self.ui_controller._place_entrance_exit()
-            self.ui_controller.run_ride_evaluation()
-            ride_rating = self.evaluate_ride()
-            info['ride_rating'] = ride_rating
+            if self.evaluation_queue is not None:
+                info['episode_id'] = self.evaluation_queue.submit(state.track_pieces.tolist())
+            else:
+                ride_rating = self.evaluate_ride()
+                info['ride_rating'] = ride_rating
 
+        self.total_steps += 1
+        if self.latency is not None:
+            info['latency'] = self.latency.end('step')
+            if self.total_steps % self.metrics_interval == 0:
+                self.report_latency()
         return observation, reward, terminated, truncated, info
 
     def reset(self, seed=None, options=None):
         super().reset(seed=seed)
-        self.ui_controller.demolish_rollercoaster()
+        if self.latency is not None:
+            self.latency.begin()
+        if self.backend_suspended:
+            observation, info = self._reset_track(self.reset_mode)
+        elif options and options.get('snapshot') is not None:
+            observation, info = self.restore(options['snapshot'])
+        elif options and options.get('track_design') is not None:
+            observation, info = self.load_track_design(options['track_design'])
+        else:
+            observation, info = self._reset_track((options or {}).get('reset_mode', self.reset_mode))
+        if self.latency is not None:
+            info['latency'] = self.latency.end('reset')
+        return observation, info
 
-        # Set initial position (north end of the station)
-        self.current_position = [500, 500, 0]
+    def _reset_track(self, reset_mode):
+        # Remove the pieces back to the station when we know what was built, otherwise start over.
+        # While the game is being restarted the episode starts without a track in the game.
+        suspended = self.backend_suspended
+        rewound = False
+        if reset_mode == 'rewind' and self.track_known:
+            pieces = len(self.track_builder.history)
+            rewound = self.ui_controller.remove_pieces(pieces) == pieces
+            if not rewound:
+                log_event(self.log, logging.WARNING, 'rewind_failed', pieces=pieces)
+        if not rewound and not suspended:
+            self.ui_controller.demolish_rollercoaster()
 
         # Set goal position (south end of the station)
         self.goal_position = [500, 500 - self.station_length, 0]
 
-        self.current_direction = 0
-        self.track_pieces = []
-        self.track_length = 0
-        self.steps = 0
-        self.loop_completed = False
-        self.last_piece_type = 0
-        self.chain_lift_count = 0
-        self.last_action = None
-        self.track_builder.history.clear()  # Clear the history when resetting the environment
+        # A new state starting at the north end of the station, with the station pieces on the track
+        self.state = EpisodeState(self.max_track_length, self.station_length, (500, 500, 0), self.compact_size)
+        self.track_builder.clear()  # Clear the history when resetting the environment
+        if self.distance_field is not None:
+            self._reset_closure()
 
         # Build inital station
-        self.ui_controller.start_new_rollercoaster()
+        if not rewound and not suspended:
+            self.ui_controller.start_new_rollercoaster()
+        self.track_known = not suspended
+        self._sync_track_model()
+
+        observation = self._get_observation()
+        info = {}
+        return observation, info
+
+    @property
+    def track_pieces(self):
+        # The pieces of the track as a view of the episode's piece buffer
+        return self.state.track_pieces
+
+    def snapshot(self):
+        state = self.state
+        return EnvSnapshot(
+            history=self.track_builder.snapshot(),
+            track_pieces=tuple(state.track_pieces.tolist()),
+            current_position=tuple(state.position),
+            current_direction=state.direction,
+            track_length=state.length,
+            steps=state.steps,
+            loop_completed=state.loop_completed,
+            last_piece_type=state.last_piece_type,
+            chain_lift_count=state.chain_lift_count,
+            last_action=state.last_action,
+        )
 
-        # Update our state to reflect the built station
-        self.track_length = self.station_length
-        self.track_pieces = [0] * self.station_length  # Assuming 0 is the action for a straight piece
+    def restore(self, snapshot):
+        # Only the pieces after the prefix shared with the current track are removed and placed
+        if not (self.track_known and self.track_builder.restore(snapshot.history)):
+            if self.track_known:
+                log_event(self.log, logging.WARNING, 'restore_failed', pieces=len(snapshot.history))
+            self.ui_controller.demolish_rollercoaster()
+            self.track_builder.clear()
+            self.ui_controller.start_new_rollercoaster()
+            self.track_known = True
+            if not self.track_builder.restore(snapshot.history):
+                raise BackendError(f"Could not rebuild the {len(snapshot.history)} pieces of the snapshot")
+
+        self.goal_position = [500, 500 - self.station_length, 0]
+        state = self.state = EpisodeState(self.max_track_length, position=tuple(snapshot.current_position),
+                                          compact_size=self.compact_size)
+        state.set_pieces(snapshot.track_pieces)
+        state.direction = snapshot.current_direction
+        state.steps = snapshot.steps
+        state.loop_completed = snapshot.loop_completed
+        state.last_piece_type = snapshot.last_piece_type
+        state.chain_lift_count = snapshot.chain_lift_count
+        state.last_action = snapshot.last_action
+        if self.distance_field is not None:
+            self._reset_closure()
+        self._sync_track_model()
 
         observation = self._get_observation()
         info = {}
         return observation, info
 
-    def _calculate_reward(self, success):
+    def action_masks(self):
+        # Pieces the local track model knows would collide, leave the build area or break
+        # the slope are masked out, the real game still has the final say
+        masks = np.ones(self.action_space.n, dtype=bool)
+        if self.track_model_synced:
+            for action, piece in TRACK_PIECES.items():
+                masks[action] = self.track_model.can_add_track_piece(piece[0])
+        masks[18] = bool(self.track_builder.history)
+        if not masks.any():
+            masks[:] = True
+        return masks
+
+    def _sync_track_model(self):
+        # Rebuild the local track model from the track builder history
+        self.track_model.demolish_rollercoaster()
+        self.track_model.start_new_rollercoaster()
+        pieces = [TRACK_PIECES[action][0] for action, _, _ in self.track_builder.history]
+        self.track_model_synced = self.track_model.add_track_pieces(pieces) == len(pieces)
+
+    def load_track_design(self, track_pieces):
+        # Start from a stored design, the backend places its pieces one after the other
+        pieces = list(track_pieces[self.station_length:])
+        placed = self.ui_controller.load_track_design([TRACK_PIECES[action][0] for action in pieces])
+        if placed < len(pieces):
+            log_event(self.log, logging.WARNING, 'track_design_incomplete', placed=placed, pieces=len(pieces))
+        snapshot = self._design_snapshot(list(track_pieces[:self.station_length + placed]))
+        self.track_builder.clear()
+        self.track_builder.history.extend(snapshot.history)
+        self.track_known = True
+        return self.restore(snapshot)
+
+    def suspend_backend(self):
+        # The game is being restarted: until resume_backend() steps end their episode without
+        # sending anything to it and resets only reset the episode
+        log_event(self.log, logging.WARNING, 'backend_suspended')
+        self.backend_suspended = True
+        self.track_known = False
+
+    def resume_backend(self):
+        # The restarted game is ready, connect to it. The coaster is built on the next reset.
+        log_event(self.log, logging.INFO, 'backend_resumed')
+        self.ui_controller.reconnect()
+        self.backend_suspended = False
+        self.track_known = False
+
+    def save_track_design(self, path):
+        save_td6(path, self.state.track_pieces.tolist(), self.station_length)
+
+    def _design_snapshot(self, track_pieces):
+        # The state after building `track_pieces`, counting chain lifts like the reward does
+        position, direction = [500, 500, 0], 0
+        history = []
+        for action in track_pieces[self.station_length:]:
+            history.append((action, tuple(position), direction))
+            position, direction = move(action, position, direction)
+        chain_lifts = sum(1 for index, action in enumerate(track_pieces) if action == 15 and index + 1 < 17)
+        return EnvSnapshot(
+            history=tuple(history),
+            track_pieces=tuple(track_pieces),
+            current_position=tuple(position),
+            current_direction=direction,
+            track_length=len(track_pieces),
+            steps=0,
+            loop_completed=self.ui_controller.is_loop_completed(),
+            last_piece_type=track_pieces[-1],
+            chain_lift_count=min(chain_lifts, self.max_chain_lifts),
+            last_action=None,
+        )
+
+    def _calculate_reward(self, success, pieces_to_close=None):
+        # Called after _get_observation, so the distance to the start is up to date.
+        # `pieces_to_close` is the number of pieces needed to close the loop before the step.
+        state = self.state
         reward = 0
         if success:
             # Base reward for successful action
             reward += 1
 
             # Reward for placing chain lifts in the beginning
-            if self.track_length < 17 and self.last_piece_type == 15:
-                if self.chain_lift_count < self.max_chain_lifts:
+            if state.length < 17 and state.last_piece_type == 15:
+                if state.chain_lift_count < self.max_chain_lifts:
                     reward += 5
-                    self.chain_lift_count += 1
+                    state.chain_lift_count += 1
             
             # Penalty for removing pieces
-            if self.last_action == 18:
+            if state.last_action == 18:
                 reward -= 2
 
             # Reward for continuous building
@@ -130,52 +397,114 @@ class OpenRCT2Env(gym.Env):
             #    reward += 0.2
 
             # Big reward for completing the loop
-            if self.loop_completed:
+            if state.loop_completed:
                 reward += 100
             
             # Penalty for excessive height to discourage sky-high coasters
-            if self.current_position[2] > 22:
+            if state.position[2] > 22:
                 reward -= 0.2
 
             # Reward for building a longer track
             #if self.track_length > 50:
             #    reward += 0.5
 
-            # Punish going far away from start
-            if self._calculate_distance_to_start() > 40:
-                distance_to_start = self._calculate_distance_to_start()
-                reward -= max(0, distance_to_start[0] - 40) * 0.1
+            if self.distance_field is None:
+                # Punish going far away from start
+                distance_to_start = state.distance[0]
+                if distance_to_start > 40:
+                    reward -= max(0, distance_to_start - 40) * 0.1
 
-            # Encourage returning to start for longer tracks
-            if self.track_length > 40:
-                distance_to_start = self._calculate_distance_to_start()
-                reward += max(0, 40 - distance_to_start[0]) * 0.2
+                # Encourage returning to start for longer tracks
+                if state.length > 40:
+                    reward += max(0, 40 - distance_to_start) * 0.2
+            elif pieces_to_close != UNKNOWN and state.pieces_to_close[0] != UNKNOWN:
+                # Reward pieces that bring the loop closer to being closed and punish the ones
+                # that move it away, by the change in pieces needed to close it
+                reward += (pieces_to_close - state.pieces_to_close[0]) * 0.5
         else:
             # If segment could not be placed, punish the agent
             reward -= 0.5
-        print("Reward was: %s" % reward)
         return reward
 
     def _calculate_distance_to_start(self):
-        point_a = np.array(self.current_position)
-        point_b = np.array(self.goal_position)
-        distance = float(np.linalg.norm(point_a - point_b))
-        return np.array([distance], dtype=np.float32)
+        # Written to the episode's distance array, which is also the observation
+        self.state.distance[0] = math.dist(self.state.position, self.goal_position)
+        return self.state.distance
 
     def _is_trunkated(self):
-        return (self.steps >= self.max_steps or 
-                self.track_length >= self.max_track_length)
+        state = self.state
+        if state.steps >= self.max_steps or state.length >= self.max_track_length:
+            return True
+        # Stop early when the loop can't be closed in the steps that are left
+        if self.distance_field is not None and not state.loop_completed:
+            steps_to_close = state.closure_steps[-1]
+            if steps_to_close != UNKNOWN and steps_to_close > self.max_steps - state.steps:
+                log_event(self.log, logging.DEBUG, 'unrecoverable', steps=state.steps, steps_to_close=steps_to_close)
+                return True
+        return False
+
+    def _lookup_pieces_to_close(self, position, direction, slope):
+        goal = self.goal_position
+        return self.distance_field.lookup(position[0] - goal[0], position[1] - goal[1], position[2] - goal[2],
+                                          direction, slope)
+
+    def _update_closure(self, success, action):
+        # Look up the pieces to close the loop after the step, returns the number before it
+        state = self.state
+        before = int(state.pieces_to_close[0])
+        if not success:
+            return before
+        history = self.track_builder.history
+        slope = ACTION_SLOPES[history[-1][0]] if history else 0
+        pieces = self._lookup_pieces_to_close(state.position, state.direction, slope)
+        if action == REMOVE_PIECE:
+            state.closure_steps.pop()
+        else:
+            # Either build on from here or remove this piece and close the loop from the track before it
+            state.closure_steps.append(min(pieces, state.closure_steps[-1] + 1))
+        state.pieces_to_close[0] = pieces
+        return before
+
+    def _reset_closure(self):
+        # Fill the closure stack for the station and every piece in the track builder history
+        state = self.state
+        state.closure_steps = []
+        slope = 0
+        for action, position, direction in self.track_builder.history:
+            pieces = self._lookup_pieces_to_close(position, direction, slope)
+            state.closure_steps.append(min(pieces, state.closure_steps[-1] + 1) if state.closure_steps else pieces)
+            slope = ACTION_SLOPES[action]
+        pieces = self._lookup_pieces_to_close(state.position, state.direction, slope)
+        state.closure_steps.append(min(pieces, state.closure_steps[-1] + 1) if state.closure_steps else pieces)
+        state.pieces_to_close[0] = pieces
 
     def _get_observation(self):
+        # The arrays are the episode state's own buffers, valid until the next step. They are
+        # only checked against the observation space in debug mode.
+        state = self.state
+        if state.compact is not None:
+            encode_observation(state.compact, self.max_track_length, state.position, state.direction,
+                               self._calculate_distance_to_start()[0], state.length, state.last_piece_type,
+                               state.pieces_to_close[0] if self.distance_field is not None else None)
+            if self.debug and not self.observation_space.contains(state.compact):
+                raise ValueError(f"The compact observation is outside the defined space: {state.compact}")
+            return state.compact
+        state.position_array[:] = state.position
         observation = {
-            'track_pieces': np.array(self.track_pieces + [0] * (self.max_track_length - len(self.track_pieces)), dtype=np.int32),
-            'current_position': np.array(self.current_position, dtype=np.int32),
-            'current_direction': self.current_direction,
+            'track_pieces': state.pieces,
+            'current_position': state.position_array,
+            'current_direction': state.direction,
             'distance_to_start': self._calculate_distance_to_start(),
-            'track_length': self.track_length,
-            'last_piece_type': self.last_piece_type,
+            'track_length': state.length,
+            'last_piece_type': state.last_piece_type,
         }
-        
+        if self.distance_field is not None:
+            observation['pieces_to_close'] = state.pieces_to_close
+        if self.debug:
+            self._check_observation(observation)
+        return observation
+
+    def _check_observation(self, observation):
         # Check if any values exceed their space
         track_pieces_space = self.observation_space['track_pieces']
         if isinstance(track_pieces_space, gym.spaces.Box):
@@ -194,14 +523,29 @@ class OpenRCT2Env(gym.Env):
         
         if observation['last_piece_type'] >= self.observation_space['last_piece_type'].n:
             raise ValueError(f"last_piece_type value exceeds the defined space: {observation['last_piece_type']}")
-        
-        return observation
 
     def evaluate_ride(self):
     #TODO Fix run_ride_evaluation() and stop returning random values
-        excitement, intensity, nausea = self.ui_controller.run_ride_evaluation()
+        track_pieces = self.state.track_pieces.tolist()
+        ratings = self.rating_cache.get(track_pieces) if self.rating_cache is not None else None
+        if ratings is None and self.rating_model is not None:
+            ratings = self.rating_model.estimate(track_pieces)
+            if ratings is not None:
+                log_event(self.log, logging.INFO, 'ratings_estimated', ratings=ratings)
+        if ratings is None:
+            # The builder is left for the test run, so the next reset has to rebuild
+            self.track_known = False
+            self.ui_controller._place_entrance_exit()
+            ratings = self.ui_controller.run_ride_evaluation(track_length=self.state.length)
+            log_event(self.log, logging.INFO, 'ride_tested', ratings=ratings)
+            if None not in ratings:
+                if self.rating_cache is not None:
+                    self.rating_cache.put(track_pieces, ratings)
+                if self.rating_model is not None:
+                    self.rating_model.add(track_pieces, ratings)
+        excitement, intensity, nausea = ratings
         if excitement is None or intensity is None or nausea is None:
-            print("Failed to get ride ratings, using random values")
+            log_event(self.log, logging.WARNING, 'ratings_failed')
             return {
                 'excitement': np.random.randint(0, 100),
                 'intensity': np.random.randint(0, 100),
@@ -214,8 +558,29 @@ class OpenRCT2Env(gym.Env):
                 'nausea': nausea
             }
 
+    def poll_ratings(self, timeout=None):
+        # (episode id, ride rating) of the deferred evaluations that finished since the last poll
+        if self.evaluation_queue is None:
+            return []
+        return self.evaluation_queue.poll(timeout)
+
+    def report_latency(self):
+        # Log the latency summary and update the metrics file
+        log_event(self.log, logging.INFO, 'latency', steps=self.total_steps, summary=self.latency.summary())
+        if self.metrics_path:
+            self.latency.write(self.metrics_path)
+
     def close(self):
-        pass
+        if self.latency is not None and self.metrics_path:
+            self.latency.write(self.metrics_path)
+        if hasattr(self.ui_controller, 'close'):
+            self.ui_controller.close()
+        if self.placement_cache is not None:
+            self.placement_cache.close()
+        if self.rating_cache is not None:
+            self.rating_cache.close()
+        if self.evaluation_queue is not None:
+            self.evaluation_queue.close()
 
     def render(self):
         if self.render_mode == "human":
@@ -0,0 +1,141 @@
+"""Remembers which pieces could be placed after which track prefix.
+
+The game always gives the same answer for the same piece after the same track, so
+TrackBuilder looks every placement up here first and doesn't click pieces that are
+known to fail. The prefixes form a trie stored as an edge table in SQLite: the row for
+(parent node, action) holds the outcome, and its id is the node of the longer prefix
+when the piece was placed. The root, the bare station, is node 0.
+
+The database can be shared by several processes and training runs. It holds at most
+`max_entries` edges, the least recently used ones are evicted first. Lookups only read,
+when edges were last used is kept in memory and written every `flush_interval` lookups,
+before evicting and on close. Use one file per
+game setup, outcomes from a different build area or ride type don't carry over.
+
+A failure read from the screen can be a misread, so a piece is only skipped after it
+failed `min_failures` times in a row, and with `failure_ttl` only for that many seconds
+after its last failure. Every edge records the backend it came from (`source`), so the
+outcomes of one backend can be dropped with `purge`, and single edges with `invalidate`.
+"""
+import sqlite3
+import time
+
+ROOT = 0
+
+
+class PlacementCache:
+    def __init__(self, path, max_entries=1000000, timeout=30, flush_interval=1000, source=None, min_failures=1,
+                 failure_ttl=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.source = source  # Backend the outcomes come from, e.g. 'ui' or 'sim'
+        self.min_failures = min_failures  # Failures in a row before a piece is skipped
+        self.failure_ttl = failure_ttl  # Seconds a failure is trusted, None for ever
+        self.evict_interval = max(1, max_entries // 100)  # Inserts between size checks
+        self.flush_interval = flush_interval  # Used edges kept before their times are written
+        self.used = {}  # Edge -> last time a lookup found it, not written yet
+        self.inserts = 0
+        self.lookups = 0
+        self.hits = 0
+        self.skipped = 0  # Lookups answered with a known failure, so the game wasn't asked
+
+        # Autocommit with a write ahead log, so readers in other processes are never blocked
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS edges ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, parent INTEGER NOT NULL, action INTEGER NOT NULL, "
+            "success INTEGER NOT NULL, last_used REAL NOT NULL, failures INTEGER NOT NULL DEFAULT 0, "
+            "failed_at REAL, source TEXT, UNIQUE (parent, action))")
+        # Files written before failures and sources were recorded get the columns, their
+        # failures count once and have no source
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(edges)")}
+        if 'failures' not in columns:
+            self.connection.execute("ALTER TABLE edges ADD COLUMN failures INTEGER NOT NULL DEFAULT 0")
+            self.connection.execute("UPDATE edges SET failures = 1 WHERE success = 0")
+        if 'failed_at' not in columns:
+            self.connection.execute("ALTER TABLE edges ADD COLUMN failed_at REAL")
+            self.connection.execute("UPDATE edges SET failed_at = last_used WHERE success = 0")
+        if 'source' not in columns:
+            self.connection.execute("ALTER TABLE edges ADD COLUMN source TEXT")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS edges_last_used ON edges (last_used)")
+
+    def lookup(self, node, action):
+        """Return (success, child node) of placing `action` after `node`, (None, None) if unknown."""
+        self.lookups += 1
+        row = self.connection.execute(
+            "SELECT id, success, failures, failed_at FROM edges WHERE parent = ? AND action = ?",
+            (node, action)).fetchone()
+        if row is None:
+            return None, None
+        edge, success, failures, failed_at = row
+        if not success and (failures < self.min_failures or
+                            self.failure_ttl is not None and time.time() - failed_at > self.failure_ttl):
+            # Not failed often or recently enough to skip the piece, the game is asked again
+            return None, None
+        self.hits += 1
+        if not success:
+            self.skipped += 1
+        self.used[edge] = time.time()
+        if len(self.used) >= self.flush_interval:
+            self.flush()
+        return bool(success), edge if success else None
+
+    def flush(self):
+        # Write the last used times of the looked up edges in one transaction
+        if not self.used:
+            return
+        with self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.executemany("UPDATE edges SET last_used = ? WHERE id = ?",
+                                        [(used, edge) for edge, used in self.used.items()])
+        self.used.clear()
+
+    def record(self, node, action, success):
+        """Store the outcome of placing `action` after `node`, returns the child node if it was placed."""
+        now = time.time()
+        # Failures in a row are counted, a success resets the count
+        edge, = self.connection.execute(
+            "INSERT INTO edges (parent, action, success, last_used, failures, failed_at, source) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (parent, action) DO UPDATE SET success = excluded.success, last_used = excluded.last_used, "
+            "failures = CASE WHEN excluded.success THEN 0 ELSE failures + 1 END, "
+            "failed_at = COALESCE(excluded.failed_at, failed_at), source = excluded.source "
+            "RETURNING id", (node, action, int(success), now, 0 if success else 1, None if success else now,
+                             self.source)).fetchone()
+        self.inserts += 1
+        if self.inserts % self.evict_interval == 0:
+            self.evict()
+        return edge if success else None
+
+    def evict(self):
+        # Drop the least recently used edges, the prefixes below them are never reached
+        # again and age out on their own
+        self.flush()
+        count, = self.connection.execute("SELECT COUNT(*) FROM edges").fetchone()
+        if count > self.max_entries:
+            self.connection.execute(
+                "DELETE FROM edges WHERE id IN (SELECT id FROM edges ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,))
+
+    def invalidate(self, node, action):
+        # Forget the outcome of placing `action` after `node`, the prefixes below it age out
+        self.connection.execute("DELETE FROM edges WHERE parent = ? AND action = ?", (node, action))
+
+    def purge(self, source, failures_only=False):
+        """Delete the edges recorded by backend `source`, or only its failures, returns how many."""
+        query = "DELETE FROM edges WHERE source IS ?" + (" AND success = 0" if failures_only else "")
+        return self.connection.execute(query, (source,)).rowcount
+
+    def stats(self):
+        return {
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'skipped': self.skipped,
+            'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+        }
+
+    def close(self):
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,65 @@
+"""Stores the ratings of tested rides so the same design is never tested twice.
+
+Designs are keyed by a hash of their track pieces, the SQLite file can be shared by
+several processes and training runs. Use one file per game setup, the ratings of the
+same track differ between ride types and scenery.
+"""
+import hashlib
+import sqlite3
+
+
+def track_hash(track_pieces):
+    # Actions are all below 256, so one byte each gives a canonical encoding
+    return hashlib.sha256(bytes(int(action) for action in track_pieces)).hexdigest()
+
+
+class RatingCache:
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.lookups = 0
+        self.hits = 0
+        self.stores = 0
+
+        # Autocommit with a write ahead log, concurrent writers wait for each other up to `timeout`
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS ratings ("
+            "track TEXT PRIMARY KEY, excitement REAL NOT NULL, intensity REAL NOT NULL, "
+            "nausea REAL NOT NULL, pieces BLOB NOT NULL)")
+
+    def get(self, track_pieces):
+        """Return the (excitement, intensity, nausea) of the track, None if it was never tested."""
+        self.lookups += 1
+        row = self.connection.execute(
+            "SELECT excitement, intensity, nausea FROM ratings WHERE track = ?", (track_hash(track_pieces),)).fetchone()
+        if row is None:
+            return None
+        self.hits += 1
+        return row
+
+    def put(self, track_pieces, ratings):
+        excitement, intensity, nausea = ratings
+        self.connection.execute(
+            "INSERT OR REPLACE INTO ratings (track, excitement, intensity, nausea, pieces) VALUES (?, ?, ?, ?, ?)",
+            (track_hash(track_pieces), excitement, intensity, nausea, bytes(int(action) for action in track_pieces)))
+        self.stores += 1
+
+    def samples(self):
+        # Every tested track as (track pieces, ratings), e.g. to fit a RatingModel
+        rows = self.connection.execute("SELECT pieces, excitement, intensity, nausea FROM ratings").fetchall()
+        return [(list(pieces), ratings) for pieces, *ratings in rows]
+
+    def stats(self):
+        entries, = self.connection.execute("SELECT COUNT(*) FROM ratings").fetchone()
+        return {
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'stores': self.stores,
+            'entries': entries,
+            'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+        }
+
+    def close(self):
+        self.connection.close()
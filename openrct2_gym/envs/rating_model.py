@@ -0,0 +1,151 @@
+"""Estimates ride ratings from the track geometry so most rides don't need a test run.
+
+A Bayesian ridge regression maps features of the track (height profile, drops, turns,
+banking, chain lift and length) to excitement, intensity and nausea. Next to the
+estimate it gives its uncertainty, and only tracks the model is unsure about or that
+look exciting are tested in the game. Their ratings are added to the training data
+and the model is refitted as they come in.
+
+The model can be shared by the environment and the workers of an EvaluationQueue,
+adding samples, fitting and predicting hold a lock.
+"""
+import threading
+import numpy as np
+from .track_builder import TRACK_PIECES, move
+
+LEFT_TURNS = (1, 2, 7, 9, 11)
+RIGHT_TURNS = (3, 4, 8, 10, 12)
+BANKED = (11, 12, 13, 14)
+CHAIN_LIFT = 15
+
+
+def track_features(track_pieces, station_length=6):
+    """Return the feature vector of a track, the pieces after the station are walked with `move`."""
+    pieces = [action for action in track_pieces[station_length:] if action in TRACK_PIECES]
+    position, direction = [0, 0, 0], 0
+    heights = [0]
+    for action in pieces:
+        position, direction = move(action, position, direction)
+        heights.append(position[2])
+    heights = np.array(heights, dtype=np.float64)
+
+    # A drop is a run of pieces that keep going down, its height is the total descent
+    steps = np.diff(heights)
+    drops = []
+    descent = 0.0
+    for step in steps:
+        if step < 0:
+            descent -= step
+        elif descent:
+            drops.append(descent)
+            descent = 0.0
+    if descent:
+        drops.append(descent)
+
+    counts = np.bincount(np.array(pieces, dtype=np.int64), minlength=len(TRACK_PIECES))[:len(TRACK_PIECES)]
+    summary = [
+        len(track_pieces),
+        heights.max(),
+        heights.mean(),
+        len(drops),
+        max(drops, default=0.0),
+        sum(drops),
+        sum(counts[action] for action in LEFT_TURNS),
+        sum(counts[action] for action in RIGHT_TURNS),
+        sum(counts[action] for action in BANKED),
+        counts[CHAIN_LIFT],
+    ]
+    return np.concatenate([np.array(summary, dtype=np.float64), counts.astype(np.float64)])
+
+
+class RatingModel:
+    def __init__(self, alpha=1.0, max_std=0.5, min_samples=50, explore_excitement=6.0, refit_interval=10,
+                 station_length=6):
+        self.alpha = alpha  # Prior precision of the weights
+        self.max_std = max_std  # Estimates less certain than this are tested in the game
+        self.min_samples = min_samples  # Tested rides needed before estimating
+        self.explore_excitement = explore_excitement  # Rides estimated at least this exciting are tested
+        self.refit_interval = refit_interval  # New samples between refits
+        self.station_length = station_length
+        self.features = []
+        self.ratings = []
+        self.unfitted = 0
+        self.weights = None
+        self.lock = threading.Lock()
+
+    def add(self, track_pieces, ratings):
+        features = track_features(track_pieces, self.station_length)
+        with self.lock:
+            self.features.append(features)
+            self.ratings.append(np.array(ratings, dtype=np.float64))
+            self.unfitted += 1
+            if self.unfitted >= self.refit_interval:
+                self._fit()
+
+    def add_samples(self, samples):
+        # Add (track pieces, ratings) pairs, like RatingCache.samples(), and refit once
+        samples = [(track_features(track_pieces, self.station_length), np.array(ratings, dtype=np.float64))
+                   for track_pieces, ratings in samples]
+        with self.lock:
+            for features, ratings in samples:
+                self.features.append(features)
+                self.ratings.append(ratings)
+            self._fit()
+
+    def fit(self):
+        with self.lock:
+            self._fit()
+
+    def _fit(self):
+        self.unfitted = 0
+        if len(self.features) < self.min_samples:
+            return
+        features = np.array(self.features)
+        ratings = np.array(self.ratings)
+
+        # Standardised features with a bias column, so alpha means the same for every feature
+        self.mean = features.mean(axis=0)
+        self.scale = np.maximum(features.std(axis=0), 1e-6)
+        x = self._design(features)
+        precision = x.T @ x + self.alpha * np.eye(x.shape[1])
+        self.covariance = np.linalg.inv(precision)
+        self.weights = self.covariance @ x.T @ ratings
+        residuals = ratings - x @ self.weights
+        # The fit uses up its effective degrees of freedom, the trace of the hat matrix, which is
+        # the number of weights shrunk by alpha. Without them the noise comes out too small.
+        self.degrees_of_freedom = float(np.trace(self.covariance @ x.T @ x))
+        self.noise = (residuals ** 2).sum(axis=0) / max(1.0, len(ratings) - self.degrees_of_freedom)
+
+    def _design(self, features):
+        x = (features - self.mean) / self.scale
+        return np.hstack([np.ones((len(x), 1)), x])
+
+    def predict(self, track_pieces):
+        """Return the estimated (excitement, intensity, nausea) and their standard deviations."""
+        features = track_features(track_pieces, self.station_length)
+        with self.lock:
+            if self.weights is None:
+                return None, None
+            x = self._design(features[None])[0]
+            mean = x @ self.weights
+            std = np.sqrt(self.noise * (1 + x @ self.covariance @ x))
+        return mean, std
+
+    def estimate(self, track_pieces):
+        # The estimated ratings, None when the ride should be tested in the game instead
+        mean, std = self.predict(track_pieces)
+        if mean is None or std.max() > self.max_std or mean[0] >= self.explore_excitement:
+            return None
+        return tuple(float(value) for value in mean)
+
+    def save(self, path):
+        with self.lock:
+            features, ratings = np.array(self.features), np.array(self.ratings)
+        np.savez_compressed(path, features=features, ratings=ratings)
+
+    def load(self, path):
+        samples = np.load(path)
+        with self.lock:
+            self.features = list(samples['features'])
+            self.ratings = list(samples['ratings'])
+            self._fit()
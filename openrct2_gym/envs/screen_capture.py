@@ -0,0 +1,181 @@
+import time
+import numpy as np
+from PIL import ImageGrab
+
+
+class PILCapture:
+    """Grabs the screen with PIL, every grab allocates a new image and array."""
+
+    def grab(self, bbox):
+        return np.array(ImageGrab.grab(bbox=bbox))
+
+    def reconnect(self):
+        # Every grab connects by itself
+        pass
+
+    def close(self):
+        pass
+
+
+class MSSCapture:
+    """Grabs the screen with mss (XShmGetImage on X11) into preallocated buffers.
+
+    The BGRA pixels are viewed without copying and written as RGB into a buffer that
+    is allocated once per bbox and reused, so the returned array is only valid until
+    the same bbox is grabbed again.
+    """
+
+    def __init__(self):
+        try:
+            import mss
+        except ImportError:
+            raise ImportError("The mss capture backend needs the mss package, install it with: pip install mss")
+        self.mss = mss.mss
+        self.sct = self.mss()
+        self.buffers = {}
+
+    def grab(self, bbox):
+        left, top, right, bottom = bbox
+        width, height = right - left, bottom - top
+        shot = self.sct.grab({'left': left, 'top': top, 'width': width, 'height': height})
+        bgra = np.frombuffer(shot.raw, dtype=np.uint8).reshape(height, width, 4)
+
+        buffer = self.buffers.get(bbox)
+        if buffer is None:
+            buffer = self.buffers[bbox] = np.empty((height, width, 3), dtype=np.uint8)
+        np.copyto(buffer, bgra[:, :, 2::-1])
+        return buffer
+
+    def reconnect(self):
+        try:
+            self.sct.close()
+        except Exception:
+            pass
+        self.sct = self.mss()
+
+    def close(self):
+        self.sct.close()
+
+
+CAPTURE_BACKENDS = {
+    'pil': PILCapture,
+    'mss': MSSCapture,
+}
+
+
+def create_capture(name):
+    # Anything that isn't a name is taken to be a capture backend already
+    if not isinstance(name, str):
+        return name
+    if name not in CAPTURE_BACKENDS:
+        raise ValueError(f"Unknown capture backend: {name}")
+    return CAPTURE_BACKENDS[name]()
+
+
+class FrameCache:
+    """Captures one frame of a screen area and answers region queries as slices of it.
+
+    The UI only changes after we click, so the frame stays valid until `invalidate` is
+    called after a click. Regions outside the cached area are grabbed directly.
+    """
+
+    def __init__(self, bbox, grab):
+        self.bbox = bbox  # (left, top, right, bottom)
+        self.grab = grab
+        self.frame = None
+        self.grab_count = 0
+
+    def invalidate(self):
+        self.frame = None
+
+    def contains(self, bbox):
+        left, top, right, bottom = bbox
+        return (left >= self.bbox[0] and top >= self.bbox[1] and
+                right <= self.bbox[2] and bottom <= self.bbox[3])
+
+    def region(self, bbox):
+        if not self.contains(bbox):
+            self.grab_count += 1
+            return self.grab(bbox)
+
+        if self.frame is None:
+            self.grab_count += 1
+            self.frame = self.grab(self.bbox)
+        left, top, right, bottom = bbox
+        return self.frame[top - self.bbox[1]:bottom - self.bbox[1], left - self.bbox[0]:right - self.bbox[0]]
+
+
+class UIWaiter:
+    """Polls small screen regions until the UI reacts, instead of sleeping a fixed time.
+
+    Every wait returns as soon as the expected change is seen or the timeout passes, and
+    how long it took is recorded per label so the real UI latencies can be reported.
+    """
+
+    def __init__(self, grab, poll_interval=0.005, settle_time=0.035):
+        self.grab = grab
+        self.poll_interval = poll_interval
+        # A change has settled once the region stayed the same this long, about two frames of
+        # the game, so windows and texts drawn over several frames are complete
+        self.settle_time = settle_time
+        self.stats = {}  # label -> [count, total seconds, max seconds, timeouts]
+        self.recorder = None  # LatencyRecorder that also gets every wait
+
+    def wait_until(self, bbox, condition, timeout, label='wait', poll_interval=None):
+        # Wait until `condition(region)` is true, returns False on timeout
+        poll_interval = self.poll_interval if poll_interval is None else poll_interval
+        start = time.perf_counter()
+        while True:
+            done = condition(self.grab(bbox))
+            elapsed = time.perf_counter() - start
+            if done or elapsed >= timeout:
+                break
+            time.sleep(poll_interval)
+        self._record(label, elapsed, done)
+        return done
+
+    def wait_for_change(self, bbox, reference, timeout, label='wait', poll_interval=None):
+        # Wait until the region differs from `reference` and then stays the same for
+        # settle_time, so animations and redraws have finished
+        poll_interval = self.poll_interval if poll_interval is None else poll_interval
+        start = time.perf_counter()
+        changed = settled = False
+        previous = None
+        while True:
+            region = self.grab(bbox)
+            now = time.perf_counter()
+            elapsed = now - start
+            if not changed:
+                changed = not np.array_equal(region, reference)
+                stable_since = now
+            elif not np.array_equal(region, previous):
+                stable_since = now
+            settled = changed and now - stable_since >= self.settle_time
+            if settled or elapsed >= timeout:
+                break
+            # Grabs can reuse their buffer, so keep a copy of the last poll
+            previous = region.copy()
+            time.sleep(poll_interval)
+        self._record(label, elapsed, settled)
+        return changed
+
+    def _record(self, label, elapsed, done):
+        stats = self.stats.setdefault(label, [0, 0.0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+        if not done:
+            stats[3] += 1
+        if self.recorder is not None:
+            self.recorder.record('wait_' + label, elapsed)
+
+    def report(self):
+        return {
+            label: {
+                'count': count,
+                'mean': total / count,
+                'max': maximum,
+                'timeouts': timeouts,
+            }
+            for label, (count, total, maximum, timeouts) in self.stats.items()
+        }
@@ -0,0 +1,197 @@
+import numpy as np
+from .backend import GameBackend
+from .track_builder import DIRECTION_VECTORS, TRACK_PIECES, PIECE_ACTIONS, move
+
+# Slope of the track at the end of each piece type
+SLOPES = {
+    "steep_down": -2,
+    "down": -1,
+    "level": 0,
+    "up": 1,
+    "steep_up": 2,
+}
+
+
+def piece_slope(piece_type):
+    for slope in ("steep_down", "steep_up", "down", "up", "level"):
+        if slope in piece_type:
+            return SLOPES[slope]
+    return 0
+
+
+def piece_roll(piece_type):
+    # Bank at the end of a piece, -1 to the left and 1 to the right
+    if 'leftroll' in piece_type:
+        return -1
+    if 'rightroll' in piece_type:
+        return 1
+    return 0
+
+
+def piece_fits_after(action, slope, roll):
+    """Whether the piece of `action` can follow track that ends at `slope` and `roll`.
+
+    These are the transitions the game has track elements for: curves keep the slope and
+    bank they start with, straight pieces change the slope one step at a time, only bank
+    on level track and can't go from one bank straight to the other.
+    """
+    piece_type, forward = TRACK_PIECES[action][:2]
+    end_slope, end_roll = piece_slope(piece_type), piece_roll(piece_type)
+    if forward != 1:
+        return slope == end_slope and roll == end_roll
+    return (abs(end_slope - slope) <= 1 and (roll == 0 or slope == 0) and (end_roll == 0 or end_slope == 0) and
+            roll * end_roll >= 0)
+
+
+def piece_footprint(action, position, direction):
+    """Return the (x, y) tiles a piece covers when placed at `position` facing `direction`.
+
+    The piece first runs forward in the current direction and then steps sideways into
+    the turn, so the tile it ends on (the next build position) is never part of it.
+    """
+    _, forward, sideways, _, _ = TRACK_PIECES[action]
+    fx, fy = DIRECTION_VECTORS[direction]
+    rx, ry = DIRECTION_VECTORS[(direction + 1) % 4]
+    step = 1 if sideways > 0 else -1
+    tiles = [(position[0] + i * fx, position[1] + i * fy) for i in range(forward)]
+    x, y = tiles[-1]
+    for i in range(1, abs(sideways)):
+        tiles.append((x + i * step * rx, y + i * step * ry))
+    return tiles
+
+
+class VoxelGrid:
+    """3D occupancy grid of the build area, indexed by absolute track coordinates."""
+
+    def __init__(self, origin, size, height, clearance=2):
+        self.origin = np.array(origin, dtype=np.int64)
+        self.size = size
+        self.height = height
+        self.clearance = clearance
+        self.occupied = np.zeros((size[0], size[1], height), dtype=bool)
+
+    def clear(self):
+        self.occupied.fill(False)
+
+    def piece_voxels(self, action, position, direction):
+        # A piece fills every tile of its footprint from its lowest point up to its
+        # highest point plus the clearance the train needs above the track
+        start_z = position[2]
+        end_z = start_z + TRACK_PIECES[action][3]
+        bottom = min(start_z, end_z)
+        top = max(start_z, end_z) + self.clearance
+        return self._voxels(piece_footprint(action, position, direction), bottom, top)
+
+    def station_voxels(self, position, length):
+        tiles = [(position[0], position[1] + i) for i in range(length)]
+        return self._voxels(tiles, position[2], position[2] + self.clearance)
+
+    def _voxels(self, tiles, bottom, top):
+        tiles = np.array(tiles, dtype=np.int64) - self.origin[:2]
+        heights = np.arange(bottom, top, dtype=np.int64) - self.origin[2]
+        x = np.repeat(tiles[:, 0], len(heights))
+        y = np.repeat(tiles[:, 1], len(heights))
+        z = np.tile(heights, len(tiles))
+        return x, y, z
+
+    def fits(self, voxels):
+        x, y, z = voxels
+        if (np.any(x < 0) or np.any(x >= self.size[0]) or
+                np.any(y < 0) or np.any(y >= self.size[1]) or
+                np.any(z < 0) or np.any(z >= self.height)):
+            return False
+        return not np.any(self.occupied[x, y, z])
+
+    def fill(self, voxels):
+        self.occupied[voxels] = True
+
+    def free(self, voxels):
+        self.occupied[voxels] = False
+
+
+class SimController(GameBackend):
+    """Offline stand-in for UIController that builds the track in a voxel grid.
+
+    Pieces are rejected when they leave the build area, collide with already placed
+    track or break the slope and bank transitions the game allows (piece_fits_after). The
+    loop is completed when a level, unbanked piece ends at the south end of the station
+    facing north.
+    """
+
+    def __init__(self, grid_size=(64, 64), max_height=32, clearance=2):
+        self.station_length = 6
+        self.start_position = [500, 500, 0]
+        self.goal_position = [500, 500 - self.station_length, 0]
+        origin = (self.start_position[0] - grid_size[0] // 2,
+                  self.start_position[1] - grid_size[1] // 2,
+                  0)
+        self.grid = VoxelGrid(origin, grid_size, max_height, clearance)
+
+        self.position = list(self.start_position)
+        self.direction = 0
+        self.slope = 0
+        self.roll = 0
+        self.pieces = []  # Stack of (action, position, direction, slope, roll, voxels) tuples
+        self.station_built = False
+        self.loop_completed = False
+
+    def _placement(self, piece_type):
+        # The voxels `piece_type` would fill at the end of the track, None if it can't be placed
+        action = PIECE_ACTIONS.get(piece_type)
+        if action is None or not self.station_built or self.loop_completed:
+            return None
+
+        if not piece_fits_after(action, self.slope, self.roll):
+            return None
+
+        voxels = self.grid.piece_voxels(action, self.position, self.direction)
+        if not self.grid.fits(voxels):
+            return None
+        return voxels
+
+    def can_add_track_piece(self, piece_type):
+        return self._placement(piece_type) is not None
+
+    def add_track_piece(self, piece_type):
+        voxels = self._placement(piece_type)
+        if voxels is None:
+            return False
+
+        action = PIECE_ACTIONS[piece_type]
+        self.grid.fill(voxels)
+        self.pieces.append((action, self.position, self.direction, self.slope, self.roll, voxels))
+        self.position, self.direction = move(action, self.position, self.direction)
+        self.slope = piece_slope(piece_type)
+        self.roll = piece_roll(piece_type)
+        self.loop_completed = (self.position == self.goal_position and
+                               self.direction == 0 and self.slope == 0 and self.roll == 0)
+        return True
+
+    def remove_piece(self):
+        if not self.pieces:
+            return False
+        _, self.position, self.direction, self.slope, self.roll, voxels = self.pieces.pop()
+        self.grid.free(voxels)
+        self.loop_completed = False
+        return True
+
+    def start_new_rollercoaster(self):
+        self.grid.fill(self.grid.station_voxels(self.goal_position, self.station_length))
+        self.position = list(self.start_position)
+        self.direction = 0
+        self.slope = 0
+        self.roll = 0
+        self.station_built = True
+
+    def demolish_rollercoaster(self):
+        self.grid.clear()
+        self.pieces.clear()
+        self.station_built = False
+        self.loop_completed = False
+
+    def is_loop_completed(self):
+        return self.loop_completed
+
+    def run_ride_evaluation(self, timeout=None, track_length=None):
+        # Ratings need the game's physics, so the simulation has none to offer
+        return None, None, None
@@ -0,0 +1,126 @@
+"""Game backend that talks JSON lines to an OpenRCT2 scripting plugin over a socket.
+
+Every request is one JSON object on its own line:
+
+    {"id": 3, "command": "add_track_piece", "args": ["straight_level_noroll"]}
+
+and the plugin answers each request, in order, with one line:
+
+    {"id": 3, "result": true}
+    {"id": 3, "error": "Unknown piece type"}
+
+Requests are pipelined. Commands whose result the env never looks at, like
+demolishing the old coaster and building a new station on reset, are queued and
+written together with the next command that needs an answer, so a whole reset costs
+a single round trip. Batches of pieces are sent as one `add_track_pieces` command,
+and the pieces of a stored design as one `load_track_design` command.
+"""
+import json
+import socket
+from .backend import GameBackend, BackendError
+
+
+class SocketBackend(GameBackend):
+    def __init__(self, address=('localhost', 7777), timeout=60, station_length=6):
+        # A (host, port) tuple connects over TCP, a string path over a Unix socket
+        self.address = address
+        self.timeout = timeout
+        self.station_length = station_length
+        self.next_id = 0
+        self.pending = []  # Queued request lines whose responses haven't been read
+        self.socket = None
+        self.reader = None
+
+    def connect(self):
+        family = socket.AF_UNIX if isinstance(self.address, str) else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.settimeout(self.timeout)
+        self.socket.connect(self.address if family == socket.AF_UNIX else tuple(self.address))
+        if family == socket.AF_INET:
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.socket.makefile('r', encoding='utf-8')
+
+    def close(self):
+        if self.socket is not None:
+            self.reader.close()
+            self.socket.close()
+            self.socket = None
+            self.reader = None
+
+    def reconnect(self):
+        # The next command connects to the restarted game
+        self.close()
+        self.pending = []
+
+    def send(self, command, *args):
+        # Queue a command without waiting for its result
+        self.next_id += 1
+        request = {'id': self.next_id, 'command': command, 'args': list(args)}
+        self.pending.append((self.next_id, json.dumps(request)))
+
+    def flush(self):
+        # Write all queued commands at once and read back their results in order
+        if not self.pending:
+            return []
+        if self.socket is None:
+            self.connect()
+        pending, self.pending = self.pending, []
+        try:
+            self.socket.sendall(''.join(line + '\n' for _, line in pending).encode('utf-8'))
+        except OSError as e:
+            self.close()
+            raise BackendError(f"Connection to the game was closed: {e}")
+
+        # Read every response before raising so the stream stays in sync
+        results = []
+        error = None
+        for request_id, _ in pending:
+            line = self.reader.readline()
+            if not line:
+                self.close()
+                raise BackendError("Connection to the game was closed")
+            response = json.loads(line)
+            if response.get('id') != request_id:
+                self.close()
+                raise BackendError(f"Expected response {request_id}, got {response.get('id')}")
+            if 'error' in response and error is None:
+                error = BackendError(response['error'])
+            results.append(response.get('result'))
+        if error is not None:
+            raise error
+        return results
+
+    def call(self, command, *args):
+        self.send(command, *args)
+        return self.flush()[-1]
+
+    def add_track_piece(self, piece_type):
+        return bool(self.call('add_track_piece', piece_type))
+
+    def add_track_pieces(self, piece_types):
+        return int(self.call('add_track_pieces', list(piece_types)))
+
+    def remove_piece(self):
+        return bool(self.call('remove_piece'))
+
+    def remove_pieces(self, count):
+        return int(self.call('remove_pieces', count))
+
+    def load_track_design(self, piece_types):
+        return int(self.call('load_track_design', list(piece_types)))
+
+    def start_new_rollercoaster(self):
+        self.send('start_new_rollercoaster')
+
+    def demolish_rollercoaster(self):
+        self.send('demolish_rollercoaster')
+
+    def is_loop_completed(self):
+        return bool(self.call('is_loop_completed'))
+
+    def _place_entrance_exit(self):
+        self.send('place_entrance_exit')
+
+    def run_ride_evaluation(self, timeout=None, track_length=None):
+        excitement, intensity, nausea = self.call('run_ride_evaluation', timeout, track_length)
+        return excitement, intensity, nausea
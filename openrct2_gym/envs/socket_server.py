@@ -0,0 +1,90 @@
+"""Python stand-in for the OpenRCT2 plugin side of the SocketBackend protocol.
+
+It answers the JSON lines protocol with any GameBackend, by default the offline
+SimController, so SocketBackend can be used and tested without the game:
+
+    python -m openrct2_gym.envs.socket_server --port 7777
+"""
+import argparse
+import json
+import os
+import socketserver
+from .sim_controller import SimController
+
+# Protocol command -> backend method
+COMMANDS = {
+    'add_track_piece': 'add_track_piece',
+    'add_track_pieces': 'add_track_pieces',
+    'remove_piece': 'remove_piece',
+    'remove_pieces': 'remove_pieces',
+    'start_new_rollercoaster': 'start_new_rollercoaster',
+    'demolish_rollercoaster': 'demolish_rollercoaster',
+    'is_loop_completed': 'is_loop_completed',
+    'load_track_design': 'load_track_design',
+    'place_entrance_exit': '_place_entrance_exit',
+    'run_ride_evaluation': 'run_ride_evaluation',
+}
+
+
+class BackendRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # Every connection gets its own game, like a separate OpenRCT2 instance
+        backend = self.server.backend_factory()
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = self.server.handle_request(backend, line)
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class _BackendServerMixin:
+    def handle_request(self, backend, line):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            method = COMMANDS.get(request.get('command'))
+            if method is None:
+                return {'id': request_id, 'error': f"Unknown command: {request.get('command')}"}
+            result = getattr(backend, method)(*request.get('args', []))
+            return {'id': request_id, 'result': result}
+        except Exception as e:
+            return {'id': request_id, 'error': str(e)}
+
+
+class BackendServer(_BackendServerMixin, socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('localhost', 7777), backend_factory=SimController):
+        self.backend_factory = backend_factory
+        super(BackendServer, self).__init__(tuple(address), BackendRequestHandler)
+
+
+class UnixBackendServer(_BackendServerMixin, socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, address, backend_factory=SimController):
+        self.backend_factory = backend_factory
+        if os.path.exists(address):
+            os.remove(address)
+        super(UnixBackendServer, self).__init__(address, BackendRequestHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the simulated game over the SocketBackend protocol")
+    parser.add_argument("--host", type=str, default="localhost", help="Host to listen on")
+    parser.add_argument("--port", type=int, default=7777, help="TCP port to listen on")
+    parser.add_argument("--unix-socket", type=str, help="Listen on this Unix socket path instead of TCP")
+    args = parser.parse_args()
+
+    if args.unix_socket:
+        server = UnixBackendServer(args.unix_socket)
+    else:
+        server = BackendServer((args.host, args.port))
+    print(f"Serving simulated game on {server.server_address}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
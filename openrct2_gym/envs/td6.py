@@ -0,0 +1,244 @@
+"""Reads and writes RCT2 track designs (.td6) for the action vocabulary of TrackBuilder.
+
+A .td6 file is the RLE compressed design followed by a 4 byte checksum. The design
+starts with a 0xA3 byte header (ride type, vehicle, colours, stats, ...) followed by
+the track elements as (element type, flags) byte pairs ended by 0xFF, the entrance
+and exit elements ended by 0xFF and the scenery ended by 0xFF.
+
+The track builder only selects the shape of the next piece and the slope and roll it
+ends at, the game picks the element that connects it to the previous one. Writing a
+design replays that choice, and reading one maps every element back to the action
+that builds it. Which pieces can follow each other is decided by piece_fits_after of
+the simulation, so every track it builds has an element for every piece. Designs are written without entrance, exit or scenery, and with the
+header values of a new Wooden Roller Coaster.
+"""
+import struct
+from .sim_controller import piece_fits_after, piece_roll, piece_slope
+from .track_builder import TRACK_PIECES
+
+# OpenRCT2 track element types
+FLAT = 0
+END_STATION = 1
+BEGIN_STATION = 2
+MIDDLE_STATION = 3
+STATION_ELEMENTS = (END_STATION, BEGIN_STATION, MIDDLE_STATION)
+
+# (start slope, end slope, start roll, end roll) -> straight track element type
+# Slopes are the sim's -2..2, roll is -1 for a left bank and 1 for a right bank
+STRAIGHT_ELEMENTS = {
+    (0, 0, 0, 0): FLAT,
+    (1, 1, 0, 0): 4,     # Up25
+    (2, 2, 0, 0): 5,     # Up60
+    (0, 1, 0, 0): 6,     # FlatToUp25
+    (1, 2, 0, 0): 7,     # Up25ToUp60
+    (2, 1, 0, 0): 8,     # Up60ToUp25
+    (1, 0, 0, 0): 9,     # Up25ToFlat
+    (-1, -1, 0, 0): 10,  # Down25
+    (-2, -2, 0, 0): 11,  # Down60
+    (0, -1, 0, 0): 12,   # FlatToDown25
+    (-1, -2, 0, 0): 13,  # Down25ToDown60
+    (-2, -1, 0, 0): 14,  # Down60ToDown25
+    (-1, 0, 0, 0): 15,   # Down25ToFlat
+    (0, 0, 0, -1): 18,   # FlatToLeftBank
+    (0, 0, 0, 1): 19,    # FlatToRightBank
+    (0, 0, -1, 0): 20,   # LeftBankToFlat
+    (0, 0, 1, 0): 21,    # RightBankToFlat
+    (0, 1, -1, 0): 24,   # LeftBankToUp25
+    (0, 1, 1, 0): 25,    # RightBankToUp25
+    (1, 0, 0, -1): 26,   # Up25ToLeftBank
+    (1, 0, 0, 1): 27,    # Up25ToRightBank
+    (0, -1, -1, 0): 28,  # LeftBankToDown25
+    (0, -1, 1, 0): 29,   # RightBankToDown25
+    (-1, 0, 0, -1): 30,  # Down25ToLeftBank
+    (-1, 0, 0, 1): 31,   # Down25ToRightBank
+    (0, 0, -1, -1): 32,  # LeftBank
+    (0, 0, 1, 1): 33,    # RightBank
+}
+
+# Turn action -> track element type, turns start and end at their slope and bank
+CURVE_ELEMENTS = {
+    1: 16,   # LeftQuarterTurn5Tiles
+    3: 17,   # RightQuarterTurn5Tiles
+    11: 22,  # BankedLeftQuarterTurn5Tiles
+    12: 23,  # BankedRightQuarterTurn5Tiles
+    7: 34,   # LeftQuarterTurn5TilesUp25
+    8: 35,   # RightQuarterTurn5TilesUp25
+    9: 36,   # LeftQuarterTurn5TilesDown25
+    10: 37,  # RightQuarterTurn5TilesDown25
+    2: 42,   # LeftQuarterTurn3Tiles
+    4: 43,   # RightQuarterTurn3Tiles
+}
+CURVE_ACTIONS = {element: action for action, element in CURVE_ELEMENTS.items()}
+
+# (end slope, end roll) -> straight action that ends there
+STRAIGHT_ACTIONS = {
+    (0, 0): 0,
+    (-1, 0): 5,
+    (1, 0): 6,
+    (0, -1): 13,
+    (0, 1): 14,
+    (-2, 0): 16,
+    (2, 0): 17,
+}
+CHAIN_ACTION = 15
+
+CHAIN_LIFT_FLAG = 0x80
+END_OF_SECTION = 0xFF
+HEADER_SIZE = 0xA3
+CHECKSUM_OFFSET = 0x1D4C1
+
+# Header of a new Wooden Roller Coaster
+WOODEN_ROLLER_COASTER = 52
+WOODEN_ROLLER_COASTER_VEHICLE = 'PTCT1'
+
+
+def encode_track(track_pieces, station_length=6):
+    """Return the (element type, flags) pairs of `track_pieces`, which start with the station."""
+    if len(track_pieces) < station_length:
+        raise ValueError(f"A track needs at least the {station_length} station pieces")
+    elements = [(BEGIN_STATION, 0)]
+    elements += [(MIDDLE_STATION, 0)] * (station_length - 2)
+    elements.append((END_STATION, 0))
+
+    slope = roll = 0
+    for index, action in enumerate(track_pieces[station_length:], station_length):
+        if action not in TRACK_PIECES:
+            raise ValueError(f"Unknown action {action} at piece {index}")
+        piece_type = TRACK_PIECES[action][0]
+        if not piece_fits_after(action, slope, roll):
+            raise ValueError(f"{piece_type} can't follow track with slope {slope} and roll {roll} at piece {index}")
+        end_slope = piece_slope(piece_type)
+        end_roll = piece_roll(piece_type)
+        if action in CURVE_ELEMENTS:
+            element = CURVE_ELEMENTS[action]
+        else:
+            element = STRAIGHT_ELEMENTS[(slope, end_slope, roll, end_roll)]
+        flags = CHAIN_LIFT_FLAG if piece_type.endswith('_chain') else 0
+        elements.append((element, flags))
+        slope, roll = end_slope, end_roll
+    return elements
+
+
+def decode_track(elements):
+    """Return the track pieces of a list of (element type, flags) pairs."""
+    track_pieces = []
+    for index, (element, flags) in enumerate(elements):
+        if element in STATION_ELEMENTS:
+            track_pieces.append(0)
+        elif element in CURVE_ACTIONS:
+            track_pieces.append(CURVE_ACTIONS[element])
+        else:
+            ends = [key[1::2] for key, value in STRAIGHT_ELEMENTS.items() if value == element]
+            if not ends:
+                raise ValueError(f"Track element {element} at piece {index} has no matching action")
+            action = STRAIGHT_ACTIONS[ends[0]]
+            if action == 6 and flags & CHAIN_LIFT_FLAG:
+                action = CHAIN_ACTION
+            track_pieces.append(action)
+    return track_pieces
+
+
+def rle_encode(data):
+    # Runs of 3 to 125 equal bytes become (257 - count, byte), everything else is
+    # copied in literal blocks of up to 125 bytes prefixed with (count - 1)
+    encoded = bytearray()
+    literal = bytearray()
+    i = 0
+    while i < len(data):
+        run = 1
+        while i + run < len(data) and run < 125 and data[i + run] == data[i]:
+            run += 1
+        if run >= 3:
+            if literal:
+                encoded += bytes([len(literal) - 1]) + literal
+                literal = bytearray()
+            encoded += bytes([257 - run, data[i]])
+            i += run
+        else:
+            literal.append(data[i])
+            i += 1
+            if len(literal) == 125:
+                encoded += bytes([len(literal) - 1]) + literal
+                literal = bytearray()
+    if literal:
+        encoded += bytes([len(literal) - 1]) + literal
+    return bytes(encoded)
+
+
+def rle_decode(data):
+    decoded = bytearray()
+    i = 0
+    while i < len(data):
+        code = data[i]
+        if code & 0x80:
+            decoded += bytes([data[i + 1]]) * (257 - code)
+            i += 2
+        else:
+            decoded += data[i + 1:i + 2 + code]
+            i += 2 + code
+    return bytes(decoded)
+
+
+def checksum(data):
+    value = 0
+    for byte in data:
+        value = (value & 0xFFFFFF00) | ((value + byte) & 0xFF)
+        value = ((value << 3) | (value >> 29)) & 0xFFFFFFFF
+    return (value - CHECKSUM_OFFSET) & 0xFFFFFFFF
+
+
+def _header(elements, ride_type, vehicle):
+    header = bytearray(HEADER_SIZE)
+    header[0x00] = ride_type
+    header[0x07] = 2 << 2  # Design version 2 (RCT2), colour scheme 0
+    header[0x4C] = 1  # Trains
+    header[0x4D] = 6  # Cars per train
+    header[0x4E] = 10  # Minimum waiting time
+    header[0x4F] = 60  # Maximum waiting time
+    # Official ride object entry: flags, 8 character name and checksum
+    struct.pack_into('<I8sI', header, 0x70, 0x00008000, vehicle.ljust(8).encode('ascii'), 0)
+    header[0x80] = header[0x81] = min(len(elements), 0xFF)  # Space required, recalculated by the game
+    header[0xA2] = (1 << 5) | 5  # 1 circuit, lift hill speed 5
+    return bytes(header)
+
+
+def write_td6(track_pieces, station_length=6, ride_type=WOODEN_ROLLER_COASTER, vehicle=WOODEN_ROLLER_COASTER_VEHICLE):
+    """Return `track_pieces` as the bytes of a .td6 file."""
+    elements = encode_track(track_pieces, station_length)
+    design = bytearray(_header(elements, ride_type, vehicle))
+    for element, flags in elements:
+        design += bytes([element, flags])
+    design.append(END_OF_SECTION)  # Track
+    design.append(END_OF_SECTION)  # Entrances and exits
+    design.append(END_OF_SECTION)  # Scenery
+    encoded = rle_encode(design)
+    return encoded + struct.pack('<I', checksum(encoded))
+
+
+def read_td6(data):
+    """Return the track pieces of the .td6 file `data`.
+
+    Raises ValueError if the checksum doesn't match or the design uses elements the
+    track builder can't place.
+    """
+    encoded, (expected,) = data[:-4], struct.unpack('<I', data[-4:])
+    if checksum(encoded) != expected:
+        raise ValueError("The track design checksum doesn't match")
+    design = rle_decode(encoded)
+
+    elements = []
+    offset = HEADER_SIZE
+    while offset < len(design) and design[offset] != END_OF_SECTION:
+        elements.append((design[offset], design[offset + 1]))
+        offset += 2
+    return decode_track(elements)
+
+
+def save_td6(path, track_pieces, station_length=6, **kwargs):
+    with open(path, 'wb') as f:
+        f.write(write_td6(track_pieces, station_length, **kwargs))
+
+
+def load_td6(path):
+    with open(path, 'rb') as f:
+        return read_td6(f.read())
@@ -1,263 +1,89 @@
+from .placement_cache import ROOT
+
+# Direction vectors indexed by direction
+DIRECTION_VECTORS = [
+    (0, 1),   # North (0)
+    (1, 0),   # East (1)
+    (0, -1),  # South (2)
+    (-1, 0)   # West (3)
+]
+
+# Action -> (piece type, steps forward, steps sideways, height change, direction change)
+# Sideways steps are positive to the right, a direction change of 1 is a clockwise turn.
+TRACK_PIECES = {
+    0: ("straight_level_noroll", 1, 0, 0, 0),
+    1: ("left_level_noroll", 3, -2, 0, -1),
+    2: ("small_left_level_noroll", 2, -1, 0, -1),
+    3: ("right_level_noroll", 3, 2, 0, 1),
+    4: ("small_right_level_noroll", 2, 1, 0, 1),
+    5: ("straight_down_noroll", 1, 0, -1, 0),
+    6: ("straight_up_noroll", 1, 0, 1, 0),
+    7: ("left_up_noroll", 3, -2, 3, -1),
+    8: ("right_up_noroll", 3, 2, 3, 1),
+    9: ("left_down_noroll", 3, -2, -3, -1),
+    10: ("right_down_noroll", 3, 2, -3, 1),
+    11: ("left_level_leftroll", 3, -2, 0, -1),
+    12: ("right_level_rightroll", 3, 2, 0, 1),
+    13: ("straight_level_leftroll", 1, 0, 0, 0),
+    14: ("straight_level_rightroll", 1, 0, 0, 0),
+    15: ("straight_up_noroll_chain", 1, 0, 1, 0),
+    16: ("straight_steep_down_noroll", 1, 0, -2, 0),
+    17: ("straight_steep_up_noroll", 1, 0, 2, 0),
+}
+
+# Action 18 removes the last piece
+REMOVE_PIECE = 18
+
+# Piece type -> action
+PIECE_ACTIONS = {piece[0]: action for action, piece in TRACK_PIECES.items()}
+
+
+def move(action, position, direction):
+    """Return the position and direction after placing `action` at `position` facing `direction`."""
+    _, forward, sideways, height, turn = TRACK_PIECES[action]
+    new_position = list(position)
+
+    # Move forward in the current direction (x and y only)
+    dx, dy = DIRECTION_VECTORS[direction]
+    new_position[0] += forward * dx
+    new_position[1] += forward * dy
+
+    # Move sideways, the vector to the right is the next direction clockwise
+    dx, dy = DIRECTION_VECTORS[(direction + 1) % 4]
+    new_position[0] += sideways * dx
+    new_position[1] += sideways * dy
+
+    new_position[2] += height
+    return new_position, (direction + turn) % 4
+
+
 class TrackBuilder:
-    def __init__(self, ui_controller):
+    def __init__(self, ui_controller, placement_cache=None):
         self.ui_controller = ui_controller
-        self.direction_vectors = [
-            (0, 1),   # North (0)
-            (1, 0),   # East (1)
-            (0, -1),  # South (2)
-            (-1, 0)   # West (3)
-        ]
-        self.history = []  # List to store (action, position, direction) tuples
+        self.direction_vectors = DIRECTION_VECTORS
+        self.history = []  # (action, position, direction) of every piece, positions are tuples so they can be shared
+        self.placement_cache = placement_cache
+        self.cache_path = [ROOT]  # Placement cache node of every prefix of the history
+
+    def clear(self):
+        self.history.clear()
+        self.cache_path = [ROOT]
+
+    def _cache_node(self):
+        # The node of the current track, pieces in the history are known to fit
+        del self.cache_path[len(self.history) + 1:]
+        while len(self.cache_path) <= len(self.history):
+            action = self.history[len(self.cache_path) - 1][0]
+            self.cache_path.append(self.placement_cache.record(self.cache_path[-1], action, True))
+        return self.cache_path[-1]
 
-    
     def take_action(self, action, current_position, current_direction):
-        success = False
-        new_position = current_position.copy()
+        # Positions are returned as tuples
+        current_position = tuple(current_position)
+        new_position = current_position
         new_direction = current_direction
-   
-        # Map action to track piece and call appropriate method
-        if action == 0:
-            success = self.ui_controller.add_track_piece("straight_level_noroll")
-            if success:
-                # Move 1 step in the current direction (x and y only)
-                dx, dy = self.direction_vectors[current_direction]
-                new_position[0] += dx
-                new_position[1] += dy
-                # Z (height) doesn't change for level pieces
-        elif action == 1:
-            success = self.ui_controller.add_track_piece("left_level_noroll")
-            if success:
-                # Move 3 steps forward and 2 steps left (x and y only)
-                dx, dy = self.direction_vectors[current_direction]
-                new_position[0] += 3 * dx
-                new_position[1] += 3 * dy
-
-                left_direction = (current_direction - 1) % 4
-                dx, dy = self.direction_vectors[left_direction]
-                new_position[0] += 2 * dx
-                new_position[1] += 2 * dy
-
-                # Z (height) doesn't change for level pieces
-
-                # Update direction (turn counter-clockwise)
-                new_direction = (current_direction - 1) % 4
-        elif action == 2:
-            success = self.ui_controller.add_track_piece("small_left_level_noroll")
-            if success:
-                # Move 2 steps forward and 1 steps left
-                dx, dy = self.direction_vectors[current_direction]
-                new_position[0] += 2 * dx
-                new_position[1] += 2 * dy
-
-                left_direction = (current_direction - 1) % 4
-                dx, dy = self.direction_vectors[left_direction]
-                new_position[0] += 1 * dx
-                new_position[1] += 1 * dy
-
-                # Update direction (turn counter-clockwise)
-                new_direction = (current_direction - 1) % 4
-        elif action == 3:
-            success = self.ui_controller.add_track_piece("right_level_noroll")
-            if success:
-                # Move 3 steps forward and 2 steps right (x and y only)
-                dx, dy = self.direction_vectors[current_direction]
-                new_position[0] += 3 * dx
-                new_position[1] += 3 * dy
-
-                right_direction = (current_direction + 1) % 4
-                dx, dy = self.direction_vectors[right_direction]
-                new_position[0] += 2 * dx
-                new_position[1] += 2 * dy
-
-                # Z (height) doesn't change for level pieces
-
-                # Update direction (turn clockwise)
-                new_direction = (current_direction + 1) % 4
-        elif action == 4:
-            success = self.ui_controller.add_track_piece("small_right_level_noroll")
-            if success:
-                # Move 2 steps forward and 1 steps right (x and y only)
-                dx, dy = self.direction_vectors[current_direction]
-                new_position[0] += 2 * dx
-                new_position[1] += 2 * dy
-
-                right_direction = (current_direction + 1) % 4
-                dx, dy = self.direction_vectors[right_direction]
-                new_position[0] += 1 * dx
-                new_position[1] += 1 * dy
-
-                # Z (height) doesn't change for level pieces
-
-                # Update direction (turn clockwise)
-                new_direction = (current_direction + 1) % 4
-        elif action == 5:
-            success = self.ui_controller.add_track_piece("straight_down_noroll")
-            if success:
-                # Move 1 step in the current direction (x and y only)
-                dx, dy = self.direction_vectors[current_direction]
-                new_position[0] += dx
-                new_position[1] += dy
-                # Z (height) decrease by 1
-                new_position[2] -= 1
-        elif action == 6:
-            success = self.ui_controller.add_track_piece("straight_up_noroll")
-            if success:
-                # Move 1 step in the current direction (x and y only)
-                dx, dy = self.direction_vectors[current_direction]
-                new_position[0] += dx
-                new_position[1] += dy
-                # Z (height) increase by 1
-                new_position[2] += 1
-        elif action == 7:
-            success = self.ui_controller.add_track_piece("left_up_noroll")
-            if success:
-                # Move 3 steps forward, 2 steps left, and 3 steps up
-                dx, dy = self.direction_vectors[current_direction]
-                new_position[0] += 3 * dx
-                new_position[1] += 3 * dy
-
-                left_direction = (current_direction - 1) % 4
-                dx, dy = self.direction_vectors[left_direction]
-                new_position[0] += 2 * dx
-                new_position[1] += 2 * dy
-
-                # Move 3 steps up
-                new_position[2] += 3
-
-                # Update direction (turn counter-clockwise)
-                new_direction = (current_direction - 1) % 4
-        elif action == 8:
-            success = self.ui_controller.add_track_piece("right_up_noroll")
-            if success:
-                # Move 3 steps forward, 2 steps right, and 3 steps up
-                dx, dy = self.direction_vectors[current_direction]
-                new_position[0] += 3 * dx
-                new_position[1] += 3 * dy
-
-                right_direction = (current_direction + 1) % 4
-                dx, dy = self.direction_vectors[right_direction]
-                new_position[0] += 2 * dx
-                new_position[1] += 2 * dy
 
-                # Move 3 steps up
-                new_position[2] += 3
-
-                # Update direction (turn clockwise)
-                new_direction = (current_direction + 1) % 4
-        elif action == 9:
-            success = self.ui_controller.add_track_piece("left_down_noroll")
-            if success:
-                # Move 3 steps forward, 2 steps left
-                dx, dy = self.direction_vectors[current_direction]
-                new_position[0] += 3 * dx
-                new_position[1] += 3 * dy
-
-                left_direction = (current_direction - 1) % 4
-                dx, dy = self.direction_vectors[left_direction]
-                new_position[0] += 2 * dx
-                new_position[1] += 2 * dy
-
-                # Move 3 steps down
-                new_position[2] -= 3
-
-                # Update direction (turn counter-clockwise)
-                new_direction = (current_direction - 1) % 4
-        elif action == 10:
-            success = self.ui_controller.add_track_piece("right_down_noroll")
-            if success:
-                # Move 3 steps forward, 2 steps right
-                dx, dy = self.direction_vectors[current_direction]
-                new_position[0] += 3 * dx
-                new_position[1] += 3 * dy
-
-                right_direction = (current_direction + 1) % 4
-                dx, dy = self.direction_vectors[right_direction]
-                new_position[0] += 2 * dx
-                new_position[1] += 2 * dy
-
-                # Move 3 steps down
-                new_position[2] -= 3
-
-                # Update direction (turn clockwise)
-                new_direction = (current_direction + 1) % 4
-        elif action == 11:
-            success = self.ui_controller.add_track_piece("left_level_leftroll")
-            if success:
-                # Move 3 steps forward and 2 steps left (x and y only)
-                dx, dy = self.direction_vectors[current_direction]
-                new_position[0] += 3 * dx
-                new_position[1] += 3 * dy
-
-                left_direction = (current_direction - 1) % 4
-                dx, dy = self.direction_vectors[left_direction]
-                new_position[0] += 2 * dx
-                new_position[1] += 2 * dy
-
-                # Z (height) doesn't change for level pieces
-
-                # Update direction (turn counter-clockwise)
-                new_direction = (current_direction - 1) % 4
-        elif action == 12:
-            success = self.ui_controller.add_track_piece("right_level_rightroll")
-            if success:
-                # Move 3 steps forward and 2 steps right (x and y only)
-                dx, dy = self.direction_vectors[current_direction]
-                new_position[0] += 3 * dx
-                new_position[1] += 3 * dy
-
-                right_direction = (current_direction + 1) % 4
-                dx, dy = self.direction_vectors[right_direction]
-                new_position[0] += 2 * dx
-                new_position[1] += 2 * dy
-
-                # Z (height) doesn't change for level pieces
-
-                # Update direction (turn clockwise)
-                new_direction = (current_direction + 1) % 4
-        elif action == 13:
-            success = self.ui_controller.add_track_piece("straight_level_leftroll")
-            if success:
-                # Move 1 step in the current direction (x and y only)
-                dx, dy = self.direction_vectors[current_direction]
-                new_position[0] += dx
-                new_position[1] += dy
-                # Z (height) doesn't change for level pieces
-        elif action == 14:
-            success = self.ui_controller.add_track_piece("straight_level_rightroll")
-            if success:
-                # Move 1 step in the current direction (x and y only)
-                dx, dy = self.direction_vectors[current_direction]
-                new_position[0] += dx
-                new_position[1] += dy
-                # Z (height) doesn't change for level pieces
-        elif action == 15:
-            success = self.ui_controller.add_track_piece("straight_up_noroll_chain")
-            if success:
-                # Move 1 step in the current direction (x and y only)
-                dx, dy = self.direction_vectors[current_direction]
-                new_position[0] += dx
-                new_position[1] += dy
-                # Z (height) increase by 1
-                new_position[2] += 1
-        elif action == 16:
-            success = self.ui_controller.add_track_piece("straight_steep_down_noroll")
-            if success:
-                # Move 1 step in the current direction (x and y only)
-                dx, dy = self.direction_vectors[current_direction]
-                new_position[0] += dx
-                new_position[1] += dy
-                # Z (height) decrease by 2
-                new_position[2] -= 2
-        elif action == 17:
-            success = self.ui_controller.add_track_piece("straight_steep_up_noroll")
-            if success:
-                # Move 1 step in the current direction (x and y only)
-                dx, dy = self.direction_vectors[current_direction]
-                new_position[0] += dx
-                new_position[1] += dy
-                # Z (height) decrease by 1
-                new_position[2] += 2
-        elif action == 18:
+        if action == REMOVE_PIECE:
             if not self.history:
                 # The first action can not be to remove a piece
                 return False, new_position, new_direction
@@ -266,9 +92,58 @@ class TrackBuilder:
                 # Revert to the previous state
                 previous_action, new_position, new_direction = self.history.pop()
             return success, new_position, new_direction
-        if success and action != 18:
+
+        if action not in TRACK_PIECES:
+            return False, new_position, new_direction
+
+        # Pieces known to fail after this track aren't tried again
+        if self.placement_cache is not None:
+            node = self._cache_node()
+            known, child = self.placement_cache.lookup(node, action)
+            if known is False:
+                return False, new_position, new_direction
+
+        # Map action to track piece and place it
+        piece_type = TRACK_PIECES[action][0]
+        success = self.ui_controller.add_track_piece(piece_type)
+        if self.placement_cache is not None and known is not success:
+            child = self.placement_cache.record(node, action, success)
+        if success:
+            new_position, new_direction = move(action, current_position, current_direction)
+            new_position = tuple(new_position)
             # Add the current state to history before updating
-            self.history.append((action, current_position.copy(), current_direction))
+            self.history.append((action, current_position, current_direction))
+            if self.placement_cache is not None:
+                self.cache_path.append(child)
 
         return success, new_position, new_direction
 
+    def snapshot(self):
+        # The history as nested tuples, cheap to copy and safe to share
+        return tuple(self.history)
+
+    def restore(self, snapshot):
+        """Make the built track match `snapshot`, touching only the pieces after the shared prefix.
+
+        Returns True if the backend removed and placed every piece, the history then matches the
+        snapshot. On failure the history is left as far as the backend got.
+        """
+        # Positions follow from the actions, so the tracks agree as long as the actions do
+        shared = 0
+        for (action, _, _), (snapshot_action, _, _) in zip(self.history, snapshot):
+            if action != snapshot_action:
+                break
+            shared += 1
+
+        del self.cache_path[shared + 1:]
+        removals = len(self.history) - shared
+        if removals:
+            removed = self.ui_controller.remove_pieces(removals)
+            del self.history[len(self.history) - removed:]
+            if removed != removals:
+                return False
+
+        suffix = snapshot[shared:]
+        placed = self.ui_controller.add_track_pieces([TRACK_PIECES[action][0] for action, _, _ in suffix])
+        self.history.extend((action, tuple(position), direction) for action, position, direction in suffix[:placed])
+        return placed == len(suffix)
@@ -1,15 +1,17 @@
-import pyautogui
-import time
-from PIL import ImageGrab, Image, ImageEnhance
-import cv2
-import pytesseract
+from PIL import Image, ImageEnhance
+import logging
 import numpy as np
-import re
+import time
+from .backend import GameBackend
+from .screen_capture import FrameCache, UIWaiter, create_capture
+from .input_backend import create_input
+from .logs import log_event
+from .rating_reader import RATING_TYPES, GlyphReader, parse_rating
 
-class UIController:
-    def __init__(self):
+class UIController(GameBackend):
+    def __init__(self, capture='pil', input_backend='pyautogui', glyph_bank=None, fast_evaluation=False):
         self.station_length = 6
-        self.delay = 0.1
+        self.delay = 0.1  # Longest time to wait for the UI to react to a click
         self.faded_color = np.array([123, 103, 75])
         self.build_button_bg = np.array([143, 127, 107])
         self.ride_windows_bg = np.array([179, 79, 79])
@@ -59,24 +61,86 @@ class UIController:
 
         # Error detection
         self.error_area = (105, 380, 231, 402)  # (left, top, right, bottom)
-        
 
-    def click(self, coords):
+        # Area covering the track builder window, captured once and reused until the next click
+        self.builder_window_area = (95, 135, 265, 485)  # (left, top, right, bottom)
+        self.capture = create_capture(capture)
+        self.frame_cache = FrameCache(self.builder_window_area, self.capture.grab)
+
+        # Clicks wait for the UI to react instead of sleeping a fixed time
+        self.waiter = UIWaiter(self.capture.grab)
+
+        # Input backends that can send a whole click sequence at once get one per piece
+        self.input = create_input(input_backend)
+        self.batch_interval = 0.03  # Pause between clicks in a batch so the game can handle each
+
+        # Ride evaluation. With fast evaluation the game runs at its highest speed during the
+        # test, set with the game's speed keyboard shortcuts and restored afterwards.
+        self.evaluation_timeout = 45  # Used when the track length isn't known
+        self.evaluation_base_time = 20  # Seconds at normal speed for the test of an empty track
+        self.evaluation_time_per_piece = 0.5  # Extra seconds at normal speed per track piece
+        self.fast_evaluation = fast_evaluation
+        self.speed_up_key = '+'
+        self.speed_down_key = '-'
+        self.max_game_speed = 4  # Every speed step doubles the game speed
+        self.game_speed = 1
+
+        # Ratings are read by template matching when a glyph bank (a path or a GlyphReader) is
+        # given, otherwise by Tesseract
+        if isinstance(glyph_bank, str):
+            glyph_bank = GlyphReader.load(glyph_bank)
+        self.rating_reader = glyph_bank
+
+        # Compiled piece types and the builder's current selection, None when unknown
+        self.piece_plans = {}
+        self.selection = None
+        # Like the game, the chain lift is on after a piece with a chain lift is built or becomes
+        # the last piece by a removal, and off after any other piece or when a down slope is selected
+        self.chain_lift_on = False
+        self.chain_lifts = []  # If each piece after the station has a chain lift
+        self.down_slopes = (self.slope_down, self.slope_steep_down)
+        # How each selection button looked right after a click selected it, to tell if it
+        # is still selected without clicking it again
+        self.selected_looks = {}
+
+    def click(self, coords, watch_area=None):
         if self._is_button_clickable(coords):
-            pyautogui.click(coords)
-            time.sleep(self.delay)
+            label = 'build' if coords == self.build_coords else 'click'
+            self._click_and_wait(coords, watch_area, label=label)
             return True
         else:
             return False
 
-    def _is_button_clickable(self, coords):
+    def _click_and_wait(self, coords, watch_area=None, label='click'):
+        # Click and wait until the watched area (by default the button itself) has changed
+        # and settled, or at most self.delay seconds
+        watch_area = watch_area or self._button_area(coords)
+        reference = self.frame_cache.region(watch_area).copy()
+        self.input.click(coords)
+        self.frame_cache.invalidate()
+        return self.waiter.wait_for_change(watch_area, reference, self.delay, label)
+
+    def _click_sequence(self, coords_list, watch_area, label, interval=None):
+        # Send all clicks as one batch and verify once, after the last click
+        interval = self.batch_interval if interval is None else interval
+        reference = self.frame_cache.region(watch_area).copy()
+        self.input.click_sequence(coords_list, interval)
+        self.frame_cache.invalidate()
+        return self.waiter.wait_for_change(watch_area, reference, self.delay, label)
+
+    def latency_report(self):
+        # Observed UI reaction times per kind of wait
+        return self.waiter.report()
+
+    def _button_area(self, coords):
         # Define a small region around the button to check, larger area if we check the build button
         region_size = 50 if coords == self.build_coords else 5
         x, y = coords
-        bbox = (x - region_size, y - region_size, x + region_size, y + region_size)
-        
-        # Capture the region around the button
-        button_region = np.array(ImageGrab.grab(bbox=bbox))
+        return (x - region_size, y - region_size, x + region_size, y + region_size)
+
+    def _is_button_clickable(self, coords):
+        # Get the region around the button from the current frame
+        button_region = self.frame_cache.region(self._button_area(coords))
         
         if coords == self.build_coords:
             # Check if the entire button region matches the background color
@@ -87,148 +151,340 @@ class UIController:
             color_match = np.all(np.abs(button_region - self.faded_color) < self.color_threshold, axis=2)
             return not np.any(color_match)
 
+    def instrument(self, recorder):
+        super().instrument(recorder)
+        # Clicks include the clickable check and the wait, input is only sending the events
+        recorder.instrument(self, {'click': 'click', '_check_for_error': 'error_check', '_process_rating_image': 'ocr'})
+        recorder.instrument(self.input, {'click': 'input', 'click_sequence': 'input', 'press': 'input'})
+        recorder.instrument(self.capture, {'grab': 'grab'})
+        self.frame_cache.grab = self.waiter.grab = self.capture.grab
+        # The waits are where the sleeps are
+        self.waiter.recorder = recorder
+
+    def reconnect(self):
+        # The input and capture connections are to the X server of the old game, and what the
+        # builder has selected is unknown in the new one
+        self.input.reconnect()
+        self.capture.reconnect()
+        self.frame_cache.invalidate()
+        self.selection = None
+        self.chain_lift_on = False
+        self.chain_lifts = []
+
+    def close(self):
+        self.capture.close()
+        self.input.close()
+
     def is_loop_completed(self):
         return not self._is_button_clickable(self.build_coords)
 
     def start_new_rollercoaster(self):
-        print(f"Creating a new rollercoaster with {self.station_length} station segments")
-        self.click(self.build_coaster_coords)
-        self.click(self.choose_coaster_coords)
-        self.click(self.custom_coster_coords)
-        self.click(self.place_coords)
-        for _ in range(self.station_length-1):
-            self.click(self.build_coords)
+        log_event(self.log, logging.DEBUG, 'new_rollercoaster', station_length=self.station_length)
+        if self.input.batched:
+            # Windows open between these clicks, so they get the full delay
+            clicks = [self.build_coaster_coords, self.choose_coaster_coords, self.custom_coster_coords, self.place_coords]
+            clicks += [self.build_coords] * (self.station_length - 1)
+            opened = self._click_sequence(clicks, self.builder_window_area, 'new_rollercoaster', interval=self.delay)
+        else:
+            # Each click waits for what it opens, where the next click goes
+            self.click(self.build_coaster_coords, self._button_area(self.choose_coaster_coords))
+            self.click(self.choose_coaster_coords, self._button_area(self.custom_coster_coords))
+            self.click(self.custom_coster_coords, self._button_area(self.place_coords))
+            opened = self._is_button_clickable(self.place_coords) and self._click_and_wait(self.place_coords, self.builder_window_area)
+            for _ in range(self.station_length-1):
+                self.click(self.build_coords)
+        # A new builder window starts with a straight level piece without chain lift
+        self.selection = [self.direction_straight, self.slope_level, self.roll_none]
+        if opened:
+            # Those may never be clicked while unselected, so this is where they are seen selected
+            for coords in self.selection:
+                self.selected_looks.setdefault(coords, self.frame_cache.region(self._button_area(coords)).copy())
+        self.chain_lift_on = False
+        self.chain_lifts = []
 
     def demolish_rollercoaster(self):
-        print(f"Destroying old rollercoaster")
-        self.click(self.exit_builder_coords)
-        self.click(self.demolish_ride_coords)
-        self.click(self.confirm_demolish_coords)
+        log_event(self.log, logging.DEBUG, 'demolish')
+        if self.input.batched:
+            clicks = [self.exit_builder_coords, self.demolish_ride_coords, self.confirm_demolish_coords]
+            self._click_sequence(clicks, self._button_area(self.confirm_demolish_coords), 'demolish', interval=self.delay)
+        else:
+            # The builder closes, the confirmation opens and then closes with the ride window
+            self.click(self.exit_builder_coords, self.builder_window_area)
+            self.click(self.demolish_ride_coords, self._button_area(self.confirm_demolish_coords))
+            self.click(self.confirm_demolish_coords, self._button_area(self.demolish_ride_coords))
+        self.selection = None
+        self.chain_lifts = []
 
     def remove_piece(self):
         # Remove last piece
-        print(f"Remove last track piece")
-        pyautogui.click(self.remove_piece_coords)
+        log_event(self.log, logging.DEBUG, 'remove_piece')
+        self._click_and_wait(self.remove_piece_coords, self.builder_window_area, 'remove')
+        # The builder selects the shape of the removed piece
+        self.selection = None
+        self._removed_pieces(1)
         return True
 
-    def add_track_piece(self, piece_type):
-        # Helper function to click if button is clickable
-        def safe_click(coords):
-            if not self._is_button_clickable(coords):
-                return False
-            self.click(coords)
-            return True
+    def _removed_pieces(self, count):
+        # The chain lift follows the piece that is now the last one
+        del self.chain_lifts[max(len(self.chain_lifts) - count, 0):]
+        self.chain_lift_on = bool(self.chain_lifts) and self.chain_lifts[-1]
+
+    def remove_pieces(self, count):
+        if not self.input.batched:
+            return super().remove_pieces(count)
+        log_event(self.log, logging.DEBUG, 'remove_pieces', count=count)
+        if count:
+            self._click_sequence([self.remove_piece_coords] * count, self.builder_window_area, 'remove')
+            self.selection = None
+            self._removed_pieces(count)
+        return count
+
+    def _piece_plan(self, piece_type):
+        # Piece types are compiled to the buttons they need once and then reused
+        plan = self.piece_plans.get(piece_type)
+        if plan is None:
+            plan = self.piece_plans[piece_type] = self._compile_piece(piece_type)
+        return plan
 
-        # Check direction 
+    def _compile_piece(self, piece_type):
+        # Direction
+        direction = None
         if "straight" in piece_type:
-            if not safe_click(self.direction_straight):
-                return False
+            direction = self.direction_straight
         elif "large_left" in piece_type:
-            if not safe_click(self.direction_left_large):
-                return False
+            direction = self.direction_left_large
         elif "small_left" in piece_type:
-            if not safe_click(self.direction_left_small):
-                return False
+            direction = self.direction_left_small
         elif "left" in piece_type:
-            if not safe_click(self.direction_left):
-                return False
+            direction = self.direction_left
         elif "large_right" in piece_type:
-            if not safe_click(self.direction_right_large):
-                return False
+            direction = self.direction_right_large
         elif "small_right" in piece_type:
-            if not safe_click(self.direction_right_small):
-                return False
+            direction = self.direction_right_small
         elif "right" in piece_type:
-            if not safe_click(self.direction_right):
-                return False
-       
-        # Check slope
+            direction = self.direction_right
+
+        # Slope
+        slope = None
         if "level" in piece_type:
-            if not safe_click(self.slope_level):
-                return False
+            slope = self.slope_level
         elif "steep_up" in piece_type:
-            if not safe_click(self.slope_steep_up):
-                return False
+            slope = self.slope_steep_up
         elif "steep_down" in piece_type:
-            if not safe_click(self.slope_steep_down):
-                return False
+            slope = self.slope_steep_down
         elif "up" in piece_type:
-            if not safe_click(self.slope_up):
-                return False
+            slope = self.slope_up
         elif "down" in piece_type:
-            if not safe_click(self.slope_down):
-                return False
-        
-        # Check roll
+            slope = self.slope_down
+
+        # Roll
+        roll = None
         if "noroll" in piece_type:
-            if not safe_click(self.roll_none):
-                return False
-        if "leftroll" in piece_type:
-            if not safe_click(self.roll_left):
-                return False
-        if "rightroll" in piece_type:
-            if not safe_click(self.roll_right):
+            roll = self.roll_none
+        elif "leftroll" in piece_type:
+            roll = self.roll_left
+        elif "rightroll" in piece_type:
+            roll = self.roll_right
+
+        # (direction, slope, roll) buttons and if the chain lift should be on
+        return (direction, slope, roll), "chain" in piece_type
+
+    def add_track_piece(self, piece_type):
+        buttons, chain = self._piece_plan(piece_type)
+        if self.input.batched:
+            placed = self._add_track_piece_batched(buttons, chain)
+            if placed is not None:
+                return placed
+
+        # Only click the selections that differ from what the builder has selected. Changing
+        # one selection can reset the ones after it, so those are checked on the new frame.
+        changed = unsure = False
+        for index, coords in enumerate(buttons):
+            if coords is None:
+                continue
+            selected = self.selection is not None and self.selection[index] == coords
+            if not self._is_button_clickable(coords):
+                if changed:
+                    self.selection = None
                 return False
-        
-        # Check chain lift
-        if "chain" in piece_type:
-            if not safe_click(self.chain_lift):
+            if not (selected and not changed) and (unsure or not self._shows_selected(coords)):
+                if selected:
+                    # Selected before, but it doesn't look like it now. The click may not
+                    # change the button, so there is nothing on it to wait for, and the
+                    # frame may not show it yet when the next buttons are checked.
+                    self.input.click(coords)
+                    self.frame_cache.invalidate()
+                    unsure = True
+                else:
+                    self._select_button(coords)
+                changed = True
+                if coords in self.down_slopes:
+                    self.chain_lift_on = False
+            if self.selection is None:
+                self.selection = [None, None, None]
+            self.selection[index] = coords
+
+        # The chain lift button toggles, so it is only clicked when the state needs to change
+        if chain != self.chain_lift_on:
+            if not self.click(self.chain_lift):
                 return False
+            self.chain_lift_on = chain
 
         # Click build segment
-        if not safe_click(self.build_coords):
+        if not self.click(self.build_coords):
             return False
-        
-        # If we checked the chain-button we need to click it again to un-check it
-        if "chain" in piece_type:
-            if not safe_click(self.chain_lift):
+
+        # Check for error after building
+        if self._check_for_error():
+            self.selection = None
+            return False
+        self.chain_lifts.append(chain)
+        return True
+
+    def _shows_selected(self, coords):
+        look = self.selected_looks.get(coords)
+        return look is not None and np.array_equal(self.frame_cache.region(self._button_area(coords)), look)
+
+    def _select_button(self, coords):
+        # Click a selection button and remember how it looks once selected
+        if self._click_and_wait(coords):
+            self.selected_looks[coords] = self.frame_cache.region(self._button_area(coords)).copy()
+
+    def _add_track_piece_batched(self, buttons, chain):
+        # Check every button the piece needs on the current frame, then send the changed
+        # selections as one batch and the build click after them. Selected buttons after a
+        # changed one are checked again once that shows, and only clicked if the game reset them.
+        # Returns None if the current frame can't tell, the piece is then built click by click instead.
+        clicks = []
+        recheck = []
+        selection = list(self.selection) if self.selection is not None else [None, None, None]
+        for index, coords in enumerate(buttons):
+            if coords is None:
+                continue
+            if not self._is_button_clickable(coords):
+                # A button after a changed selection may only become available once that is clicked
+                return None if clicks else False
+            if selection[index] == coords or self._shows_selected(coords):
+                if clicks:
+                    recheck.append(coords)
+            else:
+                clicks.append(coords)
+            selection[index] = coords
+        if not self._is_button_clickable(self.build_coords):
+            return False
+        toggle = [] if recheck else self._chain_toggle(clicks, chain)
+        if toggle is None:
+            return False
+
+        # The selections change the builder window too, so the build click is only sent once they
+        # show. Otherwise the wait could stop at them before the build shows, and the error check
+        # would read a frame from before the build.
+        if clicks or toggle:
+            unknown = {coords: self.frame_cache.region(self._button_area(coords)).copy()
+                       for coords in clicks if coords not in self.selected_looks}
+            if self._click_sequence(clicks + toggle, self.builder_window_area, 'selection'):
+                for coords, look in unknown.items():
+                    region = self.frame_cache.region(self._button_area(coords))
+                    if not np.array_equal(region, look):
+                        self.selected_looks[coords] = region.copy()
+        if recheck:
+            reset = [coords for coords in recheck if not self._shows_selected(coords)]
+            toggle = self._chain_toggle(clicks + reset, chain)
+            if toggle is None:
                 return False
+            if reset or toggle:
+                self._click_sequence(reset + toggle, self.builder_window_area, 'selection')
+        self._click_sequence([self.build_coords], self.builder_window_area, 'piece')
+        self.selection = selection
+        self.chain_lift_on = chain
 
         # Check for error after building
-        return not self._check_for_error()
+        if self._check_for_error():
+            self.selection = None
+            return False
+        self.chain_lifts.append(chain)
+        return True
+
+    def _chain_toggle(self, clicks, chain):
+        # The chain lift click needed after these selection clicks, None if it can't be clicked
+        chain_lift_on = self.chain_lift_on and not any(coords in self.down_slopes for coords in clicks)
+        if chain == chain_lift_on:
+            return []
+        return [self.chain_lift] if self._is_button_clickable(self.chain_lift) else None
 
     def _place_entrance_exit(self):
         # Place the entrance and exit next to the station
-        pyautogui.click(self.entrance_button)
-        time.sleep(self.delay)
-        pyautogui.click(self.entrance_coords)
-        time.sleep(self.delay)
-        pyautogui.click(self.exit_coords)
-        time.sleep(self.delay)
-        print("Placed Entrance and exit!")
-
-    def run_ride_evaluation(self, timeout=45):
+        self._click_and_wait(self.entrance_button, label='entrance_exit')
+        self._click_and_wait(self.entrance_coords, label='entrance_exit')
+        self._click_and_wait(self.exit_coords, label='entrance_exit')
+        log_event(self.log, logging.DEBUG, 'entrance_exit')
+
+    def run_ride_evaluation(self, timeout=None, track_length=None):
+        if timeout is None:
+            timeout = self._evaluation_timeout(track_length)
+
         # Exit builder so we get the ride window open
-        pyautogui.click(self.exit_builder_coords)
-        time.sleep(self.delay)
-        pyautogui.click(self.test_button)
-        time.sleep(self.delay)
-        pyautogui.click(self.test_result_button)
-        time.sleep(self.delay)
-        print("Starting ride evaluation")
-        
+        self._click_and_wait(self.exit_builder_coords, self.builder_window_area)
+        self._click_and_wait(self.test_button)
+        self._click_and_wait(self.test_result_button, tuple(self.ride_rating_area))
+        log_event(self.log, logging.DEBUG, 'evaluation_started', timeout=timeout)
+        if self.fast_evaluation:
+            self._set_game_speed(self.max_game_speed)
+        try:
+            return self._wait_for_ratings(timeout)
+        finally:
+            if self.fast_evaluation:
+                self._set_game_speed(1)
+
+    def _evaluation_timeout(self, track_length):
+        # The test takes longer for longer tracks and less time the faster the game runs
+        if track_length is None:
+            return self.evaluation_timeout
+        timeout = self.evaluation_base_time + self.evaluation_time_per_piece * track_length
+        if self.fast_evaluation:
+            timeout /= 2 ** (self.max_game_speed - 1)
+        return timeout
+
+    def _set_game_speed(self, speed):
+        if speed > self.game_speed:
+            self.input.press(self.speed_up_key, presses=speed - self.game_speed)
+        elif speed < self.game_speed:
+            self.input.press(self.speed_down_key, presses=self.game_speed - speed)
+        self.game_speed = speed
+
+    def _wait_for_ratings(self, timeout):
         test_score_bbox = tuple(self.test_score_area)
         ride_rating_bbox = tuple(self.ride_rating_area)
-        start_time = time.time()
-        
-        while time.time() - start_time < timeout:
-            # Capture the region around the button
-            screenshot = ImageGrab.grab(bbox=test_score_bbox)
-            button_region = np.array(screenshot)
-            
+
+        def results_present(region):
             # Check if the region has changed color (indicating results are present)
-            color_match = np.all(np.abs(button_region - self.ride_windows_bg) < self.color_threshold, axis=2)
-            if not np.all(color_match):
-                # Results are present, process the image
-                rating_screenshot = ImageGrab.grab(bbox=ride_rating_bbox)
-                return self._process_rating_image(rating_screenshot)
-            
-            time.sleep(0.5)
-        
-        print("Timeout reached while waiting for ride evaluation results")
-        return None, None, None
+            color_match = np.all(np.abs(region - self.ride_windows_bg) < self.color_threshold, axis=2)
+            return not np.all(color_match)
+
+        # Only look closer when the score area has changed since the last look and settled
+        deadline = time.perf_counter() + timeout
+        reference = self.capture.grab(test_score_bbox).copy()
+        while not results_present(reference):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or not self.waiter.wait_for_change(test_score_bbox, reference, remaining, 'evaluation', poll_interval=0.05):
+                log_event(self.log, logging.WARNING, 'evaluation_timeout', timeout=timeout)
+                return None, None, None
+            reference = self.capture.grab(test_score_bbox).copy()
+
+        # Results are present, process the image
+        rating_screenshot = self.capture.grab(ride_rating_bbox)
+        return self._process_rating_image(rating_screenshot)
 
     def _process_rating_image(self, image):
+        if self.rating_reader is not None:
+            text = '\n'.join(self.rating_reader.read_lines(image))
+            log_event(self.log, logging.DEBUG, 'rating_text', text=text)
+            return self._parse_ratings(text)
+
+        # Tesseract is only needed when there is no glyph bank
+        import cv2
+        import pytesseract
+
         # Convert image to numpy array
         img_array = np.array(image)
         
@@ -240,39 +496,31 @@ class UIController:
         
         # Use pytesseract to extract text
         text = pytesseract.image_to_string(thresh)
-        print(f"Extracted text: {text}")
+        log_event(self.log, logging.DEBUG, 'rating_text', text=text)
         
         # Parse the text to extract ratings
-        excitement = self._extract_rating(text, "Excitement rating:")
-        intensity = self._extract_rating(text, "Intensity rating:")
-        nausea = self._extract_rating(text, "Nausea rating:")
-        
-        return excitement, intensity, nausea
-
-    def _extract_rating(self, text, rating_type):
-        pattern = f"{rating_type}\s*([\d.]+)"
-        match = re.search(pattern, text)
-        if match:
-            try:
-                return float(match.group(1))
-            except ValueError:
-                print(f"Could not convert {rating_type} to float")
-        else:
-            print(f"Could not extract {rating_type}")
-        return None
+        return self._parse_ratings(text)
+
+    def _parse_ratings(self, text):
+        # Excitement, intensity and nausea, None for the ones that can't be read
+        ratings = tuple(parse_rating(text, rating_type) for rating_type in RATING_TYPES)
+        for rating_type, rating in zip(RATING_TYPES, ratings):
+            if rating is None:
+                log_event(self.log, logging.WARNING, 'rating_missing', rating=rating_type, text=text)
+        return ratings
 
 
     def _check_for_error(self):
         try:
-            error_region = np.array(ImageGrab.grab(bbox=self.error_area))
+            error_region = self.frame_cache.region(self.error_area)
             error_red = np.array([199, 0, 0])
             red_match = np.sum(np.all(error_region == error_red, axis=2)) / error_region.size
 
             if red_match > 0.1:
-                print(f"Error detected: {red_match:.2%} red, decrease reward")
+                log_event(self.log, logging.DEBUG, 'build_error', red=float(red_match))
                 return True
             else:
                 return False
         except Exception as e:
-            print(f"Error in _check_for_error: {e}")
+            log_event(self.log, logging.WARNING, 'error_check_failed', error=str(e))
             return False
@@ -0,0 +1,331 @@
+import gymnasium as gym
+import numpy as np
+from gymnasium.vector import AutoresetMode
+from gymnasium.vector.utils import batch_space
+from .compact_observation import compact_observation_space, encode_observations
+from .distance_field import UNKNOWN, DistanceField
+from .track_builder import TRACK_PIECES, REMOVE_PIECE, move
+from .sim_controller import SLOPES, VoxelGrid, piece_fits_after, piece_roll, piece_slope
+
+
+class SimVectorEnv(gym.vector.VectorEnv):
+    """Steps `num_envs` simulated track builders at once with array operations.
+
+    Every environment follows the same rules as `OpenRCT2Env` with the 'sim' backend:
+    the same voxel collision model, slope and bank transitions, rewards and truncation. Instead
+    of branching per action, the geometry of every (action, direction) pair is looked
+    up from precomputed tables and applied to all environments in one go.
+
+    Finished environments are reset in the same step, their last observation is
+    returned in `infos['final_obs']`. With `compact_observations` every observation is a
+    row of uint8 values, laid out as described in compact_observation.py. A `distance_field`
+    is used like in `OpenRCT2Env`, looked up for all environments at once.
+    """
+
+    metadata = {"autoreset_mode": AutoresetMode.SAME_STEP}
+
+    def __init__(self, num_envs, grid_size=(64, 64), max_height=32, clearance=2, compact_observations=False,
+                 distance_field=None):
+        self.num_envs = num_envs
+        self.station_length = 6
+        self.max_track_length = 250
+        self.max_steps = 256
+        self.max_chain_lifts = 15
+        self.start_position = np.array([500, 500, 0], dtype=np.int64)
+        self.goal_position = np.array([500, 500 - self.station_length, 0], dtype=np.int64)
+
+        self.single_action_space = gym.spaces.Discrete(19)
+        self.distance_field = DistanceField(distance_field) if distance_field else None
+        self.compact_observations = compact_observations
+        if compact_observations:
+            self.single_observation_space = compact_observation_space(self.max_track_length, self.distance_field is not None)
+        else:
+            self.single_observation_space = gym.spaces.Dict({
+                'track_pieces': gym.spaces.Box(low=0, high=19, shape=(self.max_track_length,), dtype=np.int32),
+                'current_position': gym.spaces.Box(low=-20, high=1000, shape=(3,), dtype=np.int32),
+                'current_direction': gym.spaces.Discrete(4),
+                'distance_to_start': gym.spaces.Box(low=0, high=np.sqrt(2000**2 + 2000**2), shape=(1,), dtype=np.float32),
+                'track_length': gym.spaces.Discrete(self.max_track_length + 1),
+                'last_piece_type': gym.spaces.Discrete(19),
+            })
+            if self.distance_field is not None:
+                self.single_observation_space['pieces_to_close'] = gym.spaces.Box(low=0, high=UNKNOWN, shape=(1,), dtype=np.int32)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+
+        # Grid with only the station built, copied into every environment on reset
+        origin = (500 - grid_size[0] // 2, 500 - grid_size[1] // 2, 0)
+        station = VoxelGrid(origin, grid_size, max_height, clearance)
+        station.fill(station.station_voxels(self.goal_position, self.station_length))
+        self.origin = station.origin
+        self.grid_shape = np.array(station.occupied.shape, dtype=np.int64)
+        self.station_grid = station.occupied
+        self._build_tables(clearance)
+
+        # Per environment state
+        n = num_envs
+        self.occupied = np.zeros((n,) + station.occupied.shape, dtype=bool)
+        self.position = np.zeros((n, 3), dtype=np.int64)
+        self.direction = np.zeros(n, dtype=np.int64)
+        self.slope = np.zeros(n, dtype=np.int64)
+        self.roll = np.zeros(n, dtype=np.int64)
+        self.track_pieces = np.zeros((n, self.max_track_length), dtype=np.int32)
+        self.track_length = np.zeros(n, dtype=np.int64)
+        self.steps = np.zeros(n, dtype=np.int64)
+        self.last_piece_type = np.zeros(n, dtype=np.int64)
+        self.chain_lift_count = np.zeros(n, dtype=np.int64)
+        self.loop_completed = np.zeros(n, dtype=bool)
+
+        # Stack of placed pieces per environment, used to remove them again
+        depth = self.max_steps + 1
+        self.history_action = np.zeros((n, depth), dtype=np.int64)
+        self.history_position = np.zeros((n, depth, 3), dtype=np.int64)
+        self.history_direction = np.zeros((n, depth), dtype=np.int64)
+        self.history_slope = np.zeros((n, depth), dtype=np.int64)
+        self.history_roll = np.zeros((n, depth), dtype=np.int64)
+        self.history_length = np.zeros(n, dtype=np.int64)
+        # Pieces to close the loop and the fewest steps to close it with removals, for the
+        # station and every placed piece, see OpenRCT2Env._update_closure()
+        self.pieces_to_close = np.zeros(n, dtype=np.int64)
+        self.closure_steps = np.zeros((n, depth + 1), dtype=np.int64)
+
+    def _build_tables(self, clearance):
+        # (action, direction) -> position delta, new direction, slope, roll and occupied voxels
+        # relative to the build position. Padded voxels are masked out.
+        relative = VoxelGrid((0, 0, 0), (0, 0), 0, clearance)
+        voxels = {}
+        for action in TRACK_PIECES:
+            for direction in range(4):
+                voxels[action, direction] = np.stack(relative.piece_voxels(action, [0, 0, 0], direction), axis=1)
+        max_voxels = max(len(v) for v in voxels.values())
+
+        num_actions = len(TRACK_PIECES)
+        self.delta_table = np.zeros((num_actions, 4, 3), dtype=np.int64)
+        self.direction_table = np.zeros((num_actions, 4), dtype=np.int64)
+        self.slope_table = np.zeros(num_actions, dtype=np.int64)
+        self.roll_table = np.zeros(num_actions, dtype=np.int64)
+        # (action, slope + 2, roll + 1) -> whether the piece can follow track ending that way
+        self.fits_after_table = np.zeros((num_actions, len(SLOPES), 3), dtype=bool)
+        self.voxel_table = np.zeros((num_actions, 4, max_voxels, 3), dtype=np.int64)
+        self.voxel_mask_table = np.zeros((num_actions, 4, max_voxels), dtype=bool)
+        for action, (piece_type, _, _, _, _) in TRACK_PIECES.items():
+            self.slope_table[action] = piece_slope(piece_type)
+            self.roll_table[action] = piece_roll(piece_type)
+            for slope in SLOPES.values():
+                for roll in (-1, 0, 1):
+                    self.fits_after_table[action, slope + 2, roll + 1] = piece_fits_after(action, slope, roll)
+            for direction in range(4):
+                position, new_direction = move(action, [0, 0, 0], direction)
+                self.delta_table[action, direction] = position
+                self.direction_table[action, direction] = new_direction
+                count = len(voxels[action, direction])
+                self.voxel_table[action, direction, :count] = voxels[action, direction]
+                self.voxel_mask_table[action, direction, :count] = True
+
+    def _piece_voxels(self, envs, actions, positions, directions):
+        # Grid indices of the pieces, out of bounds voxels are clipped and flagged
+        voxels = positions[:, None, :] + self.voxel_table[actions, directions] - self.origin
+        mask = self.voxel_mask_table[actions, directions]
+        in_bounds = np.all((voxels >= 0) & (voxels < self.grid_shape), axis=2)
+        voxels = np.clip(voxels, 0, self.grid_shape - 1)
+        env_index = np.broadcast_to(envs[:, None], mask.shape)
+        return (env_index, voxels[..., 0], voxels[..., 1], voxels[..., 2]), mask, in_bounds
+
+    def _fits(self, envs, actions):
+        # Which pieces fit at the end of the track, with their grid indices and voxel mask
+        voxels, mask, in_bounds = self._piece_voxels(envs, actions, self.position[envs], self.direction[envs])
+        collides = self.occupied[voxels] & mask
+        fits = np.all(in_bounds | ~mask, axis=1) & ~np.any(collides, axis=1)
+        fits &= self.fits_after_table[actions, self.slope[envs] + 2, self.roll[envs] + 1]
+        return fits, voxels, mask
+
+    def action_masks(self):
+        # (num_envs, 19) array of the actions that would succeed in every environment
+        num_pieces = len(TRACK_PIECES)
+        envs = np.repeat(np.arange(self.num_envs), num_pieces)
+        actions = np.tile(np.arange(num_pieces), self.num_envs)
+        masks = np.zeros((self.num_envs, self.single_action_space.n), dtype=bool)
+        masks[:, :num_pieces] = self._fits(envs, actions)[0].reshape(self.num_envs, num_pieces)
+        masks[:, :num_pieces] &= ~self.loop_completed[:, None]
+        masks[:, REMOVE_PIECE] = self.history_length > 0
+        # A policy needs at least one action to choose from
+        masks[~masks.any(axis=1)] = True
+        return masks
+
+    def _reset_envs(self, envs):
+        self.occupied[envs] = self.station_grid
+        self.position[envs] = self.start_position
+        self.direction[envs] = 0
+        self.slope[envs] = 0
+        self.roll[envs] = 0
+        self.track_pieces[envs] = 0
+        self.track_length[envs] = self.station_length
+        self.steps[envs] = 0
+        self.last_piece_type[envs] = 0
+        self.chain_lift_count[envs] = 0
+        self.loop_completed[envs] = False
+        self.history_length[envs] = 0
+        if self.distance_field is not None:
+            start = self.distance_field.lookup(*(self.start_position - self.goal_position), 0, 0)
+            self.pieces_to_close[envs] = start
+            self.closure_steps[envs, 0] = start
+
+    def reset(self, seed=None, options=None):
+        super().reset(seed=seed)
+        self._reset_envs(np.arange(self.num_envs))
+        return self._get_observation(), {}
+
+    def step(self, actions):
+        actions = np.asarray(actions, dtype=np.int64)
+        success = np.zeros(self.num_envs, dtype=bool)
+        pieces_to_close = self.pieces_to_close.copy()
+
+        # Place pieces
+        place = np.flatnonzero((actions != REMOVE_PIECE) & ~self.loop_completed)
+        if len(place):
+            action = actions[place]
+            direction = self.direction[place]
+            slope = self.slope_table[action]
+            fits, voxels, mask = self._fits(place, action)
+
+            ok = np.flatnonzero(fits)
+            placed = place[ok]
+            if len(placed):
+                self.occupied[tuple(index[ok][mask[ok]] for index in voxels)] = True
+                depth = self.history_length[placed]
+                self.history_action[placed, depth] = action[ok]
+                self.history_position[placed, depth] = self.position[placed]
+                self.history_direction[placed, depth] = direction[ok]
+                self.history_slope[placed, depth] = self.slope[placed]
+                self.history_roll[placed, depth] = self.roll[placed]
+                self.history_length[placed] += 1
+
+                self.position[placed] += self.delta_table[action[ok], direction[ok]]
+                self.direction[placed] = self.direction_table[action[ok], direction[ok]]
+                self.slope[placed] = slope[ok]
+                self.roll[placed] = self.roll_table[action[ok]]
+                self.track_pieces[placed, self.track_length[placed]] = action[ok]
+                self.track_length[placed] += 1
+                success[placed] = True
+
+        # Remove pieces, the station itself can't be removed
+        removed = np.flatnonzero((actions == REMOVE_PIECE) & (self.history_length > 0))
+        if len(removed):
+            depth = self.history_length[removed] - 1
+            action = self.history_action[removed, depth]
+            position = self.history_position[removed, depth]
+            direction = self.history_direction[removed, depth]
+            voxels, mask, _ = self._piece_voxels(removed, action, position, direction)
+            self.occupied[tuple(index[mask] for index in voxels)] = False
+            self.position[removed] = position
+            self.direction[removed] = direction
+            self.slope[removed] = self.history_slope[removed, depth]
+            self.roll[removed] = self.history_roll[removed, depth]
+            self.history_length[removed] = depth
+            self.track_length[removed] -= 1
+            self.track_pieces[removed, self.track_length[removed]] = 0
+            success[removed] = True
+
+        self.last_piece_type[success] = actions[success]
+        if self.distance_field is not None:
+            self._update_closure(success, actions)
+        rewards = self._calculate_reward(success, actions, pieces_to_close)
+
+        # Check for loop completion
+        self.loop_completed = (np.all(self.position == self.goal_position, axis=1) &
+                               (self.direction == 0) & (self.slope == 0) & (self.roll == 0))
+        terminations = self.loop_completed.copy()
+        truncations = (self.steps >= self.max_steps) | (self.track_length >= self.max_track_length)
+        if self.distance_field is not None:
+            # The loop can't be closed in the steps that are left
+            steps_to_close = self.closure_steps[np.arange(self.num_envs), self.history_length]
+            truncations |= ((steps_to_close != UNKNOWN) & (steps_to_close > self.max_steps - self.steps) &
+                            ~self.loop_completed)
+        self.steps += 1
+
+        observation = self._get_observation()
+        infos = {}
+        done = np.flatnonzero(terminations | truncations)
+        if len(done):
+            final_obs = np.empty(self.num_envs, dtype=object)
+            for i in done:
+                if self.compact_observations:
+                    final_obs[i] = observation[i].copy()
+                else:
+                    final_obs[i] = {key: value[i].copy() for key, value in observation.items()}
+            infos['final_obs'] = final_obs
+            infos['_final_obs'] = terminations | truncations
+            self._reset_envs(done)
+            if self.compact_observations:
+                observation[done] = self._get_observation()[done]
+            else:
+                for key, value in self._get_observation().items():
+                    observation[key][done] = value[done]
+
+        return observation, rewards, terminations, truncations, infos
+
+    def _update_closure(self, success, actions):
+        # Look up the pieces to close the loop where the track changed, and push them for placed pieces
+        changed = np.flatnonzero(success)
+        self.pieces_to_close[changed] = self.distance_field.lookup_batch(
+            self.position[changed] - self.goal_position, self.direction[changed], self.slope[changed])
+        placed = np.flatnonzero(success & (actions != REMOVE_PIECE))
+        depth = self.history_length[placed]
+        self.closure_steps[placed, depth] = np.minimum(self.pieces_to_close[placed],
+                                                       self.closure_steps[placed, depth - 1] + 1)
+
+    def _calculate_reward(self, success, actions, pieces_to_close):
+        # Same shaping as OpenRCT2Env._calculate_reward, evaluated for all environments.
+        # `pieces_to_close` is the number of pieces needed to close the loop before the step.
+        rewards = np.where(success, 1.0, -0.5)
+        distance = self._calculate_distance_to_start()
+
+        # Reward for placing chain lifts in the beginning
+        chain = (success & (self.track_length < 17) & (self.last_piece_type == 15) &
+                 (self.chain_lift_count < self.max_chain_lifts))
+        rewards[chain] += 5
+        self.chain_lift_count[chain] += 1
+
+        # Penalty for removing pieces
+        rewards[success & (actions == REMOVE_PIECE)] -= 2
+
+        # Big reward for completing the loop
+        rewards[success & self.loop_completed] += 100
+
+        # Penalty for excessive height to discourage sky-high coasters
+        rewards[success & (self.position[:, 2] > 22)] -= 0.2
+
+        if self.distance_field is None:
+            # Punish going far away from start
+            rewards[success] -= np.maximum(0, distance[success] - 40) * 0.1
+
+            # Encourage returning to start for longer tracks
+            longer = success & (self.track_length > 40)
+            rewards[longer] += np.maximum(0, 40 - distance[longer]) * 0.2
+        else:
+            # Reward the change in pieces needed to close the loop
+            known = success & (pieces_to_close != UNKNOWN) & (self.pieces_to_close != UNKNOWN)
+            rewards[known] += (pieces_to_close[known] - self.pieces_to_close[known]) * 0.5
+        return rewards
+
+    def _calculate_distance_to_start(self):
+        return np.linalg.norm(self.position - self.goal_position, axis=1)
+
+    def _get_observation(self):
+        if self.compact_observations:
+            observation = np.empty((self.num_envs,) + self.single_observation_space.shape, dtype=np.uint8)
+            return encode_observations(observation, self.max_track_length, self.track_pieces, self.position,
+                                       self.direction, self._calculate_distance_to_start(), self.track_length,
+                                       self.last_piece_type,
+                                       self.pieces_to_close if self.distance_field is not None else None)
+        observation = {
+            'track_pieces': self.track_pieces.copy(),
+            'current_position': self.position.astype(np.int32),
+            'current_direction': self.direction.copy(),
+            'distance_to_start': self._calculate_distance_to_start().astype(np.float32)[:, None],
+            'track_length': self.track_length.copy(),
+            'last_piece_type': self.last_piece_type.copy(),
+        }
+        if self.distance_field is not None:
+            observation['pieces_to_close'] = self.pieces_to_close.astype(np.int32)[:, None]
+        return observation
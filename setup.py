@@ -10,5 +10,10 @@ setup(
         'pyautogui',
         'pillow'
     ],
+    extras_require={
+        'mss': ['mss'],
+        'xtest': ['python-xlib'],
+        'masked': ['sb3-contrib'],
+    },
 )
 
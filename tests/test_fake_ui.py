@@ -0,0 +1,67 @@
+import random
+import numpy as np
+import pytest
+from openrct2_gym.envs.fake_screen import fake_ui_controller
+from openrct2_gym.envs.track_builder import TRACK_PIECES
+
+
+def build_random_track(controller, steps, seed=0):
+    # Count the pieces where the controller's result differs from what the game did
+    screen = controller.screen
+    rng = random.Random(seed)
+    wrong = 0
+    controller.start_new_rollercoaster()
+    for _ in range(steps):
+        if screen.built and rng.random() < 0.15:
+            controller.remove_piece()
+            continue
+        before = len(screen.track.pieces)
+        placed = controller.add_track_piece(TRACK_PIECES[rng.choice(list(TRACK_PIECES))][0])
+        wrong += bool(placed) != (len(screen.track.pieces) == before + 1)
+        if screen.track.is_loop_completed():
+            controller.demolish_rollercoaster()
+            controller.start_new_rollercoaster()
+    return wrong
+
+
+def test_wait_settles_after_a_redraw_over_several_frames():
+    controller = fake_ui_controller(batched=False, redraw_frames=4, frame_time=0.02)
+    controller.start_new_rollercoaster()
+    area = controller.builder_window_area
+    assert controller._click_and_wait(controller.exit_builder_coords, area)
+    left, top, right, bottom = area
+    assert np.array_equal(controller.capture.grab(area), controller.screen.frame[top:bottom, left:right])
+
+
+def test_wait_times_out_without_a_change():
+    controller = fake_ui_controller(batched=False, latency=0.01, redraw_frames=3)
+    controller.start_new_rollercoaster()
+    assert not controller._click_and_wait(controller.exit_builder_coords, (1200, 600, 1250, 650))
+    assert controller.latency_report()['click']['timeouts'] == 1
+
+
+@pytest.mark.parametrize('batched', [False, True])
+def test_selected_buttons_are_not_clicked_again(batched):
+    controller = fake_ui_controller(batched=batched, latency=0.01, redraw_frames=3)
+    screen = controller.screen
+    no_ops = []
+    click = screen.click
+
+    def counted_click(coords):
+        for buttons, kind in ((screen.directions, 'direction'), (screen.slopes, 'slope'), (screen.rolls, 'roll')):
+            if screen.state == 'builder' and screen.selection[kind] == buttons.get(tuple(coords)):
+                no_ops.append(coords)
+        click(coords)
+
+    screen.click = counted_click
+    assert build_random_track(controller, 40) == 0
+    if not batched:
+        # A batch can't see what its first clicks reset, but its wait is on the whole window
+        assert no_ops == []
+    assert all(stats['timeouts'] == 0 for stats in controller.latency_report().values())
+
+
+@pytest.mark.parametrize('batched', [False, True])
+def test_pieces_match_the_game_with_delayed_redraws(batched):
+    controller = fake_ui_controller(batched=batched, latency=0.01, redraw_frames=3)
+    assert build_random_track(controller, 40) == 0
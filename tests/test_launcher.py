@@ -0,0 +1,115 @@
+import os
+import socket
+import subprocess
+import time
+import numpy as np
+import pytest
+from openrct2_gym.envs import launcher as launcher_module
+from openrct2_gym.envs.launcher import GameInstance, InstanceLauncher
+
+
+@pytest.fixture
+def launcher():
+    launcher = InstanceLauncher(2, mock=True)
+    launcher.start()
+    yield launcher
+    launcher.close()
+
+
+def wait_until_ready(launcher, timeout=5):
+    ready = []
+    deadline = time.time() + timeout
+    while launcher.restarting and time.time() < deadline:
+        ready += launcher.ready_instances()
+        time.sleep(0.01)
+    return ready
+
+
+def test_mock_instances_start_alive(launcher):
+    assert all(instance.is_alive() and instance.is_ready() for instance in launcher.instances)
+    assert launcher.check_health() == []
+    assert launcher.ready_instances() == []
+
+
+def test_dead_instance_is_restarted_without_waiting(launcher):
+    instance = launcher.instances[1]
+    instance.game.kill()
+    instance.game.wait()
+    assert launcher.check_health() == [1]
+    assert launcher.restarting == {1}
+    assert instance.restarts == 1
+    # Restarting instances are left to ready_instances() instead of being restarted again
+    assert launcher.check_health() == []
+    assert wait_until_ready(launcher) == [1]
+    assert instance.is_alive() and launcher.restarting == set()
+    assert launcher.ready_instances() == []
+
+
+def test_restart_waits_for_the_old_process_to_end(launcher):
+    instance = launcher.instances[0]
+    old = instance.game
+    instance.stop_timeout = 0
+    instance.restart(wait=False)
+    assert instance.stopping == [old] and instance.ready_at is None
+    deadline = time.time() + 5
+    while not instance.is_ready() and time.time() < deadline:
+        time.sleep(0.01)
+    assert instance.is_ready() and instance.game is not old
+    assert old.poll() is not None and instance.stopping == []
+
+
+def test_failed_start_is_tried_again_later(monkeypatch):
+    def missing_xvfb(*args, **kwargs):
+        raise FileNotFoundError('Xvfb')
+
+    monkeypatch.setattr(launcher_module.subprocess, 'Popen', missing_xvfb)
+    instance = GameInstance(':987', ['openrct2'])
+    with pytest.raises(FileNotFoundError):
+        instance.start()
+    instance.start(wait=False)
+    assert instance.failures == 1 and not instance.is_ready()
+    instance.retry_at = time.time()
+    instance.poll()
+    # The pause doubles after every failure in a row
+    assert instance.failures == 2 and instance.retry_at - time.time() > 3
+
+
+def test_stale_display_files_are_removed():
+    # A socket nobody listens on and a lock of a process that has ended, like a crashed Xvfb leaves
+    instance = GameInstance(':987', ['openrct2'])
+    socket_path = '/tmp/.X11-unix/X987'
+    lock_path = '/tmp/.X987-lock'
+    os.makedirs('/tmp/.X11-unix', exist_ok=True)
+    for path in (socket_path, lock_path):
+        if os.path.exists(path):
+            pytest.skip(f"{path} is in use")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.close()
+    ended = subprocess.Popen(['true'])
+    ended.wait()
+    with open(lock_path, 'w') as lock:
+        lock.write(f"{ended.pid:10d}\n")
+    try:
+        assert not instance._accepts_connections()
+        instance._remove_stale_display()
+        assert not os.path.exists(socket_path) and not os.path.exists(lock_path)
+    finally:
+        for path in (socket_path, lock_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def test_suspended_environment_reconnects(launcher):
+    env = launcher.env_fns()[0]().unwrapped
+    reconnects = []
+    env.ui_controller.reconnect = lambda: reconnects.append(True)
+    env.reset(seed=0)
+    env.suspend_backend()
+    _, _, terminated, truncated, info = env.step(int(np.flatnonzero(env.action_masks())[0]))
+    assert truncated and info.get('track_unknown')
+    env.resume_backend()
+    assert reconnects == [True]
+    env.reset(seed=0)
+    assert env.track_known
+    env.close()
@@ -0,0 +1,113 @@
+import itertools
+import sqlite3
+import pytest
+from openrct2_gym.envs import placement_cache
+from openrct2_gym.envs.placement_cache import ROOT, PlacementCache
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    # Every call is a second later, so the order of uses is never a tie
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(placement_cache.time, 'time', lambda: float(next(ticks)))
+
+
+def last_used(path, edge):
+    with sqlite3.connect(path) as connection:
+        return connection.execute("SELECT last_used FROM edges WHERE id = ?", (edge,)).fetchone()[0]
+
+
+def test_lookup_finds_recorded_outcomes(tmp_path):
+    cache = PlacementCache(str(tmp_path / 'placements.db'))
+    child = cache.record(ROOT, 3, True)
+    assert cache.record(child, 5, False) is None
+    assert cache.lookup(ROOT, 3) == (True, child)
+    assert cache.lookup(child, 5) == (False, None)
+    assert cache.lookup(child, 6) == (None, None)
+    assert cache.stats() == {'lookups': 3, 'hits': 2, 'skipped': 1, 'hit_rate': 2 / 3}
+    cache.close()
+
+
+def test_lookups_write_their_times_in_batches(tmp_path):
+    path = str(tmp_path / 'placements.db')
+    cache = PlacementCache(path, flush_interval=3)
+    edges = [cache.record(ROOT, action, True) for action in range(3)]
+    recorded = [last_used(path, edge) for edge in edges]
+
+    cache.lookup(ROOT, 0)
+    cache.lookup(ROOT, 1)
+    assert [last_used(path, edge) for edge in edges] == recorded
+    cache.lookup(ROOT, 2)
+    assert not cache.used
+    assert all(last_used(path, edge) > time for edge, time in zip(edges, recorded))
+
+    cache.lookup(ROOT, 0)
+    cache.close()
+    assert last_used(path, edges[0]) > last_used(path, edges[1])
+
+
+def test_eviction_keeps_recently_looked_up_edges(tmp_path):
+    cache = PlacementCache(str(tmp_path / 'placements.db'), max_entries=2)
+    cache.record(ROOT, 0, True)
+    cache.record(ROOT, 1, True)
+    cache.lookup(ROOT, 0)  # Only in memory until the eviction flushes it
+    cache.record(ROOT, 2, True)
+    assert cache.lookup(ROOT, 1) == (None, None)
+    assert cache.lookup(ROOT, 0)[0] and cache.lookup(ROOT, 2)[0]
+    cache.close()
+
+
+def test_failures_are_trusted_after_min_failures(tmp_path):
+    cache = PlacementCache(str(tmp_path / 'placements.db'), min_failures=2)
+    cache.record(ROOT, 4, False)
+    assert cache.lookup(ROOT, 4) == (None, None)
+    cache.record(ROOT, 4, False)
+    assert cache.lookup(ROOT, 4) == (False, None)
+    # A success after a misread failure starts the count again
+    child = cache.record(ROOT, 4, True)
+    cache.record(ROOT, 4, False)
+    assert cache.lookup(ROOT, 4) == (None, None)
+    assert cache.record(ROOT, 4, True) == child
+    cache.close()
+
+
+def test_failures_expire_after_their_ttl(tmp_path):
+    # The clock moves a second per call
+    cache = PlacementCache(str(tmp_path / 'placements.db'), failure_ttl=2.5)
+    cache.record(ROOT, 4, False)
+    assert cache.lookup(ROOT, 4) == (False, None)
+    assert cache.lookup(ROOT, 4) == (None, None)
+    cache.close()
+
+
+def test_invalidate_and_purge_by_source(tmp_path):
+    path = str(tmp_path / 'placements.db')
+    ui = PlacementCache(path, source='ui')
+    sim = PlacementCache(path, source='sim')
+    ui.record(ROOT, 1, False)
+    ui.record(ROOT, 2, True)
+    sim.record(ROOT, 3, False)
+    sim.record(ROOT, 4, True)
+
+    sim.invalidate(ROOT, 4)
+    assert sim.lookup(ROOT, 4) == (None, None)
+    assert sim.purge('ui', failures_only=True) == 1
+    assert [sim.lookup(ROOT, action)[0] for action in (1, 2, 3)] == [None, True, False]
+    assert sim.purge('ui') == 1
+    assert sim.lookup(ROOT, 2) == (None, None)
+    ui.close()
+    sim.close()
+
+
+def test_files_without_failure_counts_are_migrated(tmp_path):
+    path = str(tmp_path / 'placements.db')
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "CREATE TABLE edges (id INTEGER PRIMARY KEY AUTOINCREMENT, parent INTEGER NOT NULL, "
+            "action INTEGER NOT NULL, success INTEGER NOT NULL, last_used REAL NOT NULL, UNIQUE (parent, action))")
+        connection.execute("INSERT INTO edges (parent, action, success, last_used) VALUES (0, 1, 0, 1.0), (0, 2, 1, 1.0)")
+    connection.close()
+    cache = PlacementCache(path)
+    assert cache.lookup(ROOT, 1) == (False, None)
+    assert cache.lookup(ROOT, 2)[0] is True
+    cache.close()
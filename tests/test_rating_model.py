@@ -0,0 +1,103 @@
+import threading
+import numpy as np
+from openrct2_gym.envs.rating_model import RatingModel, track_features
+
+
+def fitted_model(seed, samples=60, noise=0.5):
+    # A model fitted on features with linear ratings plus noise of a known standard deviation
+    rng = np.random.default_rng(seed)
+    model = RatingModel(min_samples=10)
+    features = rng.normal(size=(samples, len(track_features([0] * 6))))
+    weights = rng.normal(size=(features.shape[1], 3))
+    model.features = list(features)
+    model.ratings = list(features @ weights + rng.normal(scale=noise, size=(samples, 3)))
+    model.fit()
+    return model
+
+
+def test_noise_accounts_for_the_fitted_weights():
+    # With about twice as many samples as weights, dividing by n - 1 would halve the noise
+    noise = np.mean([fitted_model(seed).noise for seed in range(20)])
+    assert abs(noise - 0.25) < 0.04
+
+
+def test_degrees_of_freedom_shrink_with_alpha():
+    model = fitted_model(0)
+    assert 20 < model.degrees_of_freedom < model.features[0].size + 1
+    model.alpha = 100.0
+    model.fit()
+    assert model.degrees_of_freedom < 20
+
+
+def test_track_features():
+    # Two chain lifts and a climb to 3, a drop of 3, a climb and a drop of 1, a left turn and a
+    # banked piece. Actions that aren't track pieces are left out of the walk.
+    track_pieces = [0] * 6 + [15, 15, 6, 0, 5, 16, 0, 6, 5, 1, 13, 99]
+    features = track_features(track_pieces)
+    length, max_height, mean_height, drops, max_drop, total_drop, left, right, banked, chain = features[:10]
+    assert length == 18
+    assert (max_height, mean_height) == (3, 1)
+    assert (drops, max_drop, total_drop) == (2, 3, 4)
+    assert (left, right, banked, chain) == (1, 0, 1, 2)
+    assert features[10 + 15] == 2 and features[10:].sum() == 11
+    assert not track_features([0] * 6)[1:].any()
+
+
+def random_tracks(rng, count):
+    return [[0] * 6 + list(rng.integers(0, 18, size=rng.integers(5, 40))) for _ in range(count)]
+
+
+def linear_ratings(track_pieces):
+    # Ratings the model can learn exactly, excitement stays below 6
+    length, max_height = track_features(track_pieces)[:2]
+    return 1 + 0.05 * length, 2 + 0.1 * max_height, 0.5 + 0.02 * length
+
+
+def test_estimates_wait_for_enough_samples():
+    rng = np.random.default_rng(0)
+    model = RatingModel(min_samples=20)
+    tracks = random_tracks(rng, 19)
+    model.add_samples((track, linear_ratings(track)) for track in tracks)
+    assert model.predict(tracks[0]) == (None, None)
+    assert model.estimate(tracks[0]) is None
+    model.add(tracks[0], linear_ratings(tracks[0]))
+    model.fit()
+    assert model.estimate(tracks[0]) is not None
+
+
+def test_estimates_are_gated_on_their_std_and_excitement():
+    rng = np.random.default_rng(1)
+    model = RatingModel(min_samples=20)
+    model.add_samples((track, linear_ratings(track)) for track in random_tracks(rng, 200))
+    track = random_tracks(rng, 1)[0]
+    mean, std = model.predict(track)
+    assert np.allclose(mean, linear_ratings(track), atol=0.05)
+    assert model.estimate(track) == tuple(float(value) for value in mean)
+
+    # Less certain than allowed, or exciting enough to be worth a test in the game
+    model.max_std = std.max() / 2
+    assert model.estimate(track) is None
+    model.max_std = 0.5
+    model.explore_excitement = mean[0]
+    assert model.estimate(track) is None
+
+
+def test_samples_can_be_added_while_predicting():
+    rng = np.random.default_rng(2)
+    model = RatingModel(min_samples=20, refit_interval=1)
+    tracks = random_tracks(rng, 200)
+    model.add_samples((track, linear_ratings(track)) for track in tracks[:20])
+
+    def add(part):
+        for track in part:
+            model.add(track, linear_ratings(track))
+
+    threads = [threading.Thread(target=add, args=(tracks[20 + 45 * i:65 + 45 * i],)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        mean, std = model.predict(tracks[0])
+        assert mean.shape == std.shape == (3,)
+    for thread in threads:
+        thread.join()
+    assert len(model.features) == len(model.ratings) == 200
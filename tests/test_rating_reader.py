@@ -0,0 +1,107 @@
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from openrct2_gym.envs.rating_reader import RATING_TYPES, GlyphReader, load_samples, parse_rating
+
+# Rating areas drawn in the fake screen's pixel font on the ride window background,
+# the labelled ones are the calibration samples
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'ratings')
+EXPECTED = {
+    'sample_1': (6.45, 5.12, 3.08),
+    'sample_2': (7.89, 4.60, 2.31),
+    'sample_3': (0.97, 8.23, 1.54),
+    'unlabelled': (4.71, 9.36, 0.28),
+}
+# The same ratings with the game's wording, "(High)" after each, drawn in Pillow's bitmap
+# font with a pixel between glyphs. The fake screen never draws this font, so templates
+# learned from it check the reader on glyphs it wasn't written for.
+BITMAP_FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'ratings_bitmap')
+# Labelled crops of the rating area from real game screenshots go here
+GAME_FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'ratings_game')
+
+
+def load_image(name, directory=FIXTURES):
+    return np.array(Image.open(os.path.join(directory, name + '.png')).convert('RGB'))
+
+
+@pytest.fixture
+def reader():
+    reader = GlyphReader()
+    reader.calibrate(load_samples(FIXTURES))
+    return reader
+
+
+def test_load_samples_pairs_images_with_labels():
+    samples = load_samples(FIXTURES)
+    assert len(samples) == 3
+    image, text_lines = samples[1]
+    assert image.shape == (39, 139, 3)
+    assert text_lines == ["Excitement rating: 7.89", "Intensity rating: 4.60", "Nausea rating: 2.31"]
+
+
+def test_calibrate_finds_every_glyph(reader):
+    assert set('0123456789.:') <= set(reader.chars)
+    assert set('ExcitementIntensityNausearating') <= set(reader.chars)
+    assert reader.templates.shape[0] == len(reader.chars)
+    # Spaces are wider than the gaps between letters but not wider than the ones between words
+    assert 1 < reader.space_width <= 3
+
+
+def test_calibrate_without_glyphs_fails():
+    image = load_image('sample_1')
+    with pytest.raises(ValueError):
+        GlyphReader().calibrate([(image, ["too few lines"])])
+
+
+@pytest.mark.parametrize('name', sorted(EXPECTED))
+def test_read_ratings(reader, name):
+    assert reader.read_ratings(load_image(name)) == EXPECTED[name]
+
+
+def test_read_lines_marks_unknown_glyphs():
+    reader = GlyphReader()
+    reader.calibrate([(load_image('sample_1'), ["Excitement rating: 6.45", "Intensity rating: 5.12",
+                                                "Nausea rating: 3.08"])])
+    # There is no 7 in the first sample
+    lines = reader.read_lines(load_image('sample_2'))
+    assert lines[0].startswith("Excitement rating: ?.8")
+    assert reader.read_ratings(load_image('sample_2')) == (None, 4.6, 2.31)
+
+
+def test_saved_bank_reads_the_same(reader, tmp_path):
+    path = str(tmp_path / 'glyphs.npz')
+    reader.save(path)
+    loaded = GlyphReader.load(path)
+    assert loaded.chars == reader.chars
+    assert loaded.space_width == reader.space_width
+    assert loaded.read_ratings(load_image('unlabelled')) == EXPECTED['unlabelled']
+
+
+@pytest.mark.parametrize('name', sorted(EXPECTED))
+def test_read_ratings_in_another_bitmap_font(name):
+    reader = GlyphReader()
+    chars = reader.calibrate(load_samples(BITMAP_FIXTURES))
+    assert set('0123456789.:()') <= set(chars)
+    assert reader.read_ratings(load_image(name, BITMAP_FIXTURES)) == EXPECTED[name]
+
+
+def test_read_game_captures():
+    # Every capture is read with the templates of the others
+    samples = load_samples(GAME_FIXTURES) if os.path.isdir(GAME_FIXTURES) else []
+    if len(samples) < 2:
+        pytest.skip("No labelled game captures in tests/fixtures/ratings_game")
+    for index, (image, text_lines) in enumerate(samples):
+        reader = GlyphReader()
+        reader.calibrate(samples[:index] + samples[index + 1:])
+        expected = tuple(parse_rating('\n'.join(text_lines), rating_type) for rating_type in RATING_TYPES)
+        assert reader.read_ratings(image) == expected
+
+
+def test_parse_rating():
+    text = "Excitement rating: 6.45\nIntensity rating:5.12\nNausea rating: ?"
+    assert parse_rating(text, "Excitement rating:") == 6.45
+    assert parse_rating(text, "Intensity rating:") == 5.12
+    assert parse_rating(text, "Nausea rating:") is None
+    assert parse_rating("Excitement rating: 6.4.5", "Excitement rating:") is None
+    assert parse_rating("Nausea rating: 3.08 (Medium)", "Nausea rating:") == 3.08
@@ -0,0 +1,116 @@
+import threading
+import pytest
+from openrct2_gym.envs.backend import BackendError
+from openrct2_gym.envs.sim_controller import SimController
+from openrct2_gym.envs.socket_backend import SocketBackend
+from openrct2_gym.envs.socket_server import BackendServer, UnixBackendServer
+
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+@pytest.fixture
+def server():
+    # Port 0 lets the system pick a free port
+    server = serve(BackendServer(('localhost', 0)))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def backend(server):
+    backend = SocketBackend(server.server_address, timeout=5)
+    yield backend
+    backend.close()
+
+
+class WrongIdServer(BackendServer):
+    def handle_request(self, backend, line):
+        response = super(WrongIdServer, self).handle_request(backend, line)
+        response['id'] += 1
+        return response
+
+
+def test_queued_commands_are_sent_with_the_next_call(backend):
+    backend.send('demolish_rollercoaster')
+    backend.start_new_rollercoaster()
+    assert len(backend.pending) == 2 and backend.socket is None
+    assert backend.add_track_piece('straight_level_noroll')
+    assert backend.pending == []
+
+    sim = SimController()
+    sim.start_new_rollercoaster()
+    sim.add_track_piece('straight_level_noroll')
+    pieces = ['left_level_noroll', 'straight_up_noroll', 'straight_level_noroll']
+    assert backend.add_track_pieces(pieces) == sim.add_track_pieces(pieces)
+    assert backend.remove_pieces(2) == sim.remove_pieces(2)
+    assert backend.is_loop_completed() == sim.is_loop_completed()
+
+
+def test_results_of_a_flush_come_in_order(backend):
+    backend.start_new_rollercoaster()
+    backend.send('add_track_piece', 'straight_level_noroll')
+    backend.send('is_loop_completed')
+    assert backend.flush() == [None, True, False]
+    assert backend.flush() == []
+
+
+def test_error_replies_raise_and_keep_the_stream_in_sync(backend):
+    backend.start_new_rollercoaster()
+    backend.send('no_such_command')
+    backend.send('add_track_piece', 'straight_level_noroll')
+    with pytest.raises(BackendError, match="Unknown command: no_such_command"):
+        backend.flush()
+    # The response after the error was read too, so the next call gets its own
+    assert backend.is_loop_completed() is False
+
+
+def test_response_with_the_wrong_id_closes_the_connection():
+    server = serve(WrongIdServer(('localhost', 0)))
+    backend = SocketBackend(server.server_address, timeout=5)
+    try:
+        with pytest.raises(BackendError, match="Expected response 1, got 2"):
+            backend.call('is_loop_completed')
+        assert backend.socket is None
+    finally:
+        backend.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_reconnect_starts_over_with_a_new_game(backend):
+    backend.start_new_rollercoaster()
+    backend.add_track_piece('straight_level_noroll')
+    backend.send('demolish_rollercoaster')
+    backend.reconnect()
+    assert backend.socket is None and backend.pending == []
+    # Every connection gets its own game, which has no station yet
+    assert not backend.add_track_piece('straight_level_noroll')
+    backend.start_new_rollercoaster()
+    assert backend.add_track_piece('straight_level_noroll')
+
+
+def test_closed_connection_raises_and_the_next_call_connects_again(server, backend):
+    backend.start_new_rollercoaster()
+    backend.add_track_piece('straight_level_noroll')
+    backend.socket.shutdown(2)
+    with pytest.raises(BackendError, match="closed"):
+        backend.is_loop_completed()
+    assert backend.is_loop_completed() is False
+
+
+def test_unix_socket(tmp_path):
+    path = str(tmp_path / 'game.sock')
+    server = serve(UnixBackendServer(path))
+    backend = SocketBackend(path, timeout=5)
+    try:
+        backend.start_new_rollercoaster()
+        assert backend.add_track_piece('straight_level_noroll')
+    finally:
+        backend.close()
+        server.shutdown()
+        server.server_close()
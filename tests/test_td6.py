@@ -0,0 +1,85 @@
+import random
+import gymnasium as gym
+import numpy as np
+import pytest
+import openrct2_gym  # noqa: F401, registers OpenRCT2-v0
+from openrct2_gym.envs.sim_controller import SimController, piece_fits_after, piece_roll, piece_slope
+from openrct2_gym.envs.td6 import (CURVE_ELEMENTS, STRAIGHT_ELEMENTS, decode_track, encode_track, load_td6,
+                                   read_td6, rle_decode, rle_encode, write_td6)
+from openrct2_gym.envs.track_builder import TRACK_PIECES
+
+
+def sim_track(seed, steps=200):
+    # The pieces of a track built from random pieces the simulation accepts, with some removed again
+    rng = random.Random(seed)
+    sim = SimController()
+    sim.start_new_rollercoaster()
+    for _ in range(steps):
+        if sim.pieces and rng.random() < 0.1:
+            sim.remove_piece()
+            continue
+        fitting = [action for action, piece in TRACK_PIECES.items() if sim.can_add_track_piece(piece[0])]
+        if not fitting or sim.is_loop_completed():
+            break
+        sim.add_track_piece(TRACK_PIECES[rng.choice(fitting)][0])
+    return [0] * sim.station_length + [piece[0] for piece in sim.pieces]
+
+
+def test_every_straight_piece_that_fits_has_an_element():
+    for action, piece in TRACK_PIECES.items():
+        if action in CURVE_ELEMENTS:
+            continue
+        for slope in range(-2, 3):
+            for roll in (-1, 0, 1):
+                key = (slope, piece_slope(piece[0]), roll, piece_roll(piece[0]))
+                assert piece_fits_after(action, slope, roll) == (key in STRAIGHT_ELEMENTS), (piece[0], slope, roll)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_sim_tracks_round_trip(seed):
+    track_pieces = sim_track(seed)
+    assert read_td6(write_td6(track_pieces)) == track_pieces
+
+
+def test_banked_track_round_trips():
+    # Bank left, turn on the bank, level out and climb with a chain lift
+    track_pieces = [0] * 6 + [13, 11, 11, 13, 0, 14, 12, 14, 6, 15, 15, 17, 17, 6, 0]
+    assert decode_track(encode_track(track_pieces)) == track_pieces
+
+
+def test_pieces_that_cant_follow_fail_clearly():
+    with pytest.raises(ValueError, match="straight_level_rightroll can't follow track with slope 0 and roll -1"):
+        encode_track([0] * 6 + [13, 14])
+    with pytest.raises(ValueError, match="left_level_noroll can't follow"):
+        encode_track([0] * 6 + [13, 1])
+    with pytest.raises(ValueError, match="Unknown action"):
+        encode_track([0] * 6 + [18])
+
+
+def test_corrupted_design_is_rejected():
+    data = bytearray(write_td6(sim_track(0)))
+    data[10] ^= 0xFF
+    with pytest.raises(ValueError, match="checksum"):
+        read_td6(bytes(data))
+
+
+def test_rle_round_trip():
+    data = bytes([0] * 300 + list(range(256)) + [7, 7, 1, 1, 1])
+    assert rle_decode(rle_encode(data)) == data
+
+
+def test_env_saves_its_track(tmp_path):
+    env = gym.make('OpenRCT2-v0', backend='sim').unwrapped
+    env.reset(seed=0)
+    rng = np.random.default_rng(0)
+    for _ in range(60):
+        masks = env.action_masks()
+        masks[len(TRACK_PIECES):] = False  # No removals
+        if not masks.any():
+            break
+        _, _, terminated, truncated, _ = env.step(rng.choice(np.flatnonzero(masks)))
+        if terminated or truncated:
+            break
+    path = str(tmp_path / 'coaster.td6')
+    env.save_track_design(path)
+    assert load_td6(path) == env.track_pieces.tolist()
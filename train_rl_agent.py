@@ -1,13 +1,27 @@
 import gymnasium as gym
+import numpy as np
 import openrct2_gym
+from openrct2_gym.envs import SimVectorEnv
+from openrct2_gym.envs import compact_observation
+from openrct2_gym.envs.evaluation_queue import EvaluationQueue, backend_evaluator
+from openrct2_gym.envs.launcher import InstanceLauncher
+from openrct2_gym.envs.logs import configure_logging, get_logger, log_event
+from openrct2_gym.envs.socket_backend import SocketBackend
 from stable_baselines3 import PPO
-from stable_baselines3.common.vec_env import DummyVecEnv
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecEnv, VecMonitor
+from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper
+from stable_baselines3.common.vec_env.subproc_vec_env import _worker
 from stable_baselines3.common.evaluation import evaluate_policy
 from stable_baselines3.common.callbacks import CheckpointCallback, EvalCallback
 from stable_baselines3.common.monitor import Monitor
 from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.torch_layers import BaseFeaturesExtractor
 import os
 import argparse
+import logging
+import multiprocessing
+import torch as th
+import torch.nn.functional as F
 
 class TensorboardCallback(BaseCallback):
     """
@@ -46,6 +60,7 @@ class ProgressCallback(BaseCallback):
     def __init__(self, verbose=0):
         super(ProgressCallback, self).__init__(verbose)
         self.episode_count = 0
+        self.log = get_logger('train')
 
     def _on_step(self) -> bool:
         if self.locals['dones'][0]:
@@ -55,34 +70,272 @@ class ProgressCallback(BaseCallback):
             # Check if the episode terminated (loop completed) or was truncated
             terminated = self.locals['infos'][0].get('terminal_observation') is not None
             
-            print(f"Episode: {self.episode_count}")
-            print(f"Total timesteps: {total_timesteps}")
-            print(f"Episode reward: {self.locals['rewards'][0]:.2f}")
-            print(f"Loop completed: {terminated}")
-            print("------")
+            log_event(self.log, logging.INFO, 'episode', episode=self.episode_count, timesteps=total_timesteps,
+                      reward=float(self.locals['rewards'][0]), loop_completed=terminated)
         return True
 
-def create_env():
-    env = gym.make('OpenRCT2-v0')
+class DeferredRatingCallback(BaseCallback):
+    """
+    Adds a reward for the ride rating to the last step of episodes whose ride was tested in the background.
+    """
+    def __init__(self, reward_scale=10.0, wait=None, verbose=0):
+        super(DeferredRatingCallback, self).__init__(verbose)
+        self.reward_scale = reward_scale
+        self.wait = wait  # Seconds to wait at the end of a rollout for a rating that is still being tested
+        self.steps = {}  # (env index, episode id) -> rollout buffer position of the episode's last step
+        self.relabelled = 0
+        self.late = 0
+
+    def _on_rollout_start(self):
+        # Episodes of earlier rollouts were already trained on, their ratings come too late
+        self.steps.clear()
+
+    def _on_step(self) -> bool:
+        # Called before the step is added to the rollout buffer, so it goes to the current position
+        for env_index, info in enumerate(self.locals['infos']):
+            if 'episode_id' in info:
+                self.steps[env_index, info['episode_id']] = self.model.rollout_buffer.pos
+        return True
+
+    def _on_rollout_end(self):
+        buffer = self.model.rollout_buffer
+        relabelled = 0
+        for env_index, results in enumerate(self.training_env.env_method('poll_ratings', self.wait)):
+            for episode_id, ride_rating in results:
+                position = self.steps.pop((env_index, episode_id), None)
+                if position is None:
+                    self.late += 1
+                elif ride_rating is not None:
+                    buffer.rewards[position, env_index] += self.reward_scale * ride_rating['excitement']
+                    relabelled += 1
+
+        # The returns and advantages were computed from the old rewards
+        if relabelled:
+            buffer.compute_returns_and_advantage(last_values=self.locals['values'], dones=self.locals['dones'])
+        self.relabelled += relabelled
+        self.logger.record('deferred_ratings/relabelled', self.relabelled)
+        self.logger.record('deferred_ratings/late', self.late)
+
+class HealthCheckCallback(BaseCallback):
+    """
+    Restarts dead game instances without waiting for them. Their environments are suspended while the
+    game starts, then reconnect to it and rebuild the coaster on the next reset. A worker process that
+    died is replaced by a new one, tried again on the next check if that fails.
+    """
+    def __init__(self, launcher, check_freq=100, verbose=0):
+        super(HealthCheckCallback, self).__init__(verbose)
+        self.launcher = launcher
+        self.check_freq = check_freq
+        self.restarts = 0
+        self.log = get_logger('train')
+
+    def _on_step(self) -> bool:
+        if self.n_calls % self.check_freq == 0:
+            self._check_workers()
+            restarted = self.launcher.check_health()
+            if restarted:
+                self.training_env.env_method('suspend_backend', indices=restarted)
+                self.restarts += len(restarted)
+            ready = self.launcher.ready_instances()
+            if ready:
+                self.training_env.env_method('resume_backend', indices=ready)
+            self.logger.record('instances/restarts', self.restarts)
+            self.logger.record('instances/restarting', len(self.launcher.restarting))
+        return True
+
+    def _check_workers(self):
+        # A worker process that died takes its environment with it, a new one takes its place
+        venv = self.training_env
+        while not hasattr(venv, 'restart_worker') and hasattr(venv, 'venv'):
+            venv = venv.venv
+        if not hasattr(venv, 'restart_worker'):
+            return
+        for index, process in enumerate(venv.processes):
+            if process.is_alive():
+                continue
+            log_event(self.log, logging.ERROR, 'worker_died', worker=index, exitcode=process.exitcode)
+            try:
+                venv.restart_worker(index)
+            except (EOFError, OSError) as e:
+                log_event(self.log, logging.ERROR, 'worker_restart_failed', worker=index, error=str(e))
+                continue
+            if index in self.launcher.restarting:
+                self.training_env.env_method('suspend_backend', indices=[index])
+
+class RestartingSubprocVecEnv(SubprocVecEnv):
+    """
+    SubprocVecEnv that can replace a dead worker process by a new one made with the same environment factory.
+    """
+    def __init__(self, env_fns):
+        self.env_fns = env_fns
+        forkserver_available = 'forkserver' in multiprocessing.get_all_start_methods()
+        self.start_method = 'forkserver' if forkserver_available else 'spawn'
+        super(RestartingSubprocVecEnv, self).__init__(env_fns, self.start_method)
+        self.remotes = list(self.remotes)
+
+    def restart_worker(self, index):
+        # The new environment is reset here, the step after that still uses the last observation
+        # of the dead one
+        ctx = multiprocessing.get_context(self.start_method)
+        remote, work_remote = ctx.Pipe()
+        process = ctx.Process(target=_worker, args=(work_remote, remote, CloudpickleWrapper(self.env_fns[index])),
+                              daemon=True)
+        process.start()
+        work_remote.close()
+        self.remotes[index].close()
+        self.remotes[index] = remote
+        self.processes[index] = process
+        remote.send(('reset', (None, {})))
+        remote.recv()
+
+class CompactObservationExtractor(BaseFeaturesExtractor):
+    """
+    Decodes compact observations into the features MultiInputPolicy makes of the dict observations:
+    the pieces, position and distance as numbers, the direction, track length and last piece one-hot.
+    With `pieces_to_close` the observations end with the pieces to close the loop, also a number.
+    """
+    def __init__(self, observation_space, pieces_to_close=False):
+        self.pieces_to_close = pieces_to_close
+        self.max_track_length = observation_space.shape[0] - compact_observation.EXTRA_BYTES - int(pieces_to_close)
+        n = self.max_track_length
+        features_dim = n + 3 + 4 + 1 + (n + 1) + 19 + int(pieces_to_close)
+        super(CompactObservationExtractor, self).__init__(observation_space, features_dim=features_dim)
+
+    def forward(self, observations):
+        # Stable Baselines3 hands the uint8 values over as floats
+        n = self.max_track_length
+        extra = observations[:, n:]
+        low, high = extra[:, :compact_observation.DIRECTION:2], extra[:, 1:compact_observation.DIRECTION:2]
+        position = low + 256 * high
+        position = th.where(position >= 2 ** 15, position - 2 ** 16, position)
+        distance = extra[:, compact_observation.DISTANCE] + 256 * extra[:, compact_observation.DISTANCE + 1]
+        features = [
+            observations[:, :n],
+            position,
+            F.one_hot(extra[:, compact_observation.DIRECTION].long(), 4).float(),
+            (distance / compact_observation.DISTANCE_SCALE)[:, None],
+            F.one_hot(extra[:, compact_observation.TRACK_LENGTH].long(), n + 1).float(),
+            F.one_hot(extra[:, compact_observation.LAST_PIECE_TYPE].long(), 19).float(),
+        ]
+        if self.pieces_to_close:
+            features.append(extra[:, compact_observation.PIECES_TO_CLOSE:])
+        return th.cat(features, dim=1)
+
+class SimVecEnvAdapter(VecEnv):
+    """
+    Exposes the batched SimVectorEnv through the Stable Baselines3 VecEnv interface.
+    """
+    def __init__(self, venv):
+        self.venv = venv
+        super(SimVecEnvAdapter, self).__init__(venv.num_envs, venv.single_observation_space, venv.single_action_space)
+        self.actions = None
+
+    def reset(self):
+        observation, _ = self.venv.reset(seed=self._seeds[0])
+        self._reset_seeds()
+        return observation
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        observation, rewards, terminations, truncations, infos = self.venv.step(self.actions)
+        dones = terminations | truncations
+        env_infos = [{} for _ in range(self.num_envs)]
+        for i in np.flatnonzero(dones):
+            env_infos[i]['terminal_observation'] = infos['final_obs'][i]
+            env_infos[i]['TimeLimit.truncated'] = bool(truncations[i] and not terminations[i])
+        return observation, rewards.astype(np.float32), dones, env_infos
+
+    def close(self):
+        self.venv.close()
+
+    def get_attr(self, attr_name, indices=None):
+        # Per environment state is stored as arrays on the batched env, anything else is shared
+        value = getattr(self.venv, attr_name)
+        if isinstance(value, np.ndarray):
+            return [value[i] for i in self._get_indices(indices)]
+        return [value for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        getattr(self.venv, attr_name)[list(self._get_indices(indices))] = value
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        # Methods of the batched env return one row per environment, like action_masks
+        result = getattr(self.venv, method_name)(*method_args, **method_kwargs)
+        return [result[i] for i in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
+
+def parse_address(address):
+    # 'host:port' -> (host, port)
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+def create_env(backend='ui', num_envs=1, evaluation_address=None, launcher=None, log_level=None, log_dir='logs',
+               compact=False, distance_field=None, socket_address='localhost:7777'):
+    # The ratings are tested on one game instance and collected by a single environment
+    if evaluation_address and (launcher is not None or num_envs > 1):
+        raise ValueError("--evaluation-address only works with a single environment, not with --num-envs or --instances")
+
+    # Every game instance of the launcher gets its own worker process, which sets up its own logging
+    if launcher is not None:
+        env_kwargs = {'log_level': log_level, 'log_dir': log_dir, 'compact_observations': compact,
+                      'distance_field': distance_field}
+        return VecMonitor(RestartingSubprocVecEnv(launcher.env_fns(backend, env_kwargs)))
+
+    if num_envs > 1:
+        if backend != 'sim':
+            raise ValueError("Only the sim backend can run more than one environment")
+        return VecMonitor(SimVecEnvAdapter(SimVectorEnv(num_envs, compact_observations=compact,
+                                                        distance_field=distance_field)))
+
+    # Completed rides can be tested on a second game instance while training goes on
+    env_kwargs = {'compact_observations': compact, 'distance_field': distance_field}
+    if evaluation_address:
+        env_kwargs['evaluation_queue'] = EvaluationQueue([backend_evaluator(SocketBackend(parse_address(evaluation_address)))])
+    if backend == 'socket':
+        env_kwargs['backend_kwargs'] = {'address': parse_address(socket_address)}
+
+    env = gym.make('OpenRCT2-v0', backend=backend, **env_kwargs)
     env = Monitor(env)  # Wrap the environment
     return DummyVecEnv([lambda: env])
 
-def train_agent(total_timesteps, checkpoint_freq, eval_freq, model_path=None):
-    env = create_env()
+def get_algorithm(masked=False):
+    # MaskablePPO only samples the actions allowed by the env's action_masks()
+    if masked:
+        from sb3_contrib import MaskablePPO
+        from sb3_contrib.common.maskable.callbacks import MaskableEvalCallback
+        return MaskablePPO, MaskableEvalCallback
+    return PPO, EvalCallback
+
+def train_agent(total_timesteps, checkpoint_freq, eval_freq, model_path=None, backend='ui', num_envs=1, masked=False,
+                evaluation_address=None, rating_reward_scale=10.0, launcher=None, log_level=None, log_dir='logs',
+                compact=False, distance_field=None, socket_address='localhost:7777'):
+    env = create_env(backend, num_envs, evaluation_address, launcher, log_level, log_dir, compact, distance_field,
+                     socket_address)
+    algorithm, eval_callback_class = get_algorithm(masked)
 
     if model_path and os.path.exists(model_path):
         print(f"Loading model from {model_path}")
-        model = PPO.load(model_path, env=env)
+        model = algorithm.load(model_path, env=env)
     else:
         print("Creating new model")
         policy_kwargs = dict(
             net_arch=dict(pi=[256, 256], vf=[256, 256]),
         )
-        model = PPO("MultiInputPolicy", env, policy_kwargs=policy_kwargs, verbose=1, tensorboard_log="./ppo_openrct2_tensorboard/")
+        policy = "MultiInputPolicy"
+        if compact:
+            # One uint8 array per observation, decoded by the extractor on the model's device
+            policy = "MlpPolicy"
+            policy_kwargs['features_extractor_class'] = CompactObservationExtractor
+            policy_kwargs['features_extractor_kwargs'] = dict(pieces_to_close=distance_field is not None)
+        model = algorithm(policy, env, policy_kwargs=policy_kwargs, verbose=1, tensorboard_log="./ppo_openrct2_tensorboard/")
 
     # Callbacks
     checkpoint_callback = CheckpointCallback(save_freq=checkpoint_freq, save_path='./logs/', name_prefix='ppo_openrct2_model')
-    eval_callback = EvalCallback(env, best_model_save_path='./logs/best_model', log_path='./logs/', eval_freq=eval_freq)
+    eval_callback = eval_callback_class(env, best_model_save_path='./logs/best_model', log_path='./logs/', eval_freq=eval_freq)
     tensorboard_callback = TensorboardCallback()
     progress_callback = ProgressCallback()
 
@@ -97,7 +350,7 @@ def train_agent(total_timesteps, checkpoint_freq, eval_freq, model_path=None):
         name_prefix="ppo_openrct2_model"
     )
     
-    eval_callback = EvalCallback(
+    eval_callback = eval_callback_class(
         env,
         best_model_save_path=log_dir,
         log_path=log_dir,
@@ -106,10 +359,16 @@ def train_agent(total_timesteps, checkpoint_freq, eval_freq, model_path=None):
         render=False
     )
 
+    callbacks = [checkpoint_callback, eval_callback, tensorboard_callback, progress_callback]
+    if evaluation_address:
+        callbacks.append(DeferredRatingCallback(rating_reward_scale))
+    if launcher is not None:
+        callbacks.append(HealthCheckCallback(launcher))
+
     try:
         model.learn(
             total_timesteps=total_timesteps,
-            callback=[checkpoint_callback, eval_callback, tensorboard_callback, progress_callback],
+            callback=callbacks,
             reset_num_timesteps=False  # Important for continuing training
         )
     except Exception as e:
@@ -122,8 +381,12 @@ def train_agent(total_timesteps, checkpoint_freq, eval_freq, model_path=None):
 
     return model, env
 
-def evaluate_agent(model, env):
-    mean_reward, std_reward = evaluate_policy(model, env, n_eval_episodes=10)
+def evaluate_agent(model, env, masked=False):
+    if masked:
+        from sb3_contrib.common.maskable.evaluation import evaluate_policy as evaluate_masked_policy
+        mean_reward, std_reward = evaluate_masked_policy(model, env, n_eval_episodes=10)
+    else:
+        mean_reward, std_reward = evaluate_policy(model, env, n_eval_episodes=10)
     print(f"Mean reward: {mean_reward:.2f} +/- {std_reward:.2f}")
 
 def main():
@@ -132,12 +395,41 @@ def main():
     parser.add_argument("--checkpoint-freq", type=int, default=10000, help="Frequency of checkpoints")
     parser.add_argument("--eval-freq", type=int, default=10000, help="Frequency of evaluations")
     parser.add_argument("--model-path", type=str, help="Path to a saved model to continue training")
+    parser.add_argument("--backend", type=str, default="ui", choices=["ui", "sim", "fake_ui", "socket"], help="Play the real game through the UI, a simulation, the UI on a fake screen or a game plugin over a socket")
+    parser.add_argument("--socket-address", type=str, default="localhost:7777", help="host:port of the game plugin for the socket backend")
+    parser.add_argument("--num-envs", type=int, default=1, help="Number of environments stepped in parallel (sim backend only)")
+    parser.add_argument("--masked", action="store_true", help="Train with MaskablePPO (needs sb3-contrib) so known invalid pieces are never tried")
+    parser.add_argument("--evaluation-address", type=str, help="host:port of a second game plugin that tests completed rides in the background")
+    parser.add_argument("--rating-reward-scale", type=float, default=10.0, help="Reward per point of excitement of background tested rides")
+    parser.add_argument("--instances", type=int, default=0, help="Start this many games, each on its own Xvfb display, and train on all of them")
+    parser.add_argument("--game-command", type=str, default="openrct2", help="Command that starts a game in the track designer")
+    parser.add_argument("--first-display", type=int, default=99, help="X display number of the first game instance")
+    parser.add_argument("--mock-display", action="store_true", help="Start placeholder instances that train on the simulation instead of games")
+    parser.add_argument("--log-level", type=str, choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="Log events of this level and above as JSON lines, nothing is logged without it")
+    parser.add_argument("--log-dir", type=str, default="logs", help="Directory of the JSON lines logs, one file per environment")
+    parser.add_argument("--compact", action="store_true", help="Use compact uint8 observations, about a quarter of the rollout buffer memory")
+    parser.add_argument("--distance-field", type=str, help="File of the pieces-to-close table (built when missing), used for the reward, truncation and observations")
     args = parser.parse_args()
+    if args.evaluation_address and (args.instances or args.num_envs > 1):
+        parser.error("--evaluation-address can't be combined with --num-envs or --instances")
 
-    model, env = train_agent(args.timesteps, args.checkpoint_freq, args.eval_freq, args.model_path)
-    evaluate_agent(model, env)
+    if args.log_level:
+        configure_logging(args.log_level, args.log_dir)
 
-    env.close()
+    launcher = None
+    if args.instances:
+        launcher = InstanceLauncher(args.instances, args.game_command.split(), args.first_display, mock=args.mock_display)
+        launcher.start()
+
+    try:
+        model, env = train_agent(args.timesteps, args.checkpoint_freq, args.eval_freq, args.model_path, args.backend, args.num_envs, args.masked,
+                                 args.evaluation_address, args.rating_reward_scale, launcher, args.log_level, args.log_dir,
+                                 args.compact, args.distance_field, args.socket_address)
+        evaluate_agent(model, env, args.masked)
+        env.close()
+    finally:
+        if launcher is not None:
+            launcher.close()
 
 if __name__ == "__main__":
     main()